@@ -1,13 +1,116 @@
+import argparse
 import socket
+import threading
+import time
 
-def tcp_client():
+def tcp_client(host='localhost', port=8080):
     client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client.connect(('localhost', 8080))
+    client.connect((host, port))
     client.sendall(b"Hello, server!")
     response = client.recv(1024)
     print(f"Received response data: {response}")
     print(f"Decoded response data: {response.decode()}")
     client.close()
 
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[index]
+
+def measure_latency(host, port, count=10000, size=64):
+    """Round-trip times in seconds of count size-byte pings, sorted
+
+    Needs a server in streaming mode (chat_server.py --stream).
+    """
+    client = socket.create_connection((host, port))
+    client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    payload = b"x" * size
+    buf = bytearray(size)
+    view = memoryview(buf)
+    rtts = []
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            client.sendall(payload)
+            received = 0
+            while received < size:
+                n = client.recv_into(view[received:])
+                if not n:
+                    raise ConnectionError("Server closed the connection")
+                received += n
+            rtts.append(time.perf_counter() - start)
+    finally:
+        client.close()
+    rtts.sort()
+    return rtts
+
+def stream_one(host, port, total, chunk_size, results, i):
+    """Send total bytes while reading the echo back; results[i] = bytes echoed"""
+    client = socket.create_connection((host, port))
+    chunk = memoryview(b"x" * chunk_size)
+
+    def send():
+        remaining = total
+        while remaining > 0:
+            n = min(remaining, chunk_size)
+            client.sendall(chunk[:n])
+            remaining -= n
+        client.shutdown(socket.SHUT_WR)
+
+    sender = threading.Thread(target=send, daemon=True)
+    sender.start()
+    buf = bytearray(chunk_size)
+    received = 0
+    try:
+        while True:
+            n = client.recv_into(buf)
+            if not n:
+                break
+            received += n
+    finally:
+        sender.join()
+        client.close()
+    results[i] = received
+
+def measure_throughput(host, port, total=1 << 30, chunk_size=256 * 1024, connections=1):
+    """Echo total bytes spread over connections; (bytes echoed, seconds)"""
+    results = [0] * connections
+    share = total // connections
+    threads = [
+        threading.Thread(target=stream_one, args=(host, port, share, chunk_size, results, i))
+        for i in range(connections)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(results), time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TCP echo client")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--bench', action='store_true',
+                        help="measure round-trip latency and GB/s against chat_server.py --stream")
+    parser.add_argument('--count', type=int, default=10000, help="pings for the latency test")
+    parser.add_argument('--size', type=int, default=64, help="bytes per ping")
+    parser.add_argument('--bytes', type=int, default=1 << 30, help="bytes to stream in total")
+    parser.add_argument('--chunk-size', type=int, default=256 * 1024)
+    parser.add_argument('--connections', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if not args.bench:
+        tcp_client(args.host, args.port)
+        return
+    rtts = measure_latency(args.host, args.port, args.count, args.size)
+    print(f"Round trip ({args.size} bytes, {args.count} pings): "
+          f"p50 {percentile(rtts, 50) * 1e6:.1f} us, p99 {percentile(rtts, 99) * 1e6:.1f} us, "
+          f"max {rtts[-1] * 1e6:.1f} us")
+    echoed, elapsed = measure_throughput(args.host, args.port, args.bytes, args.chunk_size,
+                                         args.connections)
+    print(f"Throughput ({args.connections} connections): {echoed / elapsed / 1e9:.2f} GB/s "
+          f"({echoed} bytes echoed in {elapsed:.2f}s)")
+
+
 if __name__ == "__main__":
-    tcp_client()
+    main()
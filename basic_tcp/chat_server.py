@@ -1,27 +1,68 @@
+import argparse
 import socket
+import threading
 
-def tcp_server():
+BUFFER_SIZE = 256 * 1024  # bytes per recv_into() in streaming mode
+
+def echo_once(conn, addr):
+    """Echo one message back with an "Echo: " prefix, then close"""
+    print(f"Connection object: {conn}")
+    print(f"New connection from {addr}")
+    data = conn.recv(1024)
+    print(f"Received data: {data}")
+    print(f"Decoded data: {data.decode()}")
+    conn.sendall(b"Echo: " + data)
+    conn.close()
+
+def echo_stream(conn, buffer_size=BUFFER_SIZE):
+    """Echo everything back unchanged until the client closes
+
+    Every read lands in the same buffer and is sent from a memoryview
+    slice of it, so nothing is allocated per chunk.
+    """
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    try:
+        while True:
+            n = conn.recv_into(buf)
+            if not n:
+                break
+            conn.sendall(view[:n])
+    except OSError:
+        pass
+    finally:
+        conn.close()
+
+def tcp_server(port=8080, host='0.0.0.0', stream=False, buffer_size=BUFFER_SIZE):
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server.bind(('0.0.0.0', 8080))
+    server.bind((host, port))
     server.listen(128)
 
-    print("Chat server listening on port 8080")
+    print(f"Chat server listening on port {port}" + (" (streaming echo)" if stream else ""))
 
     try:
         while True:
             conn, addr = server.accept()
-            print(f"Connection object: {conn}")
-            print(f"New connection from {addr}")
-            data = conn.recv(1024)
-            print(f"Received data: {data}")
-            print(f"Decoded data: {data.decode()}")
-            conn.sendall(b"Echo: " + data)
-            conn.close()
+            if stream:
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                threading.Thread(target=echo_stream, args=(conn, buffer_size), daemon=True).start()
+            else:
+                echo_once(conn, addr)
     except KeyboardInterrupt:
         print("Shutting down...")
         server.close()
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TCP echo server")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--stream', action='store_true',
+                        help="keep connections open and echo continuously, one thread per client")
+    parser.add_argument('--buffer-size', type=int, default=BUFFER_SIZE)
+    args = parser.parse_args(argv)
+    tcp_server(args.port, args.host, args.stream, args.buffer_size)
+
 
 if __name__ == "__main__":
-    tcp_server()
+    main()
@@ -3,6 +3,7 @@ import threading
 import time
 import pytest
 from chat_server import tcp_server
+from chat_client import measure_latency, measure_throughput
 
 
 @pytest.fixture
@@ -213,3 +214,56 @@ class TestClientBehavior:
         assert response == expected
 
         client.close()
+
+
+@pytest.fixture
+def streaming_server():
+    def start_server(port):
+        thread = threading.Thread(
+            target=tcp_server,
+            kwargs={'port': port, 'host': '127.0.0.1', 'stream': True, 'buffer_size': 4096},
+            daemon=True
+        )
+        thread.start()
+        time.sleep(0.2)
+        return port
+
+    return start_server
+
+
+class TestStreamingEcho:
+
+    def test_connection_stays_open(self, streaming_server):
+        port = streaming_server(9091)
+
+        client = socket.create_connection(('127.0.0.1', port))
+        client.settimeout(2)
+        for msg in (b"first", b"second", b"third"):
+            client.sendall(msg)
+            assert client.recv(1024) == msg
+
+        client.close()
+
+    def test_concurrent_clients_get_their_own_bytes(self, streaming_server):
+        port = streaming_server(9092)
+        clients = [socket.create_connection(('127.0.0.1', port)) for _ in range(5)]
+
+        for i, client in enumerate(clients):
+            client.settimeout(2)
+            client.sendall(f"client {i}".encode())
+        for i, client in enumerate(clients):
+            assert client.recv(1024) == f"client {i}".encode()
+
+        for client in clients:
+            client.close()
+
+    def test_bench_measures_latency_and_throughput(self, streaming_server):
+        port = streaming_server(9093)
+
+        rtts = measure_latency('127.0.0.1', port, count=100, size=64)
+        echoed, elapsed = measure_throughput('127.0.0.1', port, total=1 << 20,
+                                             chunk_size=8192, connections=2)
+
+        assert len(rtts) == 100 and rtts == sorted(rtts)
+        assert echoed == 1 << 20
+        assert elapsed > 0
@@ -0,0 +1,105 @@
+"""Micro-benchmark: allocations and CPU per broadcast as clients grow.
+
+Compares threaded_tcp.chat_server.broadcast (payload encoded once) with
+the old per-recipient f-string/decode/encode, and with clients split
+into small rooms. Outboxes are replaced by
+sinks that keep the last frame, as a real send queue would, so retained
+allocations show up in tracemalloc.
+
+    python benchmarks/bench_broadcast.py --clients 100 1000 5000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'threaded_tcp'))
+
+import chat_server  # noqa: E402
+
+
+class Sink:
+    def __init__(self):
+        self.frame = None
+
+    def put(self, frame):
+        self.frame = frame
+        return True
+
+
+def per_recipient_broadcast(message, sender_sock=None):
+    """The pre-change fan-out: one decode/format/encode per recipient"""
+    clients, sessions = chat_server.clients, chat_server.sessions
+    with chat_server.clients_lock:
+        for client_sock in clients:
+            if client_sock == sender_sock:
+                continue
+            sessions[client_sock].outbox.put(
+                f"[{clients[sender_sock] if sender_sock else 'Server'}] {message.decode()}\n".encode()
+            )
+
+def setup(n_clients, room_size=None):
+    chat_server.clients.clear()
+    chat_server.sessions.clear()
+    chat_server.rooms.clear()
+    socks = [object() for _ in range(n_clients)]
+    for i, sock in enumerate(socks):
+        session = chat_server.Session(sock, f"user{i}", Sink())
+        if room_size:
+            session.room = f"room{i // room_size}"
+        chat_server.clients[sock] = session.username
+        chat_server.sessions[sock] = session
+        chat_server.rooms.setdefault(session.room, {})[sock] = session
+    with chat_server.clients_lock:
+        chat_server.refresh_snapshot(*chat_server.rooms)
+    return socks[0]
+
+def clear_sinks():
+    for session in chat_server.sessions.values():
+        session.outbox.frame = None
+
+def measure(fn, n_clients, rounds, room_size=None):
+    sender = setup(n_clients, room_size)
+    message = b"hello everyone, how is it going?"
+
+    fn(message, sender_sock=sender)
+    clear_sinks()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    fn(message, sender_sock=sender)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    blocks = sum(s.count_diff for s in stats if s.count_diff > 0)
+    size = sum(s.size_diff for s in stats if s.size_diff > 0)
+
+    start = time.process_time()
+    for _ in range(rounds):
+        fn(message, sender_sock=sender)
+    cpu = (time.process_time() - start) / rounds
+    return blocks, size, cpu
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--room-size', type=int, default=10,
+                        help="room size for the rooms variant")
+    args = parser.parse_args(argv)
+
+    variants = [
+        ('per-recipient', per_recipient_broadcast, None),
+        ('encode-once', chat_server.broadcast, None),
+        (f'rooms-of-{args.room_size}', chat_server.broadcast, args.room_size),
+    ]
+    print(f"{'variant':<15}{'clients':>8}{'alloc blocks':>14}{'alloc KB':>10}{'CPU us':>10}")
+    for n_clients in args.clients:
+        for name, fn, room_size in variants:
+            blocks, size, cpu = measure(fn, n_clients, args.rounds, room_size)
+            print(f"{name:<15}{n_clients:>8}{blocks:>14}{size / 1024:>10.1f}{cpu * 1e6:>10.1f}")
+
+if __name__ == "__main__":
+    main()
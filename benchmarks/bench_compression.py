@@ -0,0 +1,77 @@
+"""Micro-benchmark: bandwidth saved vs CPU added by per-connection zlib.
+
+Builds a stream of chat lines the way broadcast() frames them ("[name]
+message\\n" from a few hundred users, words drawn from a skewed
+vocabulary) and pushes it through one connection's compressor the way
+an Outbox writer does: compress each coalesced batch, then sync-flush.
+Batch 1 is latency mode with a quiet room; larger batches are what a
+busy room or throughput mode coalesces per sendmsg().
+
+    python benchmarks/bench_compression.py --size 32 64 128 256 --batch 1 16
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'threaded_tcp'))
+
+from outbound import compress_batch, compressor  # noqa: E402
+
+
+def chat_lines(n, size, users=300, vocabulary=2000, seed=1):
+    """n text frames whose messages average about size bytes"""
+    rng = random.Random(seed)
+    words = [''.join(rng.choice('etaoinshrdlucmfwyp') for _ in range(rng.randint(2, 9)))
+             for _ in range(vocabulary)]
+    # Zipf-like: a few words and users account for most of the traffic
+    word_weights = [1 / (rank + 1) for rank in range(vocabulary)]
+    names = [f"user{i}" for i in range(users)]
+    name_weights = [1 / (rank + 1) ** 0.5 for rank in range(users)]
+    lines = []
+    for name in rng.choices(names, name_weights, k=n):
+        message = []
+        length = 0
+        while length < size:
+            word = rng.choices(words, word_weights)[0]
+            message.append(word)
+            length += len(word) + 1
+        lines.append(f"[{name}] {' '.join(message)}\n".encode())
+    return lines
+
+def run(lines, batch, level):
+    stream = compressor(level)
+    wire = 0
+    start = time.process_time()
+    for i in range(0, len(lines), batch):
+        wire += sum(map(len, compress_batch(stream, lines[i:i + batch])))
+    cpu = time.process_time() - start
+    raw = sum(map(len, lines))
+    return raw, wire, cpu
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--size', type=int, nargs='+', default=[32, 64, 128, 256])
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 16])
+    parser.add_argument('--level', type=int, nargs='+', default=[1, 6])
+    args = parser.parse_args(argv)
+
+    print(f"{'size':>6}{'batch':>7}{'level':>7}{'raw B/msg':>11}{'wire B/msg':>12}"
+          f"{'saved':>8}{'cpu us/msg':>12}{'us/KB saved':>13}")
+    for size in args.size:
+        lines = chat_lines(args.messages, size)
+        for batch in args.batch:
+            for level in args.level:
+                raw, wire, cpu = run(lines, batch, level)
+                n = len(lines)
+                saved = raw - wire
+                print(f"{size:>6}{batch:>7}{level:>7}{raw / n:>11.1f}{wire / n:>12.1f}"
+                      f"{saved / raw:>8.0%}{cpu / n * 1e6:>12.2f}"
+                      f"{cpu * 1e6 / (saved / 1024) if saved > 0 else float('nan'):>13.1f}")
+
+if __name__ == "__main__":
+    main()
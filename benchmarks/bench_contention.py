@@ -0,0 +1,114 @@
+"""Micro-benchmark: clients_lock contention with many concurrent senders.
+
+Registers N in-process clients whose outboxes are sinks, then runs S
+sender threads calling chat_server.broadcast() in a loop while one
+churn thread keeps moving a client between rooms (a membership change
+on every iteration). Reports broadcasts/s and the clients_lock wait and
+hold histograms that chat_server records.
+
+    python benchmarks/bench_contention.py --clients 1000 --senders 16 32
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'threaded_tcp'))
+
+import chat_server  # noqa: E402
+import metrics  # noqa: E402
+
+
+class Sink:
+    def __init__(self):
+        self.frame = None
+
+    def put(self, frame):
+        self.frame = frame
+        return True
+
+    def close(self):
+        pass
+
+
+def setup(n_clients):
+    with chat_server.clients_lock:
+        chat_server.clients.clear()
+        chat_server.sessions.clear()
+        chat_server.rooms.clear()
+        chat_server.rooms[chat_server.LOBBY] = {}
+    socks = [object() for _ in range(n_clients)]
+    for i, sock in enumerate(socks):
+        session = chat_server.Session(sock, f"user{i}", Sink())
+        with chat_server.clients_lock:
+            chat_server.clients[sock] = session.username
+            chat_server.sessions[sock] = session
+            chat_server.rooms[chat_server.LOBBY][sock] = session
+            chat_server.refresh_snapshot(chat_server.LOBBY)
+    return socks
+
+def reset_histograms():
+    for name in ('clients_lock_wait_seconds', 'clients_lock_hold_seconds', 'fanout_seconds'):
+        metrics.histograms[name].__init__()
+
+def run(n_clients, n_senders, duration):
+    socks = setup(n_clients)
+    stop = threading.Event()
+    counts = [0] * n_senders
+    message = b"hello everyone, how is it going?"
+
+    def sender(i):
+        sock = socks[i]
+        while not stop.is_set():
+            chat_server.broadcast(message, sender_sock=sock)
+            counts[i] += 1
+
+    def churn():
+        session = chat_server.sessions[socks[-1]]
+        while not stop.is_set():
+            chat_server.move_to_room(session, 'side')
+            chat_server.move_to_room(session, chat_server.LOBBY)
+
+    threads = [threading.Thread(target=sender, args=(i,)) for i in range(n_senders)]
+    threads.append(threading.Thread(target=churn))
+    reset_histograms()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    wait = metrics.histograms['clients_lock_wait_seconds']
+    hold = metrics.histograms['clients_lock_hold_seconds']
+    return {
+        'broadcasts_per_sec': sum(counts) / elapsed,
+        'lock_acquisitions': wait.count,
+        'wait_p50_us': wait.percentile(50) * 1e6,
+        'wait_p99_us': wait.percentile(99) * 1e6,
+        'hold_p99_us': hold.percentile(99) * 1e6,
+        'wait_total_s': wait.sum,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--senders', type=int, nargs='+', default=[16, 32])
+    parser.add_argument('--duration', type=float, default=3.0)
+    args = parser.parse_args(argv)
+
+    print(f"{'senders':>8}{'bcast/s':>10}{'lock acq':>10}{'wait p50 us':>13}"
+          f"{'wait p99 us':>13}{'hold p99 us':>13}{'wait total s':>14}")
+    for n_senders in args.senders:
+        r = run(args.clients, n_senders, args.duration)
+        print(f"{n_senders:>8}{r['broadcasts_per_sec']:>10.0f}{r['lock_acquisitions']:>10}"
+              f"{r['wait_p50_us']:>13.0f}{r['wait_p99_us']:>13.0f}{r['hold_p99_us']:>13.0f}"
+              f"{r['wait_total_s']:>14.2f}")
+
+if __name__ == "__main__":
+    main()
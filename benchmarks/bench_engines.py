@@ -0,0 +1,177 @@
+"""Compare the chat server engines.
+
+Starts each engine (threaded_tcp --engine threaded/asyncio, or the
+selectors_tcp server) in a subprocess, connects N clients, and reports
+server memory per connection and broadcast throughput. Memory is
+sampled twice: right after the join notices (every join is broadcast,
+so N clients cost O(N^2) notices) and again once the broadcasts have
+been delivered and the server has sat idle for --settle seconds.
+
+With --idle, clients stay at the name prompt, so nobody joins and
+nothing is broadcast; only the settled memory of N idle connections
+is reported.
+
+    python benchmarks/bench_engines.py --clients 1000 5000 10000
+    python benchmarks/bench_engines.py --idle --clients 10000 --engines selectors
+"""
+import argparse
+import asyncio
+import time
+
+
+from loadgen import ENGINES, rss_kb, start_server, thread_count
+
+
+class Client:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.lines = 0
+
+    async def drain_forever(self):
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    return
+                self.lines += data.count(b"\n")
+        except (ConnectionError, asyncio.CancelledError):
+            return
+
+
+async def connect_client(port, username, gate):
+    """A Client logged in as username, or left at the name prompt if None"""
+    async with gate:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        await reader.readexactly(len(b"Enter your name: "))
+        if username is not None:
+            writer.write(f"{username}\n".encode())
+            await writer.drain()
+        return Client(reader, writer)
+
+async def wait_for(predicate, timeout):
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            return False
+        await asyncio.sleep(0.01)
+    return True
+
+async def run_idle(port, pid, n_clients, concurrency, settle):
+    gate = asyncio.Semaphore(concurrency)
+    base_rss = rss_kb(pid)
+
+    start = time.perf_counter()
+    clients = await asyncio.gather(*(
+        connect_client(port, None, gate) for i in range(n_clients)
+    ))
+    connect_secs = time.perf_counter() - start
+    await asyncio.sleep(settle)
+    idle_rss = rss_kb(pid)
+    threads = thread_count(pid)
+    for c in clients:
+        c.writer.close()
+
+    return {
+        'clients': n_clients,
+        'connect_secs': round(connect_secs, 2),
+        'server_threads': threads,
+        'rss_kb_per_conn': None,
+        'idle_rss_kb_per_conn': round((idle_rss - base_rss) / n_clients, 1),
+        'msgs_per_sec': None,
+        'deliveries_per_sec': None,
+    }
+
+async def run_clients(port, pid, n_clients, n_messages, concurrency, timeout, settle):
+    gate = asyncio.Semaphore(concurrency)
+    base_rss = rss_kb(pid)
+
+    start = time.perf_counter()
+    clients = await asyncio.gather(*(
+        connect_client(port, f"user{i}", gate) for i in range(n_clients)
+    ))
+    tasks = [asyncio.create_task(c.drain_forever()) for c in clients]
+    # Client i sees its own join notice and every later one.
+    expected_joins = n_clients * (n_clients + 1) // 2
+    await wait_for(lambda: sum(c.lines for c in clients) >= expected_joins, timeout)
+    connect_secs = time.perf_counter() - start
+
+    await asyncio.sleep(0.5)
+    conn_rss = rss_kb(pid)
+    threads = thread_count(pid)
+
+    for c in clients:
+        c.lines = 0
+    sender = clients[0]
+    payload = b"x" * 32 + b"\n"
+    expected = n_messages * (n_clients - 1)
+    start = time.perf_counter()
+    # Both engines frame by line, so each payload is one broadcast line
+    # at every recipient however TCP splits or coalesces the bytes.
+    for _ in range(n_messages):
+        sender.writer.write(payload)
+    await sender.writer.drain()
+    delivered = await wait_for(lambda: sum(c.lines for c in clients) >= expected, timeout)
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(settle)
+    idle_rss = rss_kb(pid)
+
+    for t in tasks:
+        t.cancel()
+    for c in clients:
+        c.writer.close()
+
+    return {
+        'clients': n_clients,
+        'connect_secs': round(connect_secs, 2),
+        'server_threads': threads,
+        'rss_kb_per_conn': round((conn_rss - base_rss) / n_clients, 1),
+        'idle_rss_kb_per_conn': round((idle_rss - base_rss) / n_clients, 1),
+        'msgs_per_sec': round(n_messages / elapsed, 1) if delivered else None,
+        'deliveries_per_sec': round(expected / elapsed) if delivered else None,
+    }
+
+def bench(engine, n_clients, port, args):
+    if args.idle:
+        # Idle clients never send a name; keep the server from timing them out
+        server = start_server(engine, port, ['--handshake-timeout', '3600'])
+        run = run_idle(port, server.pid, n_clients, args.concurrency, args.settle)
+    else:
+        server = start_server(engine, port)
+        run = run_clients(port, server.pid, n_clients, args.messages, args.concurrency,
+                          args.timeout, args.settle)
+    try:
+        result = asyncio.run(run)
+    finally:
+        server.terminate()
+        server.wait()
+    result['engine'] = engine
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, nargs='+', default=[1000, 5000, 10000])
+    parser.add_argument('--engines', nargs='+', choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--timeout', type=float, default=300.0)
+    parser.add_argument('--port', type=int, default=9500)
+    parser.add_argument('--settle', type=float, default=5.0,
+                        help="idle seconds before the second memory sample")
+    parser.add_argument('--idle', action='store_true',
+                        help="leave clients at the name prompt: no joins, no broadcasts")
+    args = parser.parse_args(argv)
+
+    print(f"{'engine':<10}{'clients':>8}{'threads':>9}{'KB/conn':>9}{'idle KB':>9}"
+          f"{'connect s':>11}{'msgs/s':>9}{'deliv/s':>10}")
+    port = args.port
+    for n_clients in args.clients:
+        for engine in args.engines:
+            r = bench(engine, n_clients, port, args)
+            port += 1
+            print(f"{r['engine']:<10}{r['clients']:>8}{r['server_threads']:>9}"
+                  f"{str(r['rss_kb_per_conn']):>9}{r['idle_rss_kb_per_conn']:>9}{r['connect_secs']:>11}"
+                  f"{str(r['msgs_per_sec']):>9}{str(r['deliveries_per_sec']):>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Micro-benchmark: broadcast latency with and without the journal.
+
+Paces chat_server.broadcast at a fixed rate (50k msgs/s by default)
+into rooms of sink outboxes, as bench_broadcast.py does, and reports
+per-call wall-clock percentiles. With the journal, its writer thread
+encodes, writes and fsyncs in the background the whole time, so any
+cost it adds to the broadcast path, GIL contention included, shows up.
+
+    python benchmarks/bench_journal.py --rate 50000 --seconds 3
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'threaded_tcp'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import chat_server  # noqa: E402
+import journal  # noqa: E402
+from bench_broadcast import setup  # noqa: E402
+
+
+def run(rate, seconds, clients, room_size):
+    sender = setup(clients, room_size)
+    message = b"hello everyone, how is it going?"
+    n = int(rate * seconds)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(n):
+        due = start + i / rate
+        while time.perf_counter() < due:
+            pass
+        t = time.perf_counter()
+        chat_server.broadcast(message, sender_sock=sender)
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return n / elapsed, [latencies[int(len(latencies) * q)] for q in (0.5, 0.99, 0.999)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=int, default=50000, help="broadcasts per second")
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--room-size', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    print(f"{'journal':<10}{'msgs/s':>10}{'p50 us':>9}{'p99 us':>9}{'p99.9 us':>10}{'fsyncs':>8}")
+    for journaling in (False, True):
+        directory = tempfile.mkdtemp(prefix='chat-journal-')
+        chat_server.journal = journal.Journal(directory).start() if journaling else None
+        fsyncs = journal.journal_fsyncs.value
+        rate, (p50, p99, p999) = run(args.rate, args.seconds, args.clients, args.room_size)
+        if chat_server.journal:
+            chat_server.journal.close()
+        print(f"{'on' if journaling else 'off':<10}{rate:>10.0f}{p50 * 1e6:>9.1f}{p99 * 1e6:>9.1f}"
+              f"{p999 * 1e6:>10.1f}{journal.journal_fsyncs.value - fsyncs:>8}")
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
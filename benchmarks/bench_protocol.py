@@ -0,0 +1,85 @@
+"""Micro-benchmark: parse and serialize cost, text lines vs binary packets.
+
+Parsing walks an in-memory buffer of N client messages the way
+FrameReader does (newline search + decode for text, header unpack +
+slice for binary). Serializing builds the outbound frame for each
+message the way broadcast() does.
+
+    python benchmarks/bench_protocol.py --messages 100000 --size 64
+"""
+import argparse
+import os
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'threaded_tcp'))
+
+import protocol  # noqa: E402
+
+
+def parse_text(buf):
+    view = memoryview(buf)
+    start = count = 0
+    while True:
+        i = buf.find(b"\n", start)
+        if i < 0:
+            return count
+        message = str(view[start:i], 'utf-8').strip()
+        if message and message != "/list" and message != "/quit":
+            count += 1
+        start = i + 1
+
+def parse_binary(buf):
+    view = memoryview(buf)
+    unpack_from, size = protocol.HEADER.unpack_from, protocol.HEADER.size
+    start = count = 0
+    end = len(buf)
+    while start < end:
+        length, kind, _ = unpack_from(buf, start)
+        payload = view[start + size:start + size + length]
+        if kind == protocol.CHAT and payload:
+            count += 1
+        start += size + length
+    return count
+
+def serialize_text(messages, prefix):
+    for message in messages:
+        b"".join((prefix, message, b"\n"))
+
+def serialize_binary(messages, sender_id):
+    pack = protocol.pack
+    for message in messages:
+        pack(protocol.CHAT, sender_id, message)
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--size', type=int, nargs='+', default=[16, 64, 512])
+    args = parser.parse_args(argv)
+
+    print(f"{'size':>6}{'text parse ns':>15}{'bin parse ns':>14}"
+          f"{'text ser ns':>13}{'bin ser ns':>12}")
+    for size in args.size:
+        messages = [(b"m%07d" % i).ljust(size, b"x") for i in range(args.messages)]
+        text_buf = b"".join(m + b"\n" for m in messages)
+        binary_buf = b"".join(protocol.pack(protocol.CHAT, 0, m) for m in messages)
+        n = args.messages
+        results = [
+            timed(parse_text, text_buf),
+            timed(parse_binary, binary_buf),
+            timed(serialize_text, messages, b"[alice] "),
+            timed(serialize_binary, messages, 7),
+        ]
+        print(f"{size:>6}" + "".join(
+            f"{t / n * 1e9:>{w}.0f}" for t, w in zip(results, (15, 14, 13, 12))
+        ))
+
+if __name__ == "__main__":
+    main()
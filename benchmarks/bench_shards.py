@@ -0,0 +1,62 @@
+"""Micro-benchmark: fan-out latency with broadcast shards.
+
+Broadcasts to one room of sink outboxes (as in bench_broadcast.py) and
+reports two times per message: how long broadcast() keeps the sending
+thread, which is what stalls its reads, and how long until every
+recipient has the frame queued. With K shards the first shrinks to K
+queue puts. The second drops by up to K only on free-threaded Python
+with K free cores; with the GIL the shards take turns.
+
+    python benchmarks/bench_shards.py --clients 10000 --shards 1 2 4 8
+"""
+import argparse
+import os
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'threaded_tcp'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import chat_server  # noqa: E402
+import shards  # noqa: E402
+from bench_broadcast import setup  # noqa: E402
+
+
+def run(n_clients, count, rounds):
+    sender = setup(n_clients)
+    chat_server.senders = shards.Shards(count).start() if count > 1 else None
+    message = b"hello everyone, how is it going?"
+    stalls, totals = [], []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        chat_server.broadcast(message, sender_sock=sender)
+        returned = time.perf_counter()
+        if chat_server.senders:
+            chat_server.senders.flush()
+        stalls.append(returned - start)
+        totals.append(time.perf_counter() - start)
+    if chat_server.senders:
+        chat_server.senders.stop()
+        chat_server.senders = None
+    stalls.sort()
+    totals.sort()
+    return stalls[len(stalls) // 2], totals[len(totals) // 2]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--rounds', type=int, default=100)
+    args = parser.parse_args(argv)
+
+    print(f"free-threaded: {shards.FREE_THREADED}, cpus: {os.cpu_count()}")
+    print(f"{'clients':>8}{'shards':>8}{'sender us':>11}{'fan-out us':>12}")
+    for n_clients in args.clients:
+        for count in args.shards:
+            stall, total = run(n_clients, count, args.rounds)
+            print(f"{n_clients:>8}{count:>8}{stall * 1e6:>11.1f}{total * 1e6:>12.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""Load generator for the chat servers.
+
+Opens N simulated clients against any server variant in the repo (or an
+already running server), has some of them chat at a fixed rate, and
+reports connect throughput, message throughput, end-to-end fan-out
+latency percentiles, and server RSS and CPU. Results are printed and
+written as JSON so runs can be compared.
+
+    python benchmarks/loadgen.py --engine selectors --clients 1000 \\
+        --senders 20 --rate 10 --size 64 --duration 10 --output run.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+THREADED = os.path.join(ROOT, 'threaded_tcp', 'chat_server.py')
+SELECTORS = os.path.join(ROOT, 'selectors_tcp', 'chat_server.py')
+ENGINES = {
+    # No admission cap, so runs can go past the server's default 1024 clients
+    'threaded': [THREADED, '--engine', 'threaded', '--max-connections', '0'],
+    'asyncio': [THREADED, '--engine', 'asyncio'],
+    'selectors': [SELECTORS],
+}
+PROMPT = b"Enter your name: "
+MARK = b"@"  # chat payloads start with "@<send time> "
+
+
+def rss_kb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    # utime and stime, fields 14 and 15 of proc(5)
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def thread_count(pid):
+    return len(os.listdir(f"/proc/{pid}/task"))
+
+def start_server(engine, port, extra_args=()):
+    proc = subprocess.Popen(
+        [sys.executable, *ENGINES[engine], '--host', '127.0.0.1',
+         '--port', str(port), '--max-clients', '1024', *extra_args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    time.sleep(0.5)
+    return proc
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[index]
+
+
+class Client:
+    def __init__(self, reader, writer, stats):
+        self.reader = reader
+        self.writer = writer
+        self.stats = stats
+        self.partial = b""
+
+    async def receive_forever(self):
+        stats = self.stats
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    return
+                now = time.perf_counter()
+                lines = (self.partial + data).split(b"\n")
+                self.partial = lines.pop()
+                stats.lines += len(lines)
+                if not stats.recording:
+                    continue
+                for line in lines:
+                    i = line.find(b"] " + MARK)
+                    if i >= 0:
+                        sent = float(line[i + 3:line.index(b" ", i + 3)])
+                        stats.latencies.append(now - sent)
+        except (ConnectionError, asyncio.CancelledError):
+            return
+
+
+class Stats:
+    def __init__(self):
+        self.lines = 0
+        self.sent = 0
+        self.recording = False
+        self.latencies = []
+
+
+async def connect_client(host, port, username, stats):
+    reader, writer = await asyncio.open_connection(host, port)
+    if await reader.readexactly(len(PROMPT)) != PROMPT:
+        writer.close()
+        raise ConnectionRefusedError(f"{username} was turned away")
+    writer.write(f"{username}\n".encode())
+    await writer.drain()
+    return Client(reader, writer, stats)
+
+async def connect_all(host, port, n_clients, connect_rate, concurrency, stats):
+    gate = asyncio.Semaphore(concurrency)
+    interval = 1.0 / connect_rate if connect_rate else 0.0
+    start = time.perf_counter()
+
+    async def paced(i):
+        if interval:
+            await asyncio.sleep(max(0.0, start + i * interval - time.perf_counter()))
+        async with gate:
+            return await connect_client(host, port, f"load{i}", stats)
+
+    results = await asyncio.gather(*(paced(i) for i in range(n_clients)), return_exceptions=True)
+    clients = [c for c in results if isinstance(c, Client)]
+    return clients, time.perf_counter() - start
+
+async def chat(client, rate, size, until, stats):
+    interval = 1.0 / rate
+    next_send = time.perf_counter()
+    while next_send < until:
+        await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+        stamp = MARK + b"%.9f " % time.perf_counter()
+        client.writer.write(stamp.ljust(size, b"x") + b"\n")
+        stats.sent += 1
+        next_send += interval
+    await client.writer.drain()
+
+async def run_load(args, pid):
+    stats = Stats()
+    cpu_before = cpu_seconds(pid) if pid else None
+
+    clients, connect_secs = await connect_all(
+        args.host, args.port, args.clients, args.connect_rate, args.concurrency, stats
+    )
+    receivers = [asyncio.create_task(c.receive_forever()) for c in clients]
+    await asyncio.sleep(args.settle)
+
+    rss_before = rss_kb(pid) if pid else None
+    cpu_mid = cpu_seconds(pid) if pid else None
+    stats.recording = True
+    stats.lines = 0
+    start = time.perf_counter()
+    until = start + args.duration
+    senders = clients[:args.senders]
+    await asyncio.gather(*(chat(c, args.rate, args.size, until, stats) for c in senders))
+    await asyncio.sleep(args.drain)
+    elapsed = time.perf_counter() - start
+    stats.recording = False
+
+    result = {
+        'clients_requested': args.clients,
+        'clients_connected': len(clients),
+        'connect_secs': round(connect_secs, 3),
+        'connects_per_sec': round(len(clients) / connect_secs, 1) if connect_secs else None,
+        'messages_sent': stats.sent,
+        'messages_per_sec': round(stats.sent / args.duration, 1),
+        'deliveries': len(stats.latencies),
+        'deliveries_per_sec': round(len(stats.latencies) / elapsed, 1),
+    }
+    latencies = sorted(stats.latencies)
+    for name, pct in (('p50', 50), ('p99', 99), ('p999', 99.9)):
+        value = percentile(latencies, pct)
+        result[f'latency_{name}_ms'] = round(value * 1000, 3) if value is not None else None
+    if pid:
+        result['server_rss_kb'] = rss_kb(pid)
+        result['server_rss_kb_per_client'] = round(rss_before / max(1, len(clients)), 2)
+        result['server_threads'] = thread_count(pid)
+        result['server_cpu_connect_secs'] = round(cpu_mid - cpu_before, 3)
+        result['server_cpu_chat_secs'] = round(cpu_seconds(pid) - cpu_mid, 3)
+        result['server_cpu_percent'] = round(100 * (cpu_seconds(pid) - cpu_mid) / elapsed, 1)
+
+    for task in receivers:
+        task.cancel()
+    for c in clients:
+        c.writer.close()
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--engine', choices=list(ENGINES), default='threaded',
+                        help="server variant to start for this run")
+    target.add_argument('--address', help="host:port of a server that is already running")
+    parser.add_argument('--pid', type=int, help="with --address, server pid for RSS/CPU")
+    parser.add_argument('--server-arg', action='append', default=[],
+                        help="extra argument for the started server (repeatable)")
+    parser.add_argument('--port', type=int, default=9600)
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--connect-rate', type=float, default=0,
+                        help="new connections per second (0 = as fast as possible)")
+    parser.add_argument('--concurrency', type=int, default=64,
+                        help="handshakes in flight at once")
+    parser.add_argument('--senders', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=5.0, help="messages per second per sender")
+    parser.add_argument('--size', type=int, default=64, help="message size in bytes")
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--settle', type=float, default=1.0,
+                        help="seconds to wait after connecting")
+    parser.add_argument('--drain', type=float, default=2.0,
+                        help="seconds to wait for in-flight messages")
+    parser.add_argument('--output', help="write the results here as JSON")
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.address:
+        args.host, port = args.address.rsplit(':', 1)
+        args.port = int(port)
+        pid = args.pid
+    else:
+        args.host = '127.0.0.1'
+        server = start_server(args.engine, args.port, args.server_arg)
+        pid = server.pid
+    try:
+        result = asyncio.run(run_load(args, pid))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    report = {
+        'target': args.address or args.engine,
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'pid')},
+        'host': {'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': result,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+import selectors
+import socket
+import threading
+import time
+import pytest
+import chat_server
+from chat_server import tcp_server, clients
+
+
+@pytest.fixture
+def reset_clients():
+    clients.clear()
+    yield
+    clients.clear()
+
+
+@pytest.fixture
+def server_thread():
+    def start_server(port=8281):
+        thread = threading.Thread(
+            target=tcp_server,
+            kwargs={'port': port, 'host': '127.0.0.1'},
+            daemon=True
+        )
+        thread.start()
+        time.sleep(0.2)
+        return thread
+
+    yield start_server
+
+
+class TestClientConnection:
+    
+    def test_single_client_connects(self, reset_clients, server_thread):
+        server_thread(port=8282)
+        
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.connect(('127.0.0.1', 8282))
+        
+        prompt = client.recv(1024)
+        assert prompt == b"Enter your name: "
+        
+        client.send(b"Alice\n")
+        time.sleep(0.1)
+        
+        assert len(clients) == 1
+        assert "Alice" in clients.values()
+        
+        client.close()
+        time.sleep(0.1)
+    
+    def test_multiple_clients_connect(self, reset_clients, server_thread):
+        server_thread(port=8283)
+        
+        clients_list = []
+        usernames = ["Alice", "Bob", "Charlie"]
+        
+        for username in usernames:
+            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client.connect(('127.0.0.1', 8283))
+            client.recv(1024)
+            client.send(f"{username}\n".encode())
+            time.sleep(0.1)
+            clients_list.append(client)
+        
+        assert len(clients) == 3
+        for username in usernames:
+            assert username in clients.values()
+        
+        for client in clients_list:
+            client.close()
+        time.sleep(0.1)
+
+
+class TestBroadcasting:
+    
+    def test_message_broadcast_to_other_clients(self, reset_clients, server_thread):
+        server_thread(port=8284)
+        
+        client1 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client1.connect(('127.0.0.1', 8284))
+        client1.recv(1024)
+        client1.send(b"Alice\n")
+        time.sleep(0.2)
+        
+        client1.recv(1024)
+        
+        client2 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client2.connect(('127.0.0.1', 8284))
+        client2.recv(1024)
+        client2.send(b"Bob\n")
+        time.sleep(0.2)
+        
+        join_msg = client1.recv(1024)
+        assert b"Bob" in join_msg and b"joined" in join_msg
+        
+        client1.send(b"Hello everyone!\n")
+        time.sleep(0.1)
+        
+        msg = client2.recv(1024)
+        assert b"Alice" in msg
+        assert b"Hello everyone!" in msg
+        
+        client1.close()
+        client2.close()
+        time.sleep(0.1)
+    
+    def test_sender_does_not_receive_own_message(self, reset_clients, server_thread):
+        server_thread(port=8285)
+        
+        client1 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client1.connect(('127.0.0.1', 8285))
+        client1.recv(1024)
+        client1.send(b"Alice\n")
+        time.sleep(0.2)
+        
+        client2 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client2.connect(('127.0.0.1', 8285))
+        client2.recv(1024)
+        client2.send(b"Bob\n")
+        time.sleep(0.2)
+        
+        client1.recv(1024)
+        
+        client1.send(b"Test message\n")
+        time.sleep(0.2)
+        
+        msg = client2.recv(1024)
+        assert b"Alice" in msg
+        assert b"Test message" in msg
+        
+        client1.settimeout(0.3)
+        try:
+            unexpected = client1.recv(1024)
+            assert False, f"Client should not receive own message, got: {unexpected}"
+        except socket.timeout:
+            pass
+        
+        client1.close()
+        client2.close()
+        time.sleep(0.1)
+
+
+class TestClientDisconnection:
+    
+    def test_client_removed_on_disconnect(self, reset_clients, server_thread):
+        server_thread(port=8286)
+        
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.connect(('127.0.0.1', 8286))
+        client.recv(1024)
+        client.send(b"Alice\n")
+        time.sleep(0.1)
+        
+        assert len(clients) == 1
+        
+        client.close()
+        time.sleep(0.2)
+        
+        assert len(clients) == 0
+    
+    def test_disconnect_notification_broadcast(self, reset_clients, server_thread):
+        server_thread(port=8287)
+        
+        client1 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client1.connect(('127.0.0.1', 8287))
+        client1.recv(1024)
+        client1.send(b"Alice\n")
+        time.sleep(0.1)
+        
+        client2 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client2.connect(('127.0.0.1', 8287))
+        client2.recv(1024)
+        client2.send(b"Bob\n")
+        client1.recv(1024)
+        time.sleep(0.1)
+        
+        client1.close()
+        time.sleep(0.2)
+        
+        msg = client2.recv(1024)
+        assert b"Alice" in msg
+        assert b"left" in msg
+        
+        client2.close()
+        time.sleep(0.1)
+
+
+class TestCommands:
+    
+    def test_list_command_shows_clients(self, reset_clients, server_thread):
+        server_thread(port=8288)
+        
+        client1 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client1.connect(('127.0.0.1', 8288))
+        client1.recv(1024)
+        client1.send(b"Alice\n")
+        time.sleep(0.1)
+        
+        client2 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client2.connect(('127.0.0.1', 8288))
+        client2.recv(1024)
+        client2.send(b"Bob\n")
+        client1.recv(1024)
+        time.sleep(0.1)
+        
+        client1.send(b"/list\n")
+        time.sleep(0.1)
+        
+        response = client1.recv(1024)
+        assert b"Alice" in response
+        assert b"Bob" in response
+        
+        client1.close()
+        client2.close()
+        time.sleep(0.1)
+    
+    def test_quit_command_disconnects_client(self, reset_clients, server_thread):
+        server_thread(port=8289)
+        
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.connect(('127.0.0.1', 8289))
+        client.recv(1024)
+        client.send(b"Alice\n")
+        time.sleep(0.1)
+        
+        assert len(clients) == 1
+        
+        client.send(b"/quit\n")
+        time.sleep(0.2)
+        
+        assert len(clients) == 0
+        
+        client.close()
+
+
+class TestThreadSafety:
+    
+    def test_concurrent_connections(self, reset_clients, server_thread):
+        server_thread(port=8290)
+        
+        def connect_client(username):
+            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client.connect(('127.0.0.1', 8290))
+            client.recv(1024)
+            client.send(f"{username}\n".encode())
+            time.sleep(0.5)
+            client.close()
+        
+        threads = []
+        usernames = [f"User{i}" for i in range(10)]
+        
+        for username in usernames:
+            thread = threading.Thread(target=connect_client, args=(username,))
+            threads.append(thread)
+            thread.start()
+        
+        time.sleep(0.3)
+        
+        for thread in threads:
+            thread.join()
+        
+        time.sleep(0.3)
+        
+        assert len(clients) == 0
+
+
+class TestWriteInterest:
+
+    def test_write_interest_only_while_output_pending(self, reset_clients, server_thread):
+        server_thread(port=8291)
+
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.connect(('127.0.0.1', 8291))
+        client.recv(1024)
+        client.send(b"Alice\n")
+        time.sleep(0.1)
+
+        conn = next(iter(chat_server.connections.values()))
+        key = conn.sel.get_key(conn.sock)
+        assert key.events == selectors.EVENT_READ
+        assert not conn.outbuf
+
+        client.close()
+        time.sleep(0.1)
+
+    def test_backlog_is_sent_in_order_from_shared_frames(self):
+        class Trickle:
+            """Socket that takes at most 5 bytes per call"""
+
+            def __init__(self):
+                self.data = b""
+
+            def send(self, data):
+                return self.sendmsg([data])
+
+            def sendmsg(self, buffers):
+                chunk = b"".join(bytes(b) for b in buffers)[:5]
+                self.data += chunk
+                return len(chunk)
+
+        class Selector:
+            events = None
+
+            def modify(self, sock, events, data):
+                self.events = events
+
+        sock, sel = Trickle(), Selector()
+        conn = chat_server.Connection(sock, None, sel)
+        frames = [b"[A] one\n", b"[A] two\n", b"[A] three\n"]
+        for frame in frames:
+            conn.send(frame)
+        # Unsent frames are queued as they are, not copied
+        assert conn.outbuf[-1] is frames[-1]
+        assert sel.events == selectors.EVENT_READ | selectors.EVENT_WRITE
+
+        while conn.outbuf:
+            conn.on_writable()
+        assert sock.data == b"".join(frames)
+        assert conn.outbuf_bytes == 0
+        assert sel.events == selectors.EVENT_READ
+
+        assert chat_server.backlogged
+        chat_server.release_memory()
+        assert not chat_server.backlogged
+
+    def test_many_idle_connections_one_thread(self, reset_clients, server_thread):
+        server_thread(port=8292)
+        threads_before = threading.active_count()
+
+        idle = []
+        for i in range(200):
+            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client.connect(('127.0.0.1', 8292))
+            client.recv(1024)
+            client.send(f"User{i}\n".encode())
+            idle.append(client)
+        time.sleep(0.5)
+
+        assert len(clients) == 200
+        assert threading.active_count() == threads_before
+
+        for client in idle:
+            client.close()
+        time.sleep(0.5)
+        assert len(clients) == 0
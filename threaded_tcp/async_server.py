@@ -0,0 +1,135 @@
+import asyncio
+import functools
+import logging
+
+from framing import MAX_FRAME
+from outbound import SlowConsumerPolicy, DISCONNECT, frames_dropped, slow_consumer_disconnects
+
+
+HANDSHAKE_TIMEOUT = 30.0  # seconds a new client gets to send its name
+
+clients = {}  # {writer: username}
+slow_policy = SlowConsumerPolicy()  # what broadcast does about a backed-up transport
+
+log = logging.getLogger('chat_server')
+
+def broadcast(message, sender=None):
+    """Queue message on every client's transport (except sender)
+
+    A transport holding slow_policy.max_bytes unsent is not written
+    to: with DISCONNECT the client is dropped, otherwise the message is
+    (a transport cannot drop what it already buffered, so DROP_OLDEST
+    acts as DROP_NEWEST).
+    """
+    prefix = f"[{clients[sender] if sender else 'Server'}] ".encode()
+    payload = prefix + message
+    policy = slow_policy
+    dead_clients = []
+    for writer in clients:
+        if writer is sender:
+            continue
+        if writer.is_closing():
+            dead_clients.append(writer)
+            continue
+        buffered = writer.transport.get_write_buffer_size()
+        if buffered and buffered + len(payload) > policy.max_bytes:
+            if policy.mode == DISCONNECT:
+                log.warning("Disconnecting slow consumer %s", clients[writer])
+                slow_consumer_disconnects.inc()
+                # Its task sees the connection drop and announces the leave
+                writer.transport.abort()
+            else:
+                frames_dropped.inc()
+            continue
+        writer.write(payload)
+    for writer in dead_clients:
+        remove_client(writer)
+
+def remove_client(writer):
+    username = None
+    if writer in clients:
+        username = clients[writer]
+        del clients[writer]
+        log.info("%s left (%d clients)", username, len(clients))
+    return username
+
+async def read_frame(reader):
+    """Next newline-terminated frame, or None at EOF"""
+    try:
+        return await reader.readuntil(b"\n")
+    except asyncio.IncompleteReadError:
+        return None
+
+async def handshake(reader, writer, timeout=HANDSHAKE_TIMEOUT):
+    """Prompt for a username; None if the client stalls or disconnects"""
+    addr = writer.get_extra_info('peername')
+    try:
+        writer.write(b"Enter your name: ")
+        await writer.drain()
+        data = await asyncio.wait_for(read_frame(reader), timeout)
+        if data is None:
+            return None
+        return data.decode().strip()
+    except (OSError, ValueError, asyncio.LimitOverrunError, asyncio.TimeoutError) as e:
+        log.warning("Handshake with %s failed: %r", addr, e)
+        return None
+
+async def handle_client(reader, writer, handshake_timeout=HANDSHAKE_TIMEOUT):
+    """Handle one client connection (runs as a task on the event loop)"""
+    addr = writer.get_extra_info('peername')
+    username = await handshake(reader, writer, handshake_timeout)
+    if username is None:
+        writer.close()
+        return
+    clients[writer] = username
+    log.info("%s joined (%d clients)", username, len(clients))
+    broadcast(f"{username} joined the chat!\n".encode())
+    log.info("New connection from %s", addr)
+    try:
+        while True:
+            data = await read_frame(reader)
+            if data is None:
+                break
+            message = data.decode().strip()
+            if not message:
+                continue
+            if message == "/list":
+                writer.write(f"Current clients: {', '.join(clients.values())}\n".encode())
+                await writer.drain()
+                continue
+            elif message == "/quit":
+                break
+            log.debug("[%s] %s", clients[writer], message)
+            broadcast(data, sender=writer)
+    except Exception as e:
+        log.warning("Error with client %s: %s", addr, e)
+    finally:
+        username = remove_client(writer)
+        if username is not None:
+            broadcast(f"{username} left the chat!\n".encode())
+        writer.close()
+
+async def serve(port=8080, host='0.0.0.0', max_clients=128, handshake_timeout=HANDSHAKE_TIMEOUT,
+                max_frame=MAX_FRAME, slow_consumer=None):
+    global slow_policy
+    slow_policy = slow_consumer or SlowConsumerPolicy()
+    server = await asyncio.start_server(
+        functools.partial(handle_client, handshake_timeout=handshake_timeout),
+        host, port,
+        backlog=max_clients,
+        limit=max_frame,
+        reuse_address=True,
+    )
+    log.info("Server is listening on %s:%d (asyncio)", host, port)
+    async with server:
+        await server.serve_forever()
+
+def tcp_server(port=8080, host='0.0.0.0', max_clients=128, handshake_timeout=HANDSHAKE_TIMEOUT,
+               max_frame=MAX_FRAME, slow_consumer=None):
+    try:
+        asyncio.run(serve(port, host, max_clients, handshake_timeout, max_frame, slow_consumer))
+    except KeyboardInterrupt:
+        log.info("Server is shutting down")
+
+if __name__ == "__main__":
+    tcp_server()
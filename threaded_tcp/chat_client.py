@@ -0,0 +1,513 @@
+"""Client library and CLI for the chat server
+
+Clients speak the binary protocol (see protocol.py) over one persistent
+connection each. Sends are pipelined: they are written as soon as they
+are made, without waiting for earlier ones to be answered. A background
+reader (a thread for Client, a task for AsyncClient) parses every
+incoming packet, completes pending /list and /stats requests in order,
+answers the server's heartbeat PINGs and hands everything else to
+on_packet or the inbox. If the connection drops, the reader reconnects
+with exponential backoff and rejoins the client's room.
+
+    with Client('127.0.0.1', 8080, 'bot-1').connect() as bot:
+        bot.send("hello")
+        print(bot.list_users())
+
+    async with AsyncClient('127.0.0.1', 8080, 'bot-2') as bot:
+        await bot.send("hello")
+        print(await bot.list_users())
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import queue
+import random
+import socket
+import sys
+import threading
+import time
+
+import protocol
+from framing import FrameReader
+
+
+PROMPT = b"Enter your name: "
+MAX_PACKET = 1024 * 1024  # a /list reply from a big server can be large
+LOBBY = 'lobby'
+REPLIES = (protocol.LIST, protocol.STATS)  # request types the server answers in order
+
+log = logging.getLogger('chat_client')
+
+
+class ServerFull(ConnectionError):
+    pass
+
+
+class NameTaken(ConnectionError):
+    pass
+
+
+def backoff(initial=0.1, maximum=5.0, factor=2.0):
+    """Reconnect delays: exponential growth up to maximum, with full jitter"""
+    delay = initial
+    while True:
+        yield random.uniform(0, delay)
+        delay = min(maximum, delay * factor)
+
+def check_prompt(prompt):
+    if prompt is None:
+        raise ConnectionError("Server closed the connection during the handshake")
+    if bytes(prompt) != PROMPT:
+        raise ServerFull("Server turned the connection away")
+
+def check_welcome(first_byte, username):
+    # A packet starts with a big-endian length, so its first byte is 0
+    # for anything shorter than 16 MiB; the name-taken prompt is text
+    if first_byte != 0:
+        raise NameTaken(f"{username} is already in use")
+
+def check_welcome_packet(kind):
+    # The server queues WELCOME before anyone can send us anything; another
+    # packet first would hand us its sender's id as our own
+    if kind != protocol.WELCOME:
+        raise ConnectionError(f"Expected WELCOME from the server, got packet type {kind}")
+
+
+class Client:
+    """One persistent binary-protocol connection, usable from any thread"""
+
+    def __init__(self, host, port, username, on_packet=None, reconnect=True, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.on_packet = on_packet  # called on the reader thread with (type, sender id, payload)
+        self.inbox = queue.SimpleQueue()  # packets, when there is no on_packet
+        self.reconnect = reconnect
+        self.timeout = timeout
+        self.id = None
+        self.room = LOBBY
+        self.sock = None
+        self.send_lock = threading.Lock()
+        self.pending = {kind: collections.deque() for kind in REPLIES}
+        self.connected = threading.Event()
+        self.closed = False
+        self.reconnects = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def connect(self):
+        """Connect and complete the handshake, then start the reader thread"""
+        self._open()
+        self.thread.start()
+        return self
+
+    def _open(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            reader = FrameReader(sock, MAX_PACKET)
+            deadline = time.monotonic() + self.timeout
+            check_prompt(reader.read_exact(len(PROMPT), deadline))
+            sock.sendall(f"{protocol.NEGOTIATE}{self.username}\n".encode())
+            first = reader.peek(1, deadline)
+            if first is None:
+                raise ConnectionError("Server closed the connection during the handshake")
+            check_welcome(first[0], self.username)
+            kind, sender_id, _ = protocol.read_packet(reader, deadline)
+            check_welcome_packet(kind)
+            sock.settimeout(None)
+        except BaseException:
+            sock.close()
+            raise
+        self.sock, self.reader, self.id = sock, reader, sender_id
+        if self.room != LOBBY:
+            sock.sendall(protocol.pack(protocol.JOIN, self.id, self.room.encode()))
+        self.connected.set()
+
+    def _run(self):
+        while True:
+            try:
+                while True:
+                    packet = protocol.read_packet(self.reader)
+                    if packet is None:
+                        break
+                    kind, sender_id, payload = packet
+                    self._dispatch(kind, sender_id, bytes(payload))
+            except OSError:
+                pass
+            self.connected.clear()
+            self._fail_pending()
+            if self.closed or not self.reconnect:
+                return
+            for delay in backoff():
+                time.sleep(delay)
+                if self.closed:
+                    return
+                try:
+                    self._open()
+                    break
+                except OSError as e:
+                    log.debug("Reconnecting %s failed: %s", self.username, e)
+            self.reconnects += 1
+
+    def _dispatch(self, kind, sender_id, payload):
+        waiting = self.pending.get(kind)
+        if waiting:
+            waiting.popleft().set_result(payload)
+        elif kind == protocol.PING:
+            self._send(protocol.PONG)
+        elif self.on_packet:
+            self.on_packet(kind, sender_id, payload)
+        else:
+            self.inbox.put((kind, sender_id, payload))
+
+    def _fail_pending(self):
+        with self.send_lock:
+            for waiting in self.pending.values():
+                while waiting:
+                    waiting.popleft().set_exception(ConnectionError("Connection lost"))
+
+    def _send(self, kind, payload=b"", reply=False):
+        if not self.connected.wait(self.timeout):
+            raise ConnectionError(f"{self.username} is not connected")
+        future = None
+        with self.send_lock:
+            if reply:
+                future = concurrent.futures.Future()
+                self.pending[kind].append(future)
+            self.sock.sendall(protocol.pack(kind, self.id, payload))
+        return future
+
+    def send(self, message):
+        """Chat in the current room; returns as soon as the bytes are written"""
+        self._send(protocol.CHAT, message.encode() if isinstance(message, str) else message)
+
+    def direct(self, username, message):
+        self._send(protocol.DIRECT, f"{username}\n{message}".encode())
+
+    def join(self, room):
+        self.room = room
+        self._send(protocol.JOIN, room.encode())
+
+    def leave(self):
+        self.room = LOBBY
+        self._send(protocol.LEAVE)
+
+    def request_list(self):
+        """Future for the roster; several can be in flight at once"""
+        return self._send(protocol.LIST, reply=True)
+
+    def list_users(self):
+        return self.request_list().result(self.timeout).decode().split("\n")
+
+    def stats(self):
+        return self._send(protocol.STATS, reply=True).result(self.timeout).decode()
+
+    def receive(self, timeout=None):
+        """Next packet from the inbox: (type, sender id, payload)"""
+        return self.inbox.get(timeout=timeout)
+
+    def close(self):
+        self.closed = True
+        if self.connected.is_set():
+            try:
+                with self.send_lock:
+                    self.sock.sendall(protocol.pack(protocol.QUIT, self.id))
+            except OSError:
+                pass
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+
+
+class ClientPool:
+    """Persistent connections for several identities, e.g. a fleet of bots"""
+
+    def __init__(self, host, port, usernames, **options):
+        self.clients = {name: Client(host, port, name, **options) for name in usernames}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getitem__(self, username):
+        return self.clients[username]
+
+    def __iter__(self):
+        return iter(self.clients.values())
+
+    def connect(self):
+        for client in self.clients.values():
+            client.connect()
+        return self
+
+    def close(self):
+        for client in self.clients.values():
+            client.close()
+
+
+async def read_packet(reader):
+    """Next (type, sender id, payload) from an asyncio StreamReader, or None at EOF"""
+    try:
+        header = await reader.readexactly(protocol.HEADER.size)
+        length, kind, sender_id = protocol.HEADER.unpack(header)
+        return kind, sender_id, await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+
+
+class AsyncClient:
+    """The asyncio counterpart of Client, for use from one event loop"""
+
+    def __init__(self, host, port, username, on_packet=None, reconnect=True, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.on_packet = on_packet  # called in the reader task with (type, sender id, payload)
+        self.inbox = asyncio.Queue()
+        self.reconnect = reconnect
+        self.timeout = timeout
+        self.id = None
+        self.room = LOBBY
+        self.writer = None
+        self.pending = {kind: collections.deque() for kind in REPLIES}
+        self.connected = asyncio.Event()
+        self.closed = False
+        self.reconnects = 0
+        self.task = None
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def connect(self):
+        await self._open()
+        self.task = asyncio.create_task(self._run())
+        return self
+
+    async def _open(self):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout
+        )
+        try:
+            async with asyncio.timeout(self.timeout):
+                try:
+                    check_prompt(await reader.readexactly(len(PROMPT)))
+                except asyncio.IncompleteReadError:
+                    check_prompt(None)
+                writer.write(f"{protocol.NEGOTIATE}{self.username}\n".encode())
+                first = await reader.read(1)
+                if not first:
+                    raise ConnectionError("Server closed the connection during the handshake")
+                check_welcome(first[0], self.username)
+                rest = await reader.readexactly(protocol.HEADER.size - 1)
+                length, kind, sender_id = protocol.HEADER.unpack(first + rest)
+                await reader.readexactly(length)
+                check_welcome_packet(kind)
+        except BaseException:
+            writer.close()
+            raise
+        self.reader, self.writer, self.id = reader, writer, sender_id
+        if self.room != LOBBY:
+            writer.write(protocol.pack(protocol.JOIN, self.id, self.room.encode()))
+        self.connected.set()
+
+    async def _run(self):
+        while True:
+            try:
+                while True:
+                    packet = await read_packet(self.reader)
+                    if packet is None:
+                        break
+                    self._dispatch(*packet)
+            except OSError:
+                pass
+            self.connected.clear()
+            for waiting in self.pending.values():
+                while waiting:
+                    waiting.popleft().set_exception(ConnectionError("Connection lost"))
+            if self.closed or not self.reconnect:
+                return
+            for delay in backoff():
+                await asyncio.sleep(delay)
+                if self.closed:
+                    return
+                try:
+                    await self._open()
+                    break
+                except (OSError, asyncio.TimeoutError) as e:
+                    log.debug("Reconnecting %s failed: %s", self.username, e)
+            self.reconnects += 1
+
+    def _dispatch(self, kind, sender_id, payload):
+        waiting = self.pending.get(kind)
+        if waiting:
+            waiting.popleft().set_result(payload)
+        elif kind == protocol.PING:
+            self.writer.write(protocol.pack(protocol.PONG, self.id))
+        elif self.on_packet:
+            self.on_packet(kind, sender_id, payload)
+        else:
+            self.inbox.put_nowait((kind, sender_id, payload))
+
+    async def _send(self, kind, payload=b"", reply=False):
+        try:
+            await asyncio.wait_for(self.connected.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionError(f"{self.username} is not connected") from None
+        future = None
+        if reply:
+            future = asyncio.get_running_loop().create_future()
+            self.pending[kind].append(future)
+        self.writer.write(protocol.pack(kind, self.id, payload))
+        await self.writer.drain()
+        return future
+
+    async def send(self, message):
+        await self._send(protocol.CHAT, message.encode() if isinstance(message, str) else message)
+
+    async def direct(self, username, message):
+        await self._send(protocol.DIRECT, f"{username}\n{message}".encode())
+
+    async def join(self, room):
+        self.room = room
+        await self._send(protocol.JOIN, room.encode())
+
+    async def leave(self):
+        self.room = LOBBY
+        await self._send(protocol.LEAVE)
+
+    async def request_list(self):
+        """Future for the roster; await several to pipeline them"""
+        return await self._send(protocol.LIST, reply=True)
+
+    async def list_users(self):
+        reply = await asyncio.wait_for(await self.request_list(), self.timeout)
+        return reply.decode().split("\n")
+
+    async def stats(self):
+        reply = await asyncio.wait_for(await self._send(protocol.STATS, reply=True), self.timeout)
+        return reply.decode()
+
+    async def receive(self):
+        return await self.inbox.get()
+
+    async def close(self):
+        self.closed = True
+        if self.writer:
+            if self.connected.is_set():
+                self.writer.write(protocol.pack(protocol.QUIT, self.id))
+            self.writer.close()
+        if self.task:
+            self.task.cancel()
+
+
+class AsyncClientPool:
+    """AsyncClients for several identities, connected concurrently"""
+
+    def __init__(self, host, port, usernames, **options):
+        self.clients = {name: AsyncClient(host, port, name, **options) for name in usernames}
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def __getitem__(self, username):
+        return self.clients[username]
+
+    def __iter__(self):
+        return iter(self.clients.values())
+
+    async def connect(self):
+        await asyncio.gather(*(client.connect() for client in self.clients.values()))
+        return self
+
+    async def close(self):
+        await asyncio.gather(*(client.close() for client in self.clients.values()))
+
+
+def show(names, kind, sender_id, payload):
+    """Format an incoming packet the way the text protocol would"""
+    text = payload.decode(errors='replace')
+    if kind == protocol.CHAT:
+        return f"[{names.get(sender_id, sender_id)}] {text}"
+    if kind == protocol.DIRECT:
+        return f"[{names.get(sender_id, sender_id)} -> you] {text}"
+    if kind in (protocol.JOIN, protocol.LEAVE):
+        names[sender_id] = text
+        return f"[Server] {text} {'joined' if kind == protocol.JOIN else 'left'}"
+    return f"[Server] {text}"
+
+def interactive(args):
+    names = {}
+    client = Client(args.host, args.port, args.name,
+                    on_packet=lambda *packet: print(show(names, *packet), flush=True))
+    with client.connect():
+        for line in sys.stdin:
+            line = line.strip()
+            command, _, arg = line.partition(" ")
+            if not line:
+                continue
+            if command == "/quit":
+                break
+            elif command == "/list":
+                print(f"Current clients: {', '.join(client.list_users())}")
+            elif command == "/stats":
+                print(client.stats(), end="")
+            elif command == "/join" and arg:
+                client.join(arg)
+            elif command == "/leave":
+                client.leave()
+            elif command == "/msg" and " " in arg:
+                client.direct(*arg.split(" ", 1))
+            else:
+                client.send(line)
+
+def bots(args):
+    """Each bot chats at args.rate messages/s for args.duration seconds"""
+    usernames = [f"{args.name}-{i}" for i in range(args.bots)]
+    with ClientPool(args.host, args.port, usernames, on_packet=lambda *packet: None) as pool:
+        pool.connect()
+        start = time.monotonic()
+        sent = 0
+        while time.monotonic() - start < args.duration:
+            for client in pool:
+                client.send(f"message {sent} from {client.username}")
+                sent += 1
+            time.sleep(1.0 / args.rate)
+        reconnects = sum(client.reconnects for client in pool)
+    print(f"{args.bots} bots sent {sent} messages ({reconnects} reconnects)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chat client (binary protocol)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--name', required=True, help="username, or the name prefix with --bots")
+    parser.add_argument('--bots', type=int, default=0,
+                        help="run this many bot identities instead of reading stdin")
+    parser.add_argument('--rate', type=float, default=1.0, help="messages per second per bot")
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args(argv)
+    if args.bots:
+        bots(args)
+    else:
+        interactive(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,80 +1,1044 @@
+import argparse
+import functools
+import itertools
+import logging
+import os
+import signal
 import socket
 import threading
+import time
 
+import logs
+import metrics
+import pool
+import protocol
+import restart
+import shards
+import tracing
+from ratelimit import RateLimits
+from framing import FrameReader, MAX_FRAME
+from history import History, MAX_BYTES as HISTORY_BYTES, REPLAY as HISTORY_REPLAY, \
+    MAX_REPLAY as HISTORY_MAX
+from journal import Journal, SEGMENT_BYTES, SYNC_BYTES, SYNC_INTERVAL
+from timers import TimingWheel
+from outbound import Outbox, SlowConsumerPolicy, WritePolicy, POLICIES, DROP_OLDEST, WRITE_MODES, LATENCY
 
+
+HANDSHAKE_TIMEOUT = 30.0  # seconds a new client gets to send its name
+HEARTBEAT = 30.0  # seconds of silence before a binary client is pinged
+IDLE_TIMEOUT = 90.0  # seconds of silence before a binary client is evicted
+DRAIN_TIMEOUT = 10.0  # seconds a stopping server spends disconnecting clients
+ACCEPT_POLL = 0.2  # how often the accept loop checks whether it should stop
+SHUTTING_DOWN = b"Server is shutting down"
+RESTARTING = b"Server is restarting, please reconnect"
+LOBBY = 'lobby'  # room every client starts in
+PROMPT = b"Enter your name: "
+NAME_TAKEN = b"That name is taken. Enter your name: "
+SERVER_FULL = b"Server full, try again later\n"
+
+# What to do with a new connection once max_connections are open
+REJECT = 'reject'  # accept it, send SERVER_FULL and close it
+HOLD = 'hold'      # stop accepting until a slot frees up
+WHEN_FULL = (REJECT, HOLD)
+
+# How client input is read
+THREAD = 'thread'  # one blocking reader thread per connection
+POOL = 'pool'      # pool_size worker threads serve every readable connection
+HANDLERS = (THREAD, POOL)
+POOL_SIZE = 16
+
+# The dicts below are only changed while holding clients_lock. Each
+# change then publishes a new Snapshot, which readers use without the lock.
 clients = {}
-clients_lock = threading.Lock()
+sessions = {}  # {socket: Session}, kept in step with clients
+names = {}  # {username: Session}, the reverse index; usernames are unique
+rooms = {LOBBY: {}}  # {room: {socket: Session}}, subscribers of each room
+clients_lock = metrics.timed_lock('clients_lock')
+session_ids = itertools.count(1)
+remote_members = {}  # {sender id: username} on other cluster workers
+remote_rooms = {}  # {sender id: room} on other cluster workers
+remote_names = {}  # {username: sender id} on other cluster workers
+bus = None  # cluster.Bus when running as one of several workers
+senders = None  # shards.Shards doing fan-out, when there is more than one shard
+history = History()  # recent chat of every room, with its own lock
+journal = None  # Journal of every chat message, when one is kept
+wheel = TimingWheel()  # idle checks of every binary session
+draining = False  # set while a stopping server disconnects everyone
+
+log = logging.getLogger('chat_server')
+connections_total = metrics.counter('connections_total')
+handshake_failures = metrics.counter('handshake_failures')
+connections_rejected = metrics.counter('connections_rejected')
+messages_in = metrics.counter('messages_in')
+bytes_in = metrics.counter('bytes_in')
+messages_out = metrics.counter('messages_out')  # frames queued on outboxes
+fanout_seconds = metrics.histogram('fanout_seconds')
+idle_evictions = metrics.counter('idle_evictions')
+
+
+class Session:
+    """A registered client: its name, room, protocol and outbound queue"""
+
+    def __init__(self, sock, username, outbox, binary=False):
+        self.sock = sock
+        self.username = username
+        self.outbox = outbox
+        self.binary = binary
+        self.room = LOBBY
+        self.id = next(session_ids)
+        self.prefix = f"[{username}] ".encode()
+        self.last_seen = time.monotonic()  # when anything last arrived from the client
+        self.timer = None  # the session's pending idle check
+        self.throttle = None  # ratelimit.Throttle, when clients are rate limited
+
+
+class Heartbeat:
+    """When to ping a silent client and when to give up on it
+
+    Binary clients are sent a PING after interval seconds without input
+    and evicted after idle_timeout. Text clients cannot be asked to
+    answer, so dead ones are found by TCP keepalive probes instead,
+    starting after interval seconds. An interval of 0 turns both off.
+    """
+
+    def __init__(self, interval=HEARTBEAT, idle_timeout=IDLE_TIMEOUT):
+        if interval and idle_timeout <= interval:
+            raise ValueError("idle_timeout must be longer than the heartbeat interval")
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+
+
+liveness = Heartbeat()
+limits = RateLimits()  # how fast each client, and all of them, may send
+
+class Snapshot:
+    """Who is online at one instant; never changed once published
+
+    Membership changes build a new Snapshot and rebind the module-level
+    snapshot to it, which is atomic, so fan-out and /list read it
+    without taking clients_lock. Unchanged room tuples are shared with
+    the previous snapshot.
+    """
+
+    __slots__ = ('everyone', 'rooms', 'remote', 'listing', 'split')
+
+    def __init__(self, everyone=(), rooms=None, remote=()):
+        self.everyone = everyone    # (Session, ...) of every local client
+        self.rooms = rooms or {}    # {room: (Session, ...)}
+        self.remote = remote        # (username, ...) on other cluster workers
+        self.listing = None
+        self.split = {}  # {room or None: members by shard}, filled in by shards()
+
+    def members(self, room):
+        """Sessions in room, or every local session if room is None"""
+        return self.everyone if room is None else self.rooms.get(room, ())
+
+    def shards(self, room, count):
+        """members(room) split into count tuples by session id, built at most once per snapshot"""
+        split = self.split.get(room)
+        if split is None:
+            parts = [[] for _ in range(count)]
+            for session in self.members(room):
+                parts[session.id % count].append(session)
+            split = self.split[room] = tuple(map(tuple, parts))
+        return split
+
+    def list_replies(self):
+        """Encoded (text, binary) /list replies, built at most once per snapshot"""
+        listing = self.listing
+        if listing is None:
+            usernames = [session.username for session in self.everyone]
+            usernames += self.remote
+            listing = self.listing = (
+                f"Current clients: {', '.join(usernames)}\n".encode(),
+                protocol.pack(protocol.LIST, 0, "\n".join(usernames).encode()),
+            )
+        return listing
+
+
+snapshot = Snapshot(rooms={LOBBY: ()})
+
+def refresh_snapshot(*changed_rooms, everyone=True, remote=False):
+    """Publish a snapshot reflecting changes to sessions/rooms/remote_members (must hold lock!)"""
+    global snapshot
+    old = snapshot
+    room_views = dict(old.rooms)
+    for room in changed_rooms:
+        if room in rooms:
+            room_views[room] = tuple(rooms[room].values())
+        else:
+            room_views.pop(room, None)
+    snapshot = Snapshot(
+        tuple(sessions.values()) if everyone else old.everyone,
+        room_views,
+        tuple(remote_members.values()) if remote else old.remote,
+    )
+
+def fan_out(text, binary, skip=None, room=None):
+    """Queue pre-encoded frames on room's subscribers (everyone if None) except skip
+
+    With broadcast shards, each shard's sender thread queues them on its
+    own part of the room, and this returns as soon as they are handed out.
+    """
+    # Walks the current snapshot, so no lock is held while queueing; a
+    # client that leaves meanwhile just has its put() refused.
+    view = snapshot
+    if senders:
+        for i, members in enumerate(view.shards(room, len(senders))):
+            if members:
+                senders.submit(i, queue_frames, members, text, binary, skip)
+    else:
+        queue_frames(view.members(room), text, binary, skip)
+
+def queue_frames(members, text, binary, skip):
+    """Put text or binary, by protocol, on every outbox in members except skip's"""
+    start = time.perf_counter()
+    queued = 0
+    for session in members:
+        if session.sock is not skip:
+            session.outbox.put(binary if session.binary else text)
+            queued += 1
+    messages_out.inc(queued)
+    fanout_seconds.observe(time.perf_counter() - start)
+
+def deliver(session, frame):
+    """Queue frame for one session, behind anything its broadcast shard has yet to queue"""
+    if senders:
+        senders.submit(session.id % len(senders), session.outbox.put, frame)
+    else:
+        session.outbox.put(frame)
+
+def publish(packet):
+    """Share an event with the other cluster workers, if any"""
+    if bus:
+        bus.publish(packet)
 
 def broadcast(message, sender_sock=None):
-    dead_clients = []
+    """Send message (bytes, no newline) to sender_sock's room, or to everyone as a server notice"""
+    # Encode once per protocol; every outbox shares the same objects.
+    # A single dict lookup is atomic, so finding the sender needs no lock.
+    sender = sessions.get(sender_sock)
+    tracer = tracing.tracer
+    traced = tracer and tracer.active()
+    if traced:
+        tracer.stage('decode')
+    if sender:
+        if sender.binary:
+            message = bytes(message).replace(b"\n", b" ")
+        text = b"".join((sender.prefix, message, b"\n"))
+        binary = protocol.pack(protocol.CHAT, sender.id, message)
+        history.append(sender.room, text, binary)
+        if journal:
+            journal.append(sender.room, sender.id, sender.username, message)
+        if traced:
+            tracer.stage('encode')
+        fan_out(text, binary, skip=sender_sock, room=sender.room)
+        if traced:
+            tracer.stage('fan_out', room=sender.room)
+    else:
+        text = b"".join((b"[Server] ", message, b"\n"))
+        binary = protocol.pack(protocol.NOTICE, 0, message)
+        fan_out(text, binary)
+    publish(binary)
+
+def watch(session):
+    """Start tracking a new session's liveness"""
+    interval = liveness.interval
+    if not interval:
+        return
+    sock = session.sock
+    if sock.family in (socket.AF_INET, socket.AF_INET6):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, max(1, int(interval)))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, int(interval / 3)))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+    if session.binary:
+        session.timer = wheel.schedule(interval, check_idle, session)
+
+def check_idle(session):
+    """Wheel callback: ping a silent binary client, evict one that stays silent"""
+    # Reads only bump last_seen; the timer is re-armed here, so a busy
+    # client costs one wheel operation per interval, not one per message
+    if session.outbox.closed:
+        return
+    idle = time.monotonic() - session.last_seen
+    if idle >= liveness.idle_timeout:
+        idle_evictions.inc()
+        log.info("Evicting %s after %.0fs of silence", session.username, idle)
+        session.outbox.abort()
+        return
+    if idle >= liveness.interval:
+        deliver(session, protocol.pack(protocol.PING, 0))
+        due = liveness.idle_timeout - idle
+    else:
+        due = liveness.interval - idle
+    session.timer = wheel.schedule(due, check_idle, session)
+
+def replay(session, n, durable=False):
+    """Queue the last n messages of session's room as one frame; how many there were
+
+    With durable, and a journal kept, they come from the journal rather
+    than the in-memory history, so they reach back past its budget and
+    across restarts. Either way a replay holds at most history.max_replay
+    messages and about history.max_bytes.
+    """
+    n = min(n, history.max_replay)
+    if durable and journal:
+        frames = [protocol.pack(protocol.CHAT, sender_id, message) if session.binary
+                  else b"".join((f"[{name}] ".encode(), message, b"\n"))
+                  for _, sender_id, _, name, message
+                  in journal.tail(session.room, n, max_bytes=history.max_bytes)]
+    else:
+        frames = history.last(session.room, n, session.binary)
+    # One put, so the writer sends the whole replay with a single call
+    if frames:
+        deliver(session, b"".join(frames))
+    return len(frames)
+
+def direct(sender, target, message):
+    """Send message (bytes) privately to the user named target; False if there is none"""
+    recipient = names.get(target)
+    if recipient:
+        if recipient.binary:
+            deliver(recipient, protocol.pack(protocol.DIRECT, sender.id, message))
+        else:
+            # As in broadcast(): a binary sender must not forge lines
+            deliver(recipient, b"".join((b"[", sender.username.encode(), b" -> you] ",
+                                         message.replace(b"\n", b" "), b"\n")))
+        return True
+    if target in remote_names:
+        publish(protocol.pack(protocol.DIRECT, sender.id, b"\n".join((target.encode(), message))))
+        return True
+    return False
+
+def announce(kind, session, notice, room):
+    """Tell room that session joined (JOIN) or left (LEAVE) it"""
+    text = f"[Server] {notice}\n".encode()
+    binary = protocol.pack(kind, session.id, session.username.encode())
+    fan_out(text, binary, room=room)
+
+def move_to_room(session, room):
     with clients_lock:
-        for client_sock in clients:
-            if client_sock == sender_sock:
-                continue
-            try:
-                client_sock.send(f"[{clients[sender_sock] if sender_sock else 'Server'}] {message.decode()}".encode())
-            except Exception as e:
-                print(f"Error sending message to {client_sock}: {e}")
-                dead_clients.append(client_sock)
-    for sock in dead_clients:
+        old = session.room
+        if room == old:
+            return
+        members = rooms[old]
+        del members[session.sock]
+        if not members and old != LOBBY:
+            del rooms[old]
+        rooms.setdefault(room, {})[session.sock] = session
+        session.room = room
+        refresh_snapshot(old, room, everyone=False)
+    announce(protocol.LEAVE, session, f"{session.username} left {old}", old)
+    replay(session, history.replay)
+    announce(protocol.JOIN, session, f"{session.username} joined {room}", room)
+    publish(protocol.pack(protocol.ROOM, session.id, room.encode()))
+
+def deliver_remote(kind, sender_id, payload):
+    """Fan out an event another cluster worker published on the bus"""
+    # Runs on the bus thread, the only writer of remote_members and
+    # remote_rooms, so it can read them without the lock
+    binary = protocol.pack(kind, sender_id, payload)
+    if kind == protocol.JOIN:
+        name = str(payload, 'utf-8')
+        with clients_lock:
+            remote_members[sender_id] = name
+            remote_rooms[sender_id] = LOBBY
+            remote_names[name] = sender_id
+            refresh_snapshot(everyone=False, remote=True)
+        fan_out(f"[Server] {name} joined the chat!\n".encode(), binary, room=LOBBY)
+    elif kind == protocol.LEAVE:
         with clients_lock:
-            remove_client(sock)
+            name = remote_members.pop(sender_id, str(payload, 'utf-8'))
+            room = remote_rooms.pop(sender_id, LOBBY)
+            remote_names.pop(name, None)
+            refresh_snapshot(everyone=False, remote=True)
+        # A cluster stops all its workers at once; see close_session()
+        if not draining:
+            fan_out(f"[Server] {name} left the chat!\n".encode(), binary, room=room)
+    elif kind == protocol.ROOM:
+        name = remote_members.get(sender_id, '?')
+        old, room = remote_rooms.get(sender_id, LOBBY), str(payload, 'utf-8')
+        remote_rooms[sender_id] = room
+        name_bytes = name.encode()
+        fan_out(f"[Server] {name} left {old}\n".encode(),
+                protocol.pack(protocol.LEAVE, sender_id, name_bytes), room=old)
+        fan_out(f"[Server] {name} joined {room}\n".encode(),
+                protocol.pack(protocol.JOIN, sender_id, name_bytes), room=room)
+    elif kind == protocol.CHAT:
+        name = remote_members.get(sender_id, '?')
+        text = b"".join((f"[{name}] ".encode(), payload, b"\n"))
+        room = remote_rooms.get(sender_id, LOBBY)
+        history.append(room, text, binary)
+        if journal:
+            journal.append(room, sender_id, name, payload)
+        fan_out(text, binary, room=room)
+    elif kind == protocol.DIRECT:
+        target, _, message = bytes(payload).partition(b"\n")
+        recipient = names.get(str(target, 'utf-8'))
+        if recipient is None:
+            return
+        if recipient.binary:
+            deliver(recipient, protocol.pack(protocol.DIRECT, sender_id, message))
+        else:
+            name = remote_members.get(sender_id, '?')
+            deliver(recipient, b"".join((f"[{name} -> you] ".encode(),
+                                         message.replace(b"\n", b" "), b"\n")))
+    else:
+        text = b"".join((b"[Server] ", payload, b"\n"))
+        fan_out(text, binary)
+
+def roster():
+    """Every online username, across cluster workers too"""
+    view = snapshot
+    return [session.username for session in view.everyone] + list(view.remote)
+
+def list_reply(session):
+    text, binary = snapshot.list_replies()
+    return binary if session.binary else text
+
+def outboxes():
+    return [session.outbox for session in snapshot.everyone]
+
+metrics.gauge('clients', lambda: len(clients))
+metrics.gauge('rooms', lambda: len(rooms))
+metrics.gauge('threads', threading.active_count)
+metrics.gauge('timers', lambda: len(wheel))
+metrics.gauge('history_messages', lambda: len(history))
+metrics.gauge('history_bytes', lambda: history.bytes)
+metrics.gauge('rate_limit_messages', lambda: limits.messages)
+metrics.gauge('rate_limit_bytes', lambda: limits.bytes)
+metrics.gauge('rate_limit_global_messages', lambda: limits.global_messages)
+metrics.gauge('throttled_clients', lambda: sum(
+    1 for s in list(sessions.values()) if s.throttle and s.throttle.until > time.monotonic()))
+metrics.gauge('broadcast_shards', lambda: len(senders) if senders else 1)
+metrics.gauge('broadcast_shard_backlog', lambda: senders.backlog() if senders else 0)
+metrics.gauge('journal_pending', lambda: len(journal.pending) if journal else 0)
+metrics.gauge('outbox_queued_bytes', lambda: sum(o.queued_bytes for o in outboxes()))
+metrics.gauge('outbox_queued_bytes_max', lambda: max((o.queued_bytes for o in outboxes()), default=0))
+metrics.gauge('outbox_queued_frames_max', lambda: max((len(o.frames) for o in outboxes()), default=0))
+
+def send_to(sock, data):
+    session = sessions.get(sock)
+    if session:
+        deliver(session, data)
+
+def add_client(sock, username, policy=None, binary=False, write_policy=None, compress=False):
+    """Register and return a new Session, or None if username is taken"""
+    session = Session(sock, username, Outbox(sock, policy, write_policy, compress), binary)
+    with clients_lock:
+        if username in names or username in remote_names:
+            return None
+        clients[sock] = username
+        sessions[sock] = session
+        names[username] = session
+        rooms[LOBBY][sock] = session
+        # WELCOME is the first frame: queue it before broadcasts can see the session
+        if binary:
+            session.outbox.put(protocol.pack(protocol.WELCOME, session.id, username.encode()))
+        refresh_snapshot(LOBBY)
+        log.info("%s joined (%d clients)", username, len(clients))
+    session.outbox.start()
+    return session
 
 def remove_client(sock):
     username = None
     if sock in clients:
         username = clients[sock]
         del clients[sock]
-        print(f"{username} left ({len(clients)} clients)")
+        log.info("%s left (%d clients)", username, len(clients))
+    session = sessions.pop(sock, None)
+    if session:
+        if names.get(session.username) is session:
+            del names[session.username]
+        members = rooms[session.room]
+        members.pop(sock, None)
+        if not members and session.room != LOBBY:
+            del rooms[session.room]
+        refresh_snapshot(session.room)
+        session.outbox.close()
     return username
 
-def handle_client(conn, addr):
+def handshake(conn, addr, reader, timeout=HANDSHAKE_TIMEOUT, prompt=PROMPT):
+    """Prompt for a username; None if the client stalls or disconnects"""
     try:
-        while True:
-            data = conn.recv(1024)
-            if not data:
-                break
-            message = data.decode().strip()
-            if message == "/list":
-                conn.send(f"Current clients: {', '.join(clients.values())}\n".encode())
-                continue
-            elif message == "/quit":
-                break
-            print(f"[{clients[conn]}] {message}")
-            broadcast(data, sender_sock=conn)
-    except Exception as e:
-        print(f"Error with client {addr}: {e}")
+        conn.send(prompt)
+        frame = reader.read_frame(deadline=time.monotonic() + timeout)
+        if frame is None:
+            handshake_failures.inc()
+            return None
+        return str(frame, 'utf-8').strip()
+    except (OSError, ValueError) as e:
+        log.warning("Handshake with %s failed: %s", addr, e)
+        handshake_failures.inc()
+        return None
     finally:
-        with clients_lock:
-            username = remove_client(conn)
-        broadcast(f"{username} left the chat!\n".encode())
+        conn.settimeout(None)
+
+def handle_text(session, frame):
+    """Act on one line from a text client; False once the client quits"""
+    conn = session.sock
+    session.last_seen = time.monotonic()
+    messages_in.inc()
+    bytes_in.inc(len(frame) + 1)
+    message = str(frame, 'utf-8').strip()
+    if not message:
+        return True
+    command, _, arg = message.partition(" ")
+    if command == "/list":
+        deliver(session, list_reply(session))
+    elif command == "/msg":
+        target, _, text = arg.strip().partition(" ")
+        if not target or not text.strip():
+            deliver(session, b"Usage: /msg <user> <text>\n")
+        elif not direct(session, target, text.strip().encode()):
+            deliver(session, f"No such user: {target}\n".encode())
+    elif command == "/history":
+        count = arg.strip() or str(history.replay)
+        if not count.isdigit():
+            deliver(session, b"Usage: /history [N]\n")
+        elif not replay(session, int(count), durable=True):
+            deliver(session, f"No messages in {session.room} yet\n".encode())
+    elif command == "/stats":
+        send_to(conn, metrics.render().encode())
+    elif command == "/quit":
+        return False
+    elif command == "/join":
+        if arg.strip():
+            move_to_room(session, arg.strip())
+        else:
+            send_to(conn, b"Usage: /join <room>\n")
+    elif command == "/leave":
+        room = arg.strip() or session.room
+        if room == session.room:
+            move_to_room(session, LOBBY)
+        else:
+            send_to(conn, f"You are not in {room}\n".encode())
+    else:
+        log.debug("[%s] %s", session.username, message)
+        broadcast(frame, sender_sock=conn)
+    return True
+
+def handle_packet(session, packet):
+    """Act on one packet from a binary client; False once the client quits"""
+    conn = session.sock
+    kind, _, payload = packet
+    session.last_seen = time.monotonic()
+    messages_in.inc()
+    bytes_in.inc(protocol.HEADER.size + len(payload))
+    if kind == protocol.CHAT:
+        broadcast(payload, sender_sock=conn)
+    elif kind == protocol.LIST:
+        deliver(session, list_reply(session))
+    elif kind == protocol.DIRECT:
+        target, _, message = bytes(payload).partition(b"\n")
+        if not direct(session, str(target, 'utf-8'), message):
+            notice = f"No such user: {str(target, 'utf-8')}".encode()
+            deliver(session, protocol.pack(protocol.NOTICE, 0, notice))
+    elif kind == protocol.HISTORY:
+        count = bytes(payload)
+        replay(session, int(count) if count.isdigit() else history.replay, durable=True)
+    elif kind == protocol.STATS:
+        send_to(conn, protocol.pack(protocol.STATS, 0, metrics.render().encode()))
+    elif kind == protocol.PING:
+        deliver(session, protocol.pack(protocol.PONG, 0))
+    elif kind == protocol.QUIT:
+        return False
+    elif kind == protocol.JOIN and payload:
+        move_to_room(session, str(payload, 'utf-8'))
+    elif kind == protocol.LEAVE and payload in (b"", session.room.encode()):
+        move_to_room(session, LOBBY)
+    return True
+
+def handle_traced(handle, session, frame, reader):
+    """handle(session, frame) while tracing: if the message is sampled, record its spans"""
+    tracer = tracing.tracer
+    if not (tracer and tracer.sampled()):
+        return handle(session, frame)
+    if reader.recv_span:
+        start, end, size = reader.recv_span
+        tracer.span('recv', start, end, bytes=size)
+    start = time.perf_counter()
+    tracer.begin()
+    try:
+        return handle(session, frame)
+    finally:
+        tracer.end()
+        tracer.span(handle.__name__, start, time.perf_counter(), user=session.username)
+
+def text_loop(session, reader):
+    while True:
+        frame = reader.read_frame()
+        if frame is None:
+            return
+        if not (handle_traced(handle_text, session, frame, reader) if tracing.tracer
+                else handle_text(session, frame)):
+            return
+        if session.throttle:
+            # Not reading lets TCP push back on the sender
+            time.sleep(session.throttle.charge(len(frame) + 1))
+
+def binary_loop(session, reader):
+    while True:
+        packet = protocol.read_packet(reader)
+        if packet is None:
+            return
+        if not (handle_traced(handle_packet, session, packet, reader) if tracing.tracer
+                else handle_packet(session, packet)):
+            return
+        if session.throttle:
+            time.sleep(session.throttle.charge(protocol.HEADER.size + len(packet[2])))
+
+def open_session(conn, addr, name, slow_consumer=None, write_policy=None):
+    """Register a client that completed the handshake and announce it; None if the name is taken"""
+    name, compress = protocol.negotiate_compression(name)
+    username, binary = protocol.negotiate(name)
+    session = add_client(conn, username, slow_consumer, binary, write_policy, compress)
+    if session is None:
+        return None
+    session.throttle = limits.throttle()
+    watch(session)
+    replay(session, history.replay)
+    announce(protocol.JOIN, session, f"{username} joined the chat!", LOBBY)
+    publish(protocol.pack(protocol.JOIN, session.id, username.encode()))
+    log.info("New connection from %s", addr)
+    return session
+
+def close_session(session):
+    """Unregister a client, announce it left and close its socket"""
+    conn = session.sock
+    if session.timer:
+        wheel.cancel(session.timer)
+    with clients_lock:
+        username = remove_client(conn)
+    if username is not None:
+        # While draining, telling the remaining clients would cost
+        # O(clients^2) notices that nobody is around to read
+        if not draining:
+            announce(protocol.LEAVE, session, f"{username} left the chat!", session.room)
+        publish(protocol.pack(protocol.LEAVE, session.id, username.encode()))
+    try:
+        conn.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    # Wait for the writer so it never touches the fd after close()
+    session.outbox.thread.join(timeout=1.0)
+    conn.close()
+
+def handle_client(conn, addr, handshake_timeout=HANDSHAKE_TIMEOUT, slow_consumer=None,
+                  max_frame=MAX_FRAME, write_policy=None):
+    connections_total.inc()
+    reader = FrameReader(conn, max_frame)
+    session = None
+    name = handshake(conn, addr, reader, handshake_timeout)
+    while name is not None:
+        session = open_session(conn, addr, name, slow_consumer, write_policy)
+        if session:
+            break
+        name = handshake(conn, addr, reader, handshake_timeout, NAME_TAKEN)
+    if session is None:
         conn.close()
+        return
+    try:
+        if session.binary:
+            binary_loop(session, reader)
+        else:
+            text_loop(session, reader)
+    except Exception as e:
+        log.warning("Error with client %s: %s", addr, e)
+    finally:
+        close_session(session)
+
+
+class PooledClient:
+    """A connection served by the worker pool: each step() handles whatever is readable"""
+
+    FRAMES_PER_STEP = 64  # then let other connections have a turn
 
-def tcp_server(port=8080, host='0.0.0.0', max_clients=128):
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server.bind((host, port))
-    server.listen(max_clients)
-    print(f"Server is listening on {host}:{port}")
+    def __init__(self, conn, addr, handshake_timeout=HANDSHAKE_TIMEOUT, slow_consumer=None,
+                 max_frame=MAX_FRAME, write_policy=None, release=None):
+        self.sock = conn
+        self.addr = addr
+        self.reader = FrameReader(conn, max_frame, socket.MSG_DONTWAIT)
+        self.handshake_timeout = handshake_timeout
+        self.deadline = time.monotonic() + handshake_timeout
+        self.slow_consumer = slow_consumer
+        self.write_policy = write_policy
+        self.release = release
+        self.session = None
+        self.resume = 0.0  # when a throttled client may be read again
+
+    def expired(self, now):
+        return self.session is None and now > self.deadline
+
+    def step(self):
+        try:
+            for _ in range(self.FRAMES_PER_STEP):
+                if self.session is None:
+                    if not self.handshake():
+                        break
+                elif self.session.binary:
+                    packet = protocol.read_packet(self.reader)
+                    if packet is None or not (
+                            handle_traced(handle_packet, self.session, packet, self.reader)
+                            if tracing.tracer else handle_packet(self.session, packet)):
+                        break
+                    if self.throttled(protocol.HEADER.size + len(packet[2])):
+                        return pool.PAUSE
+                else:
+                    frame = self.reader.read_frame()
+                    if frame is None or not (
+                            handle_traced(handle_text, self.session, frame, self.reader)
+                            if tracing.tracer else handle_text(self.session, frame)):
+                        break
+                    if self.throttled(len(frame) + 1):
+                        return pool.PAUSE
+            else:
+                return pool.AGAIN
+        except BlockingIOError:
+            return pool.WAIT
+        except Exception as e:
+            if self.session is None:
+                log.warning("Handshake with %s failed: %s", self.addr, e)
+                handshake_failures.inc()
+            else:
+                log.warning("Error with client %s: %s", self.addr, e)
+        self.finish()
+        return pool.DONE
+
+    def throttled(self, size):
+        """Charge a frame to the session's limits; True if reading must pause"""
+        if not self.session.throttle:
+            return False
+        delay = self.session.throttle.charge(size)
+        self.resume = time.monotonic() + delay
+        return delay > 0
+
+    def handshake(self):
+        """Read the name line; False if the client left first"""
+        if time.monotonic() > self.deadline:
+            raise socket.timeout("Frame not received before deadline")
+        frame = self.reader.read_frame()
+        if frame is None:
+            handshake_failures.inc()
+            return False
+        name = str(frame, 'utf-8').strip()
+        self.session = open_session(self.sock, self.addr, name, self.slow_consumer,
+                                    self.write_policy)
+        if self.session is None:
+            self.sock.send(NAME_TAKEN)
+            self.deadline = time.monotonic() + self.handshake_timeout
+        return True
+
+    def finish(self):
+        if self.session is None:
+            self.sock.close()
+        else:
+            close_session(self.session)
+        if self.release:
+            self.release()
+
+
+def reject(conn):
+    """Turn away a connection that arrived while the server was full"""
+    connections_rejected.inc()
     try:
-        while True:
-            conn, addr = server.accept()
-            conn.send(b"Enter your name: ")
-            username = conn.recv(1024).decode().strip()
-            with clients_lock:
-                clients[conn] = username
-                print(f"{username} joined ({len(clients)} clients)")
-            broadcast(f"{username} joined the chat!\n".encode())
-            print(f"New connection from {addr}")
-            thread = threading.Thread(
-                target=handle_client,
-                args=(conn, addr),
-                daemon=True
-            )
-            thread.start()
+        conn.send(SERVER_FULL, socket.MSG_DONTWAIT)
+    except OSError:
+        pass
+    conn.close()
+
+def drain(timeout=DRAIN_TIMEOUT, notice=SHUTTING_DOWN):
+    """Tell every client notice, then disconnect them all within timeout seconds
+
+    Each client's queued frames are flushed before its socket is shut
+    down. Disconnects are spread over most of the window, so clients do
+    not all reconnect at the same instant.
+    """
+    global draining
+    draining = True
+    # Straight to local clients: other cluster workers are not stopping
+    fan_out(b"".join((b"[Server] ", notice, b"\n")), protocol.pack(protocol.NOTICE, 0, notice))
+    if senders:
+        # The notice must be queued before outboxes stop taking frames
+        senders.flush(timeout)
+    members = snapshot.everyone
+    log.info("Draining %d clients over %.1fs", len(members), timeout)
+    start = time.monotonic()
+    spread = timeout * 0.8
+    for i, session in enumerate(members):
+        delay = start + spread * i / len(members) - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        session.outbox.drain()
+    while sessions and time.monotonic() - start < timeout:
+        time.sleep(0.05)
+    # Whoever is left (stuck writers, or clients registered meanwhile)
+    for session in list(sessions.values()):
+        session.outbox.abort()
+
+def serve_admitted(release, *args):
+    """handle_client in its own thread, giving back the admission slot afterwards"""
+    try:
+        handle_client(*args)
+    finally:
+        if release:
+            release()
+
+def tcp_server(port=8080, host='0.0.0.0', max_clients=128, handshake_timeout=HANDSHAKE_TIMEOUT,
+               slow_consumer=None, max_frame=MAX_FRAME, reuse_port=False, stats_port=None,
+               write_policy=None, max_connections=None, when_full=REJECT, handler=THREAD,
+               pool_size=POOL_SIZE, history_bytes=HISTORY_BYTES, history_replay=HISTORY_REPLAY,
+               history_max=HISTORY_MAX, heartbeat=HEARTBEAT, idle_timeout=IDLE_TIMEOUT,
+               drain_timeout=DRAIN_TIMEOUT,
+               control_path=None, takeover=None, journal_dir=None, journal_segment_bytes=SEGMENT_BYTES,
+               journal_sync_bytes=SYNC_BYTES, journal_sync_interval=SYNC_INTERVAL, rate_limits=None,
+               trace_path=None, trace_sample=tracing.SAMPLE, broadcast_shards=shards.DEFAULT,
+               stop=None):
+    """Serve until stop (a threading.Event) is set or on Ctrl-C, then drain
+
+    With takeover, the listening socket is taken from the server offering
+    it at that Unix socket path instead of being bound afresh. With
+    control_path, this server offers its own listener there, and stops
+    as soon as a replacement has taken it. With journal_dir, every chat
+    message is also appended to a durable journal there. With trace_path,
+    a trace_sample fraction of messages is traced, and the spans are
+    written there as a Chrome trace when the server stops. With
+    broadcast_shards above 1, that many sender threads share fan-out.
+    """
+    global history, liveness, draining, journal, limits, senders
+    draining = False
+    limits = rate_limits or RateLimits()
+    if trace_path:
+        tracing.start(trace_sample)
+    senders = shards.Shards(broadcast_shards).start() if broadcast_shards > 1 else None
+    history = History(history_bytes, history_replay, history_max)
+    journal = None
+    if journal_dir:
+        journal = Journal(journal_dir, journal_segment_bytes, journal_sync_bytes,
+                          journal_sync_interval).start()
+        log.info("Journaling to %s (%d messages so far)", journal_dir, journal.committed)
+    liveness = Heartbeat(heartbeat, idle_timeout)
+    if heartbeat:
+        wheel.start()
+    if takeover:
+        server = restart.take_listener(takeover)
+    else:
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # Lets every cluster worker bind the same port
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server.bind((host, port))
+        server.listen(max_clients)
+    # Poll so the loop notices stop; accepted sockets are still blocking
+    server.settimeout(ACCEPT_POLL)
+    stop = stop or threading.Event()
+    handed_off = threading.Event()
+    if control_path:
+        restart.offer_listener(control_path, server, handed_off)
+    if stats_port:
+        metrics.serve(stats_port)
+        log.info("Stats on http://127.0.0.1:%d/", stats_port)
+    slots = threading.BoundedSemaphore(max_connections) if max_connections else None
+    release = slots.release if slots else None
+    workers = pool.Pool(pool_size).start() if handler == POOL else None
+    log.info("Server is listening on %s:%d", host, port)
+    try:
+        while not (stop.is_set() or handed_off.is_set()):
+            # When full, HOLD stops accepting: new connections wait in
+            # the listen backlog, and the kernel refuses them once it fills
+            if slots and when_full == HOLD and not slots.acquire(timeout=ACCEPT_POLL):
+                continue
+            try:
+                conn, addr = server.accept()
+            except socket.timeout:
+                if slots and when_full == HOLD:
+                    slots.release()
+                continue
+            if slots and when_full == REJECT and not slots.acquire(blocking=False):
+                reject(conn)
+                continue
+            options = (handshake_timeout, slow_consumer, max_frame, write_policy)
+            if workers:
+                connections_total.inc()
+                try:
+                    conn.send(PROMPT)
+                except OSError:
+                    conn.close()
+                    if release:
+                        release()
+                    continue
+                workers.add(PooledClient(conn, addr, *options, release))
+            else:
+                # The name prompt runs in the client's own thread so a
+                # silent client can never hold up the accept loop.
+                thread = threading.Thread(
+                    target=serve_admitted,
+                    args=(release, conn, addr, *options),
+                    daemon=True
+                )
+                thread.start()
     except KeyboardInterrupt:
-        print("Server is shutting down")
-        server.close()
+        pass
+    # Only closes this process's reference: after a handoff the
+    # replacement keeps accepting on the same socket
+    server.close()
+    if control_path and not handed_off.is_set():
+        try:
+            os.unlink(control_path)
+        except FileNotFoundError:
+            pass
+    log.info("Server is shutting down")
+    drain(drain_timeout, RESTARTING if handed_off.is_set() else SHUTTING_DOWN)
+    if senders:
+        senders.stop()
+        senders = None
+    if journal:
+        journal.close()
+    if trace_path and tracing.tracer:
+        log.info("Wrote %d trace spans to %s", tracing.tracer.export(trace_path), trace_path)
+        tracing.stop()
+
+ENGINES = ('threaded', 'asyncio')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-client TCP chat server")
+    parser.add_argument('--engine', choices=ENGINES, default='threaded')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-clients', type=int, default=128)
+    parser.add_argument('--handshake-timeout', type=float, default=HANDSHAKE_TIMEOUT)
+    parser.add_argument('--max-frame', type=int, default=MAX_FRAME,
+                        help="longest line a client may send, in bytes")
+    parser.add_argument('--slow-consumer', choices=POLICIES, default=DROP_OLDEST,
+                        help="policy when a client's outbound queue is full")
+    parser.add_argument('--outbox-bytes', type=int, default=256 * 1024,
+                        help="most bytes queued for one client")
+    parser.add_argument('--max-backlog-secs', type=float, default=None,
+                        help="with --slow-consumer disconnect, drop clients this far behind "
+                             "(threaded engine)")
+    parser.add_argument('--max-connections', type=int, default=1024,
+                        help="most clients served at once, 0 for no limit (threaded engine)")
+    parser.add_argument('--when-full', choices=WHEN_FULL, default=REJECT,
+                        help="reject: tell new clients the server is full; "
+                             "hold: leave them in the listen backlog")
+    parser.add_argument('--handler', choices=HANDLERS, default=THREAD,
+                        help="thread: a reader thread per client; pool: --pool-size "
+                             "workers serve every readable client")
+    parser.add_argument('--pool-size', type=int, default=POOL_SIZE)
+    parser.add_argument('--write-mode', choices=WRITE_MODES, default=LATENCY,
+                        help="latency: flush at once with TCP_NODELAY; throughput: batch "
+                             "writes for up to --flush-delay (threaded engine)")
+    parser.add_argument('--flush-bytes', type=int, default=64 * 1024,
+                        help="most bytes coalesced into one sendmsg() call")
+    parser.add_argument('--flush-delay', type=float, default=0.002,
+                        help="seconds throughput mode waits for --flush-bytes to queue up")
+    parser.add_argument('--history', type=int, default=HISTORY_REPLAY,
+                        help="messages replayed to a client joining a room (threaded engine)")
+    parser.add_argument('--history-bytes', type=int, default=HISTORY_BYTES,
+                        help="memory budget for chat history across all rooms")
+    parser.add_argument('--history-max', type=int, default=HISTORY_MAX,
+                        help="most messages one /history N returns (threaded engine)")
+    parser.add_argument('--journal', metavar='DIR',
+                        help="append every chat message to a durable journal in DIR, which "
+                             "/history then reads (threaded engine; worker i uses DIR/worker-i)")
+    parser.add_argument('--journal-segment-bytes', type=int, default=SEGMENT_BYTES,
+                        help="size at which the journal starts a new segment file")
+    parser.add_argument('--journal-sync-bytes', type=int, default=SYNC_BYTES,
+                        help="fsync the journal once this many bytes are unsynced")
+    parser.add_argument('--journal-sync-interval', type=float, default=SYNC_INTERVAL,
+                        help="seconds a journaled message may wait for its fsync")
+    parser.add_argument('--rate-messages', type=float, default=0,
+                        help="messages per second each client may send, 0 for no limit "
+                             "(threaded engine); faster clients are not read until they comply")
+    parser.add_argument('--rate-bytes', type=float, default=0,
+                        help="bytes per second each client may send, 0 for no limit")
+    parser.add_argument('--rate-global-messages', type=float, default=0,
+                        help="messages per second all clients together may send, 0 for no limit")
+    parser.add_argument('--rate-burst', type=float, default=1.0,
+                        help="seconds' worth of traffic a client may send at once")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="trace sampled messages and write a Chrome trace to FILE on exit "
+                             "or SIGUSR1 (threaded engine; worker i of --workers writes FILE-i)")
+    parser.add_argument('--trace-sample', type=float, default=tracing.SAMPLE,
+                        help="fraction of messages traced")
+    parser.add_argument('--broadcast-shards', type=int, default=shards.DEFAULT,
+                        help="sender threads sharing fan-out, 1 to fan out on the sending thread "
+                             f"(threaded engine; default {shards.DEFAULT}, more on free-threaded "
+                             "Python)")
+    parser.add_argument('--heartbeat', type=float, default=HEARTBEAT,
+                        help="seconds of silence before a client is pinged, 0 to disable "
+                             "(threaded engine)")
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help="seconds of silence before a binary client is disconnected")
+    parser.add_argument('--drain-timeout', type=float, default=DRAIN_TIMEOUT,
+                        help="seconds to disconnect clients gracefully when stopping")
+    parser.add_argument('--control-socket', metavar='PATH',
+                        help="offer the listening socket to a replacement process here")
+    parser.add_argument('--takeover', metavar='PATH',
+                        help="take the listening socket from the server offering it at PATH")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="worker processes sharing the port via SO_REUSEPORT (threaded engine)")
+    parser.add_argument('--stats-port', type=int, default=None,
+                        help="serve plaintext stats on 127.0.0.1:PORT (threaded engine; "
+                             "worker i of --workers uses PORT+i)")
+    parser.add_argument('--log-level', choices=logs.LEVELS, default='info')
+    parser.add_argument('--log-rate', type=float, default=10.0,
+                        help="log records per second per call site (0 = unlimited)")
+    args = parser.parse_args(argv)
+    logs.setup(args.log_level, args.log_rate)
+    options = {
+        'port': args.port,
+        'host': args.host,
+        'max_clients': args.max_clients,
+        'handshake_timeout': args.handshake_timeout,
+        'max_frame': args.max_frame,
+        'slow_consumer': SlowConsumerPolicy(
+            args.slow_consumer, args.outbox_bytes, args.max_backlog_secs
+        ),
+    }
+    if args.engine == 'asyncio':
+        from async_server import tcp_server as serve
+    else:
+        serve = tcp_server
+        options['write_policy'] = WritePolicy(args.write_mode, args.flush_bytes, args.flush_delay)
+        options['stats_port'] = args.stats_port
+        options['max_connections'] = args.max_connections
+        options['when_full'] = args.when_full
+        options['handler'] = args.handler
+        options['pool_size'] = args.pool_size
+        options['history_bytes'] = args.history_bytes
+        options['history_replay'] = args.history
+        options['history_max'] = args.history_max
+        options['heartbeat'] = args.heartbeat
+        options['idle_timeout'] = args.idle_timeout
+        options['drain_timeout'] = args.drain_timeout
+        options['rate_limits'] = RateLimits(args.rate_messages, args.rate_bytes,
+                                            args.rate_global_messages, args.rate_burst)
+        options['journal_dir'] = args.journal
+        options['trace_path'] = args.trace
+        options['broadcast_shards'] = args.broadcast_shards
+        options['trace_sample'] = args.trace_sample
+        options['journal_segment_bytes'] = args.journal_segment_bytes
+        options['journal_sync_bytes'] = args.journal_sync_bytes
+        options['journal_sync_interval'] = args.journal_sync_interval
+        if args.workers > 1:
+            if args.control_socket or args.takeover:
+                parser.error("--control-socket and --takeover need a single worker")
+            from cluster import run_cluster
+            serve = functools.partial(run_cluster, args.workers)
+        else:
+            options['control_path'] = args.control_socket
+            options['takeover'] = args.takeover
+            stop = options['stop'] = threading.Event()
+            # SIGTERM drains like Ctrl-C does
+            signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+            if args.trace:
+                # A snapshot of the spans so far, without stopping
+                signal.signal(signal.SIGUSR1, lambda signum, frame: tracing.tracer and
+                              tracing.tracer.export(args.trace))
+    serve(**options)
 
 if __name__ == "__main__":
-    tcp_server()
+    main()
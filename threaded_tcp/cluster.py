@@ -0,0 +1,194 @@
+"""Run several chat server worker processes on one port
+
+Each worker binds its own listening socket with SO_REUSEPORT, so the
+kernel spreads new connections across them. The parent process runs a
+hub that relays a broadcast bus between workers over a Unix domain
+socket: chat lines, notices and join/leave events travel as
+protocol.pack() packets, so every user sees every message and /list
+returns the global roster.
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import tempfile
+import threading
+import time
+
+import chat_server
+import protocol
+from framing import FrameReader, MAX_FRAME
+from ratelimit import RateLimits
+
+
+LOBBY = chat_server.LOBBY.encode()
+STOP_MARGIN = 5.0  # seconds a worker gets past its drain timeout before it is killed
+
+log = logging.getLogger('chat_server')
+
+
+def max_packet(max_frame=MAX_FRAME):
+    """Longest packet a worker publishes: a client's frame behind a packet header"""
+    return max_frame + protocol.HEADER.size
+
+
+class Bus:
+    """A worker's connection to the hub"""
+
+    def __init__(self, path, max_packet=max_packet()):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.lock = threading.Lock()
+        self.max_packet = max_packet
+        self.lost = False
+
+    def publish(self, packet):
+        """Send packet to the other workers; without a hub, only local clients see it"""
+        try:
+            with self.lock:
+                self.sock.sendall(packet)
+        except OSError as e:
+            # Must not raise: callers are registering or closing a session
+            if not self.lost:
+                self.lost = True
+                log.error("Cannot publish to the cluster hub: %s", e)
+
+    def listen(self):
+        """Deliver packets published by other workers (runs in a thread)"""
+        reader = FrameReader(self.sock, self.max_packet)
+        while True:
+            packet = protocol.read_packet(reader)
+            if packet is None:
+                log.error("Lost connection to the cluster hub")
+                return
+            chat_server.deliver_remote(*packet)
+
+
+class Hub:
+    """Relays every packet from one worker to all the others"""
+
+    def __init__(self, sock, max_packet=max_packet()):
+        self.sock = sock
+        self.max_packet = max_packet
+        self.workers = {}  # {worker socket: {sender id: [username, room]}}
+        self.lock = threading.Lock()
+
+    def serve_forever(self):
+        while True:
+            conn, _ = self.sock.accept()
+            with self.lock:
+                # Late joiners learn who is already online
+                for members in self.workers.values():
+                    for sender_id, (name, room) in members.items():
+                        conn.sendall(protocol.pack(protocol.JOIN, sender_id, name))
+                        if room != LOBBY:
+                            conn.sendall(protocol.pack(protocol.ROOM, sender_id, room))
+                self.workers[conn] = {}
+            threading.Thread(target=self.relay, args=(conn,), daemon=True).start()
+
+    def relay(self, conn):
+        reader = FrameReader(conn, self.max_packet)
+        try:
+            while True:
+                packet = protocol.read_packet(reader)
+                if packet is None:
+                    break
+                kind, sender_id, payload = packet
+                if kind in (protocol.JOIN, protocol.LEAVE, protocol.ROOM):
+                    with self.lock:
+                        members = self.workers[conn]
+                        if kind == protocol.JOIN:
+                            members[sender_id] = [bytes(payload), LOBBY]
+                        elif kind == protocol.ROOM and sender_id in members:
+                            members[sender_id][1] = bytes(payload)
+                        else:
+                            members.pop(sender_id, None)
+                self.send_others(conn, protocol.pack(kind, sender_id, payload))
+        except (OSError, ValueError) as e:
+            log.warning("Error relaying for worker: %s", e)
+        finally:
+            with self.lock:
+                members = self.workers.pop(conn, {})
+            # A dead worker's users are gone everywhere else too
+            for sender_id, (name, _) in members.items():
+                self.send_others(conn, protocol.pack(protocol.LEAVE, sender_id, name))
+            conn.close()
+
+    def send_others(self, origin, packet):
+        with self.lock:
+            for conn in self.workers:
+                if conn is not origin:
+                    try:
+                        conn.sendall(packet)
+                    except OSError:
+                        pass
+
+
+def run_worker(index, workers, bus_path, options):
+    stop = threading.Event()
+    # The parent forwards SIGTERM to drain each worker; Ctrl-C reaches the
+    # whole process group, so workers leave it to the parent
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Interleaved ids keep sender ids unique across the cluster
+    chat_server.session_ids = itertools.count(index + 1, workers)
+    if options.get('stats_port'):
+        options = dict(options, stats_port=options['stats_port'] + index)
+    if options.get('journal_dir'):
+        # Each worker journals what it sees, local and remote, on its own
+        options = dict(options, journal_dir=os.path.join(options['journal_dir'], f"worker-{index}"))
+    if options.get('trace_path'):
+        options = dict(options, trace_path=f"{options['trace_path']}-{index}")
+    limits = options.get('rate_limits')
+    if limits and limits.global_messages:
+        # SO_REUSEPORT spreads clients evenly, so each worker takes its share
+        options = dict(options, rate_limits=RateLimits(
+            limits.messages, limits.bytes, limits.global_messages / workers, limits.burst))
+    chat_server.bus = Bus(bus_path, max_packet(options.get('max_frame', MAX_FRAME)))
+    threading.Thread(target=chat_server.bus.listen, daemon=True).start()
+    chat_server.tcp_server(reuse_port=True, stop=stop, **options)
+
+def run_cluster(workers=None, **options):
+    """Fork workers sharing options['port'] and relay the bus until interrupted"""
+    workers = workers or os.cpu_count()
+    bus_dir = tempfile.mkdtemp(prefix='chat-bus-')
+    bus_path = os.path.join(bus_dir, 'bus.sock')
+    hub_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    hub_sock.bind(bus_path)
+    hub_sock.listen(workers)
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, terminate)
+    ctx = multiprocessing.get_context('fork')
+    procs = [
+        ctx.Process(target=run_worker, args=(i, workers, bus_path, options), daemon=True)
+        for i in range(workers)
+    ]
+    for proc in procs:
+        proc.start()
+    threading.Thread(target=Hub(hub_sock, max_packet(options.get('max_frame', MAX_FRAME))).serve_forever, daemon=True).start()
+    log.info("Cluster of %d workers on port %d", workers, options.get('port', 8080))
+    try:
+        for proc in procs:
+            proc.join()
+    except KeyboardInterrupt:
+        log.info("Cluster is shutting down")
+    finally:
+        # SIGTERM: every worker drains its own clients, all at once
+        for proc in procs:
+            proc.terminate()
+        deadline = time.monotonic() + options.get('drain_timeout', chat_server.DRAIN_TIMEOUT) + STOP_MARGIN
+        for proc in procs:
+            proc.join(max(0.0, deadline - time.monotonic()))
+        for proc in procs:
+            if proc.is_alive():
+                log.warning("Worker %d did not drain in time; killing it", proc.pid)
+                proc.kill()
+                proc.join()
+        hub_sock.close()
+        os.unlink(bus_path)
+        os.rmdir(bus_dir)
@@ -0,0 +1,94 @@
+import socket
+import time
+
+import tracing
+
+
+MAX_FRAME = 4096  # longest line or packet a client may send
+
+
+class FrameTooLarge(ValueError):
+    pass
+
+
+class FrameReader:
+    """Split a socket's byte stream into frames
+
+    Reads land in one preallocated bytearray via recv_into. Frames are
+    returned as memoryview slices of that buffer, so a frame is only
+    valid until the next read call. With a deadline (a time.monotonic()
+    value) the whole frame must arrive before it, otherwise
+    socket.timeout is raised. With flags=socket.MSG_DONTWAIT reads raise
+    BlockingIOError instead of waiting; nothing buffered is lost, so the
+    same call can simply be retried once the socket is readable.
+    """
+
+    def __init__(self, sock, max_frame=MAX_FRAME, flags=0):
+        self.sock = sock
+        self.max_frame = max_frame
+        self.flags = flags
+        self.buf = bytearray(max_frame)
+        self.view = memoryview(self.buf)
+        self.start = 0  # first unconsumed byte
+        self.scan = 0   # no newline in buf[start:scan]
+        self.end = 0    # end of received data
+        self.recv_span = None  # (start, end, bytes) of the last recv, while tracing
+
+    def read_frame(self, deadline=None):
+        """Next newline-delimited line without its line ending, or None at EOF
+
+        Partial data left when the peer closes is discarded.
+        """
+        while True:
+            i = self.buf.find(b"\n", self.scan, self.end)
+            if i >= 0:
+                stop = i - 1 if i > self.start and self.buf[i - 1] == 0x0D else i
+                frame = self.view[self.start:stop]
+                self.start = self.scan = i + 1
+                return frame
+            self.scan = self.end
+            if not self._fill(deadline):
+                return None
+
+    def peek(self, n, deadline=None):
+        """Next n bytes without consuming them, or None at EOF"""
+        if n > self.max_frame:
+            raise FrameTooLarge(f"Frame exceeds {self.max_frame} bytes")
+        while self.end - self.start < n:
+            if not self._fill(deadline):
+                return None
+        return self.view[self.start:self.start + n]
+
+    def read_exact(self, n, deadline=None):
+        """Next n bytes, or None at EOF"""
+        frame = self.peek(n, deadline)
+        if frame is not None:
+            self.start += n
+            self.scan = max(self.scan, self.start)
+        return frame
+
+    def _fill(self, deadline):
+        """Receive more data into the buffer; False at EOF"""
+        if self.start:
+            # Slide the partial frame to the front to make room
+            pending = self.end - self.start
+            self.view[:pending] = self.view[self.start:self.end]
+            self.scan -= self.start
+            self.start, self.end = 0, pending
+        if self.end == self.max_frame:
+            raise FrameTooLarge(f"Frame exceeds {self.max_frame} bytes")
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout("Frame not received before deadline")
+            self.sock.settimeout(remaining)
+        if tracing.tracer:
+            start = time.perf_counter()
+            n = self.sock.recv_into(self.view[self.end:], 0, self.flags)
+            self.recv_span = (start, time.perf_counter(), n)
+        else:
+            n = self.sock.recv_into(self.view[self.end:], 0, self.flags)
+        if not n:
+            return False
+        self.end += n
+        return True
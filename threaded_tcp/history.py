@@ -0,0 +1,68 @@
+"""Recent chat messages per room, kept as already-encoded frames
+
+Broadcast stores the same text and binary frames it queued on the
+outboxes, so replaying history to a new client never re-encodes
+anything. Every room shares one byte budget: once it is exceeded the
+oldest message on the server is evicted, whichever room it was in.
+"""
+import collections
+import itertools
+import threading
+
+
+MAX_BYTES = 256 * 1024  # frame bytes kept across all rooms
+REPLAY = 20  # messages replayed to a client joining a room
+MAX_REPLAY = 1000  # most messages one /history may ask for
+
+
+class History:
+    """Bounded per-room message rings under one global byte budget
+
+    Has its own lock, held only to append or copy out a few frames, so
+    recording and replay never wait on the registry's clients_lock.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES, replay=REPLAY, max_replay=MAX_REPLAY):
+        self.max_bytes = max_bytes
+        self.replay = replay  # default count for a replay
+        self.max_replay = max_replay  # cap on the count a client may ask for
+        self.rooms = {}  # {room: deque of (text frame, binary frame)}
+        self.order = collections.deque()  # room of every stored message, oldest first
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.order)
+
+    def append(self, room, text, binary):
+        size = len(text) + len(binary)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            ring = self.rooms.get(room)
+            if ring is None:
+                ring = self.rooms[room] = collections.deque()
+            ring.append((text, binary))
+            self.order.append(room)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                # Messages leave each room's ring in the order they
+                # entered the global one, so the oldest is at its left
+                oldest = self.order.popleft()
+                ring = self.rooms[oldest]
+                old_text, old_binary = ring.popleft()
+                self.bytes -= len(old_text) + len(old_binary)
+                if not ring:
+                    del self.rooms[oldest]
+
+    def last(self, room, n, binary=False):
+        """Up to n of room's most recent frames, oldest first"""
+        if n <= 0:
+            return []
+        with self.lock:
+            ring = self.rooms.get(room)
+            if not ring:
+                return []
+            frames = [entry[binary] for entry in itertools.islice(reversed(ring), n)]
+        frames.reverse()
+        return frames
@@ -0,0 +1,329 @@
+"""Durable append-only journal of chat messages
+
+broadcast() only appends a tuple to an in-memory deque; a dedicated
+writer thread encodes what has piled up, writes it in a few calls and
+fsyncs in groups: once sync_bytes are unsynced or the oldest unsynced
+record is sync_interval seconds old, whichever comes first.
+
+On disk the journal is a directory of segments. Segment NNN.log holds
+records from sequence number NNN on; NNN.idx holds one big-endian u64
+per record, its offset in the .log, so any sequence number is found
+with one lookup. A segment is closed once it reaches segment_bytes.
+Reads (history, export) go through read-only mmaps of the segments.
+
+Record layout (big-endian):
+
+    message length (u32) | time (f64) | sender id (u32) |
+    room length (u16) | name length (u16) | room | name | message
+
+    python journal.py DIR [--since SEQ] [--room ROOM]   # export as JSON lines
+"""
+import argparse
+import bisect
+import collections
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+import metrics
+
+
+RECORD = struct.Struct('!IdIHH')
+OFFSET = struct.Struct('!Q')
+SEGMENT_BYTES = 64 * 1024 * 1024
+SYNC_BYTES = 1024 * 1024
+SYNC_INTERVAL = 0.05  # seconds a record may wait for its fsync
+CHUNK = 32  # records encoded between writes, each of which releases the GIL
+SCAN = 10000  # records tail() looks back through at most
+
+log = logging.getLogger('chat_server')
+journal_records = metrics.counter('journal_records')
+journal_bytes = metrics.counter('journal_bytes')
+journal_fsyncs = metrics.counter('journal_fsyncs')
+journal_fsync_seconds = metrics.histogram('journal_fsync_seconds')
+
+
+def encode(when, sender_id, room, name, message):
+    room = room.encode()
+    name = name.encode()
+    return b"".join((RECORD.pack(len(message), when, sender_id, len(room), len(name)),
+                     room, name, message))
+
+def decode(buf, offset):
+    """(time, sender id, room, name, message) of the record at offset"""
+    length, when, sender_id, room_len, name_len = RECORD.unpack_from(buf, offset)
+    start = offset + RECORD.size
+    room = str(buf[start:start + room_len], 'utf-8')
+    start += room_len
+    name = str(buf[start:start + name_len], 'utf-8')
+    start += name_len
+    return when, sender_id, room, name, bytes(buf[start:start + length])
+
+def record_end(buf, offset):
+    length, _, _, room_len, name_len = RECORD.unpack_from(buf, offset)
+    return offset + RECORD.size + room_len + name_len + length
+
+
+class Segment:
+    """One .log file and its .idx, with read-only maps once it is closed"""
+
+    def __init__(self, directory, base):
+        self.base = base  # sequence number of the first record
+        self.log_path = os.path.join(directory, f"{base:020d}.log")
+        self.idx_path = os.path.join(directory, f"{base:020d}.idx")
+        self.maps = None
+
+    def map(self, count):
+        """(log map, idx map) covering at least count records"""
+        if self.maps and len(self.maps[1]) >= count * OFFSET.size:
+            return self.maps
+        maps = []
+        for path in (self.log_path, self.idx_path):
+            with open(path, 'rb') as f:
+                maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        self.maps = tuple(maps)
+        return self.maps
+
+
+class Journal:
+    """Append-only, segmented, group-committed record of chat messages
+
+    With readonly, the journal is only read (records(), tail()): files
+    are never created, opened for writing or truncated, so it is safe
+    on the directory of a running server. It then sees the records
+    indexed when it was opened.
+    """
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, sync_bytes=SYNC_BYTES,
+                 sync_interval=SYNC_INTERVAL, readonly=False):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.sync_bytes = sync_bytes
+        self.sync_interval = sync_interval
+        self.pending = collections.deque()  # appended, not yet written
+        self.wake = threading.Event()  # set when pending gains records or on close
+        self.lock = threading.Lock()  # guards segments and committed
+        self.closed = False
+        if not readonly:
+            os.makedirs(directory, exist_ok=True)
+        bases = sorted(int(name[:-4]) for name in os.listdir(directory) if name.endswith('.log'))
+        self.segments = [Segment(directory, base) for base in bases]
+        self.bases = bases
+        if readonly:
+            self.committed = self._recover(truncate=False) if self.segments else 0
+            return
+        if not self.segments:
+            self._add_segment(0)
+        self.committed = self._recover()  # records readers may see
+        self._open_active()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _add_segment(self, base):
+        segment = Segment(self.directory, base)
+        for path in (segment.log_path, segment.idx_path):
+            open(path, 'ab').close()
+        self.segments.append(segment)
+        self.bases.append(base)
+        return segment
+
+    def _recover(self, truncate=True):
+        """The total number of whole records; with truncate, drop a torn tail left by a crash"""
+        active = self.segments[-1]
+        count = os.path.getsize(active.idx_path) // OFFSET.size
+        size = os.path.getsize(active.log_path)
+        with open(active.log_path, 'rb') as f:
+            data = f.read()
+        with open(active.idx_path, 'rb') as f:
+            idx = f.read(count * OFFSET.size)
+        # Keep indexed records whose bytes all made it to the log
+        while count:
+            offset, = OFFSET.unpack_from(idx, (count - 1) * OFFSET.size)
+            if offset + RECORD.size <= size and record_end(data, offset) <= size:
+                break
+            count -= 1
+        if truncate:
+            end = record_end(data, OFFSET.unpack_from(idx, (count - 1) * OFFSET.size)[0]) if count else 0
+            os.truncate(active.log_path, end)
+            os.truncate(active.idx_path, count * OFFSET.size)
+        return active.base + count
+
+    def _open_active(self):
+        active = self.segments[-1]
+        self.log = open(active.log_path, 'ab', buffering=0)
+        self.idx = open(active.idx_path, 'ab', buffering=0)
+        self.position = os.path.getsize(active.log_path)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def append(self, room, sender_id, name, message):
+        """Queue a message for the writer; cheap enough for the broadcast path"""
+        self.pending.append((time.time(), sender_id, room, name, bytes(message)))
+        # Only the first append after the writer went idle pays for set()
+        if not self.wake.is_set():
+            self.wake.set()
+
+    def close(self):
+        """Write and fsync everything appended so far, then stop the writer"""
+        self.closed = True
+        self.wake.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        else:
+            while self.pending:
+                self._write_pending()
+            self._sync()
+
+    def _run(self):
+        unsynced = 0
+        oldest = None  # when the oldest unsynced record was written
+        while True:
+            if not self.pending:
+                if self.closed:
+                    break
+                self.wake.clear()
+                # Checked again after clear(): an append in between left wake set
+                if not self.pending and not self.closed:
+                    # Idle until a record arrives, or until unsynced ones are due
+                    self.wake.wait(oldest + self.sync_interval - time.monotonic()
+                                   if unsynced else None)
+            written = self._write_pending()
+            if written:
+                unsynced += written
+                oldest = oldest or time.monotonic()
+            if unsynced and (unsynced >= self.sync_bytes
+                             or time.monotonic() - oldest >= self.sync_interval):
+                self._sync()
+                unsynced, oldest = 0, None
+        self._sync()
+
+    def _write_pending(self):
+        """Write up to CHUNK queued records with one write() per file; bytes written
+
+        Encoding holds the GIL; small chunks keep the broadcast path from
+        waiting long for it.
+        """
+        pending = self.pending
+        records = []
+        offsets = []
+        position = self.position
+        while pending:
+            record = encode(*pending.popleft())
+            if position > 0 and position + len(record) > self.segment_bytes:
+                self._flush(records, offsets)
+                self._rotate()
+                records, offsets, position = [], [], 0
+            offsets.append(OFFSET.pack(position))
+            records.append(record)
+            position += len(record)
+            if len(records) >= CHUNK:
+                break
+        return self._flush(records, offsets)
+
+    def _flush(self, records, offsets):
+        if not records:
+            return 0
+        data = b"".join(records)
+        # Data before index: an index entry never points past the log
+        self.log.write(data)
+        self.idx.write(b"".join(offsets))
+        self.position += len(data)
+        with self.lock:
+            self.committed += len(records)
+        journal_records.inc(len(records))
+        journal_bytes.inc(len(data))
+        return len(data)
+
+    def _sync(self):
+        start = time.perf_counter()
+        os.fsync(self.log.fileno())
+        os.fsync(self.idx.fileno())
+        journal_fsyncs.inc()
+        journal_fsync_seconds.observe(time.perf_counter() - start)
+
+    def _rotate(self):
+        self._sync()
+        self.log.close()
+        self.idx.close()
+        with self.lock:
+            self._add_segment(self.committed)
+        self._open_active()
+        log.info("Journal rotated to segment %d", self.committed)
+
+    def records(self, start=0, stop=None):
+        """Yield (seq, (time, sender id, room, name, message)) from start up to stop"""
+        with self.lock:
+            stop = self.committed if stop is None else min(stop, self.committed)
+            segments = list(self.segments)
+            bases = list(self.bases)
+        if not bases:
+            return
+        seq = max(start, bases[0])
+        while seq < stop:
+            i = bisect.bisect_right(bases, seq) - 1
+            segment = segments[i]
+            end = min(stop, bases[i + 1] if i + 1 < len(bases) else stop)
+            data, idx = segment.map(end - segment.base)
+            for n in range(seq, end):
+                offset, = OFFSET.unpack_from(idx, (n - segment.base) * OFFSET.size)
+                yield n, decode(data, offset)
+            seq = end
+
+    def tail(self, room, n, scan=SCAN, max_bytes=None):
+        """The last n messages in room, oldest first, looking back at most scan records
+
+        With max_bytes, stops before the messages add up to more. Only
+        matching records are decoded; the others cost a header read.
+        """
+        with self.lock:
+            stop = self.committed
+            segments = list(self.segments)
+        room = room.encode()
+        found = []
+        for segment in reversed(segments):
+            if segment.base >= stop:
+                continue
+            data, idx = segment.map(stop - segment.base)
+            for i in range(stop - segment.base - 1, -1, -1):
+                offset, = OFFSET.unpack_from(idx, i * OFFSET.size)
+                length, _, _, room_len, _ = RECORD.unpack_from(data, offset)
+                start = offset + RECORD.size
+                if data[start:start + room_len] == room:
+                    if max_bytes is not None:
+                        max_bytes -= length
+                        if max_bytes < 0:
+                            break
+                    found.append(decode(data, offset))
+                scan -= 1
+                if len(found) == n or not scan:
+                    break
+            else:
+                stop = segment.base
+                continue
+            break
+        found.reverse()
+        return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a chat journal as JSON lines")
+    parser.add_argument('directory')
+    parser.add_argument('--since', type=int, default=0, help="first sequence number")
+    parser.add_argument('--room', help="only this room")
+    args = parser.parse_args(argv)
+    journal = Journal(args.directory, readonly=True)
+    for seq, (when, sender_id, room, name, message) in journal.records(args.since):
+        if args.room and room != args.room:
+            continue
+        json.dump({'seq': seq, 'time': when, 'sender_id': sender_id, 'room': room,
+                   'name': name, 'message': message.decode(errors='replace')}, sys.stdout)
+        sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    main()
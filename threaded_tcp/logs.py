@@ -0,0 +1,60 @@
+"""Levelled, rate-limited console logging for the chat server
+
+Each call site gets a token bucket, so a busy line such as the
+per-message debug log or a flood of send errors cannot turn the
+console into the bottleneck. Suppressed records are counted and the
+count is attached to the next record that call site gets through.
+"""
+import logging
+import sys
+import threading
+import time
+
+import metrics
+
+
+LEVELS = ('debug', 'info', 'warning', 'error')
+
+suppressed_total = metrics.counter('log_records_suppressed')
+
+
+class RateLimit(logging.Filter):
+    """Let each call site log at most rate records per second, with bursts up to burst"""
+
+    def __init__(self, rate=10.0, burst=None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or max(1.0, rate * 2)
+        self.sites = {}  # {(path, line): [tokens, last refill, suppressed]}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None:
+                site = self.sites[key] = [self.burst, now, 0]
+            site[0] = min(self.burst, site[0] + (now - site[1]) * self.rate)
+            site[1] = now
+            if site[0] < 1:
+                site[2] += 1
+                suppressed_total.inc()
+                return False
+            site[0] -= 1
+            dropped, site[2] = site[2], 0
+        if dropped:
+            record.msg = f"{record.getMessage()} ({dropped} similar suppressed)"
+            record.args = None
+        return True
+
+
+def setup(level='info', rate=10.0):
+    """Log to stdout at level, rate-limited per call site (rate 0 disables the limit)"""
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    if rate:
+        handler.addFilter(RateLimit(rate))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper())
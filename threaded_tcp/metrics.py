@@ -0,0 +1,158 @@
+"""In-process counters, gauges and latency histograms
+
+Metrics live in module-level registries so any module can create or
+look one up by name and update it from any thread. render() formats a
+plaintext snapshot, one "name value" line per series, which the server
+sends in reply to /stats and serves on its --stats-port endpoint.
+"""
+import bisect
+import threading
+import time
+
+import tracing
+
+
+# Histogram bucket upper bounds in seconds: 1us, 2us, 4us ... ~33s
+BOUNDS = tuple(2 ** i / 1e6 for i in range(26))
+
+counters = {}    # {name: Counter}
+histograms = {}  # {name: Histogram}
+gauges = {}      # {name: callable returning a number}
+
+
+class Counter:
+    """A monotonically increasing count"""
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self.lock:
+            self.value += n
+
+
+class Histogram:
+    """Power-of-two buckets of durations in seconds, plus count, sum and max"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(BOUNDS, seconds)
+        with self.lock:
+            self.buckets[i] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, pct):
+        """Upper bound of the bucket holding the pct-th percentile (0 if empty)"""
+        with self.lock:
+            rank = self.count * pct / 100
+            seen = 0
+            for i, n in enumerate(self.buckets):
+                seen += n
+                if n and seen >= rank:
+                    return BOUNDS[i] if i < len(BOUNDS) else self.max
+        return 0.0
+
+
+class TimedLock:
+    """threading.Lock that records how long callers wait for it and hold it
+
+    While tracing, sampled acquisitions (and every one made while
+    handling a sampled message) are also recorded as wait and hold spans.
+    """
+
+    def __init__(self, wait, hold, name='lock'):
+        self.lock = threading.Lock()
+        self.wait = wait
+        self.hold = hold
+        self.name = name
+        self.acquired_at = 0.0  # only written by the current holder
+        self.traced = False  # likewise
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        if not self.lock.acquire(blocking, timeout):
+            return False
+        self.acquired_at = time.perf_counter()
+        self.wait.observe(self.acquired_at - start)
+        tracer = tracing.tracer
+        self.traced = bool(tracer) and (tracer.active() or tracer.sampled())
+        if self.traced:
+            tracer.span(f"{self.name} wait", start, self.acquired_at)
+        return True
+
+    def release(self):
+        acquired_at, traced = self.acquired_at, self.traced
+        released = time.perf_counter()
+        self.lock.release()
+        self.hold.observe(released - acquired_at)
+        tracer = tracing.tracer
+        if traced and tracer:
+            tracer.span(f"{self.name} hold", acquired_at, released)
+
+    def locked(self):
+        return self.lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def counter(name):
+    return counters.setdefault(name, Counter())
+
+def histogram(name):
+    return histograms.setdefault(name, Histogram())
+
+def gauge(name, fn):
+    gauges[name] = fn
+
+def timed_lock(name):
+    """A TimedLock reporting <name>_wait_seconds and <name>_hold_seconds"""
+    return TimedLock(histogram(f"{name}_wait_seconds"), histogram(f"{name}_hold_seconds"), name)
+
+def render():
+    lines = []
+    for name, fn in sorted(gauges.items()):
+        lines.append(f"{name} {fn()}")
+    for name, c in sorted(counters.items()):
+        lines.append(f"{name} {c.value}")
+    for name, h in sorted(histograms.items()):
+        lines.append(f"{name}_count {h.count}")
+        lines.append(f"{name}_sum {h.sum:.6f}")
+        for pct in (50, 99, 99.9):
+            lines.append(f"{name}_p{str(pct).replace('.', '')} {h.percentile(pct):.6f}")
+        lines.append(f"{name}_max {h.max:.6f}")
+    return "\n".join(lines) + "\n"
+
+
+def serve(port, host='127.0.0.1'):
+    """Serve render() over HTTP on host:port from a daemon thread"""
+    import http.server  # only servers with --stats-port pay for the import
+
+    class StatsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), StatsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
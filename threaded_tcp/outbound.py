@@ -0,0 +1,246 @@
+import collections
+import logging
+import socket
+import threading
+import time
+import zlib
+
+import metrics
+import tracing
+
+
+DROP_OLDEST = 'drop-oldest'
+DROP_NEWEST = 'drop-newest'
+DISCONNECT = 'disconnect'
+POLICIES = (DROP_OLDEST, DROP_NEWEST, DISCONNECT)
+
+LATENCY = 'latency'
+THROUGHPUT = 'throughput'
+WRITE_MODES = (LATENCY, THROUGHPUT)
+MAX_IOV = 512  # frames per sendmsg() call, well under IOV_MAX
+
+# Compressed connections get a 4 KiB window and small hash tables, about
+# 32 KiB of zlib state each instead of the default ~256 KiB
+COMPRESS_LEVEL = 6
+COMPRESS_WBITS = 12
+COMPRESS_MEMLEVEL = 5
+
+log = logging.getLogger('chat_server')
+frames_sent = metrics.counter('frames_sent')
+bytes_sent = metrics.counter('bytes_sent')
+send_calls = metrics.counter('send_calls')
+send_failures = metrics.counter('send_failures')
+frames_dropped = metrics.counter('frames_dropped')
+slow_consumer_disconnects = metrics.counter('slow_consumer_disconnects')
+compress_bytes_in = metrics.counter('compress_bytes_in')
+compress_bytes_out = metrics.counter('compress_bytes_out')
+compress_seconds = metrics.histogram('compress_seconds')
+
+
+class SlowConsumerPolicy:
+    """What to do when a client's outbound queue backs up
+
+    max_bytes bounds every queue. With DISCONNECT the client is also
+    dropped once its oldest queued frame is older than max_delay seconds.
+    """
+
+    def __init__(self, mode=DROP_OLDEST, max_bytes=256 * 1024, max_delay=None):
+        if mode not in POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {mode}")
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+
+
+class WritePolicy:
+    """How a writer thread coalesces queued frames into sendmsg() calls
+
+    Every wakeup flushes up to flush_bytes of queued frames with one
+    scatter-gather call. LATENCY flushes as soon as anything is queued and
+    sets TCP_NODELAY. THROUGHPUT waits up to flush_delay seconds for
+    flush_bytes to pile up first, and leaves Nagle's algorithm on.
+    """
+
+    def __init__(self, mode=LATENCY, flush_bytes=64 * 1024, flush_delay=0.002):
+        if mode not in WRITE_MODES:
+            raise ValueError(f"Unknown write mode: {mode}")
+        self.mode = mode
+        self.flush_bytes = flush_bytes
+        self.flush_delay = flush_delay if mode == THROUGHPUT else 0.0
+
+
+def compressor(level=COMPRESS_LEVEL):
+    """A zlib stream compressor for one connection"""
+    return zlib.compressobj(level, zlib.DEFLATED, COMPRESS_WBITS, COMPRESS_MEMLEVEL)
+
+def compress_batch(stream, batch):
+    """Deflate batch onto stream; the peer can inflate everything up to the returned chunks"""
+    chunks = [chunk for chunk in map(stream.compress, batch) if chunk]
+    chunks.append(stream.flush(zlib.Z_SYNC_FLUSH))
+    return chunks
+
+
+class Outbox:
+    """Bounded outbound queue for one client, drained by its own writer thread
+
+    With compress=True everything sent is one zlib stream. The writer
+    compresses each coalesced batch and sync-flushes once per batch, so
+    the compressor's history spans the whole connection and repeated
+    names and phrases cost a few bits each.
+    """
+
+    def __init__(self, sock, policy=None, write_policy=None, compress=False):
+        self.sock = sock
+        self.policy = policy or SlowConsumerPolicy()
+        self.write_policy = write_policy or WritePolicy()
+        if self.write_policy.mode == LATENCY and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.frames = collections.deque()  # (frame, enqueue time)
+        self.queued_bytes = 0
+        self.dropped = 0
+        self.closed = False
+        self.draining = False
+        self.cond = threading.Condition()
+        self.compressor = compressor() if compress else None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def put(self, frame):
+        """Queue frame for sending; False if the client was disconnected"""
+        policy = self.policy
+        with self.cond:
+            if self.closed or self.draining:
+                return False
+            overflow = self.frames and self.queued_bytes + len(frame) > policy.max_bytes
+            if policy.mode == DISCONNECT:
+                stale = (
+                    policy.max_delay is not None
+                    and self.frames
+                    and time.monotonic() - self.frames[0][1] > policy.max_delay
+                )
+                if overflow or stale:
+                    slow_consumer_disconnects.inc()
+                    self._abort()
+                    return False
+            elif overflow and policy.mode == DROP_NEWEST:
+                self.dropped += 1
+                frames_dropped.inc()
+                return True
+            elif overflow:
+                while self.frames and self.queued_bytes + len(frame) > policy.max_bytes:
+                    old, _ = self.frames.popleft()
+                    self.queued_bytes -= len(old)
+                    self.dropped += 1
+                    frames_dropped.inc()
+            self.frames.append((frame, time.monotonic()))
+            self.queued_bytes += len(frame)
+            # The writer only sleeps on an empty queue or, in THROUGHPUT
+            # mode, until flush_bytes are queued: skip pointless wakeups
+            if len(self.frames) == 1 or self.queued_bytes >= self.write_policy.flush_bytes:
+                self.cond.notify()
+        return True
+
+    def close(self):
+        """Stop the writer, discarding anything still queued"""
+        with self.cond:
+            self.closed = True
+            self.frames.clear()
+            self.queued_bytes = 0
+            self.cond.notify()
+
+    def drain(self):
+        """Refuse new frames, send what is queued, then shut the socket down"""
+        with self.cond:
+            self.draining = True
+            self.cond.notify()
+
+    def abort(self):
+        """Close and shut the socket down so the reader thread sees EOF"""
+        with self.cond:
+            self._abort()
+
+    def _abort(self):
+        self.closed = True
+        self.frames.clear()
+        self.queued_bytes = 0
+        self.cond.notify()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _run(self):
+        write_policy = self.write_policy
+        while True:
+            with self.cond:
+                while not self.frames and not self.closed:
+                    if self.draining:
+                        self._abort()
+                        return
+                    self.cond.wait()
+                if write_policy.flush_delay and self.queued_bytes < write_policy.flush_bytes:
+                    deadline = time.monotonic() + write_policy.flush_delay
+                    while not self.closed and self.queued_bytes < write_policy.flush_bytes:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self.cond.wait(remaining)
+                if self.closed:
+                    return
+                batch = []
+                size = 0
+                oldest = self.frames[0][1]
+                while self.frames and len(batch) < MAX_IOV and size < write_policy.flush_bytes:
+                    frame, _ = self.frames.popleft()
+                    batch.append(frame)
+                    size += len(frame)
+                self.queued_bytes -= size
+            # Counted now: compression and partial writes both reshape batch
+            frames = len(batch)
+            tracer = tracing.tracer
+            traced = tracer and tracer.sampled()
+            if traced:
+                start = time.perf_counter()
+                # Frames carry monotonic enqueue times; spans use perf_counter
+                tracer.span('queued', start - (time.monotonic() - oldest), start,
+                            frames=frames)
+            if self.compressor:
+                start = time.perf_counter()
+                batch = compress_batch(self.compressor, batch)
+                end = time.perf_counter()
+                compress_seconds.observe(end - start)
+                if traced:
+                    tracer.span('compress', start, end, frames=frames)
+                compress_bytes_in.inc(size)
+                size = sum(map(len, batch))
+                compress_bytes_out.inc(size)
+            try:
+                if traced:
+                    start = time.perf_counter()
+                    self._send(batch, size)
+                    tracer.span('send', start, time.perf_counter(), bytes=size)
+                else:
+                    self._send(batch, size)
+            except OSError as e:
+                send_failures.inc()
+                log.warning("Error sending message to %s: %s", self.sock, e)
+                self.abort()
+                return
+            frames_sent.inc(frames)
+            bytes_sent.inc(size)
+
+    def _send(self, batch, size):
+        """Write every frame in batch with as few sendmsg() calls as possible"""
+        while True:
+            sent = self.sock.sendmsg(batch)
+            send_calls.inc()
+            size -= sent
+            if not size:
+                return
+            # Partial write: drop what went out and resend the rest
+            while sent >= len(batch[0]):
+                sent -= len(batch.pop(0))
+            batch[0] = memoryview(batch[0])[sent:]
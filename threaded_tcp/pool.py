@@ -0,0 +1,97 @@
+"""Serve many connections from a fixed number of worker threads
+
+A dispatcher thread waits for readable sockets with selectors and
+hands each one to the worker pool. While a worker owns a connection
+the socket is unregistered, so no two workers ever read it at once; the
+worker registers it again once reading would block, or once a pause
+it asked for is over.
+"""
+import heapq
+import itertools
+import queue
+import selectors
+import socket
+import threading
+import time
+
+
+WAIT = 'wait'    # nothing left to read: watch the socket again
+AGAIN = 'again'  # still has input: requeue behind the other connections
+DONE = 'done'    # the connection has been torn down
+PAUSE = 'pause'  # leave the socket unread until conn.resume (a monotonic time)
+
+
+class Pool:
+    """size worker threads calling step() on connections that are ready
+
+    A connection needs a .sock, step() returning WAIT, AGAIN, DONE or
+    PAUSE (with .resume set), and expired(now), which makes the dispatcher hand it to a worker
+    even though nothing arrived (so step() can enforce deadlines).
+    """
+
+    def __init__(self, size, sweep_interval=1.0):
+        self.sel = selectors.DefaultSelector()
+        self.ready = queue.SimpleQueue()
+        self.sweep_interval = sweep_interval
+        self.paused = []  # heap of (resume, n, conn)
+        self.paused_lock = threading.Lock()
+        self.order = itertools.count()  # ties in paused never compare conns
+        # Written to when a pause is added, so the dispatcher recomputes its timeout
+        self.wakeup, self.waker = socket.socketpair()
+        self.wakeup.setblocking(False)
+        self.waker.setblocking(False)
+        self.sel.register(self.wakeup, selectors.EVENT_READ, None)
+        self.threads = [threading.Thread(target=self.work, daemon=True) for _ in range(size)]
+        self.threads.append(threading.Thread(target=self.dispatch, daemon=True))
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def add(self, conn):
+        self.sel.register(conn.sock, selectors.EVENT_READ, conn)
+
+    def pause(self, conn):
+        with self.paused_lock:
+            heapq.heappush(self.paused, (conn.resume, next(self.order), conn))
+        try:
+            self.waker.send(b"\0")
+        except BlockingIOError:
+            pass  # a wakeup is already pending
+
+    def dispatch(self):
+        next_sweep = time.monotonic() + self.sweep_interval
+        while True:
+            timeout = next_sweep - time.monotonic()
+            if self.paused:
+                timeout = min(timeout, self.paused[0][0] - time.monotonic())
+            for key, _ in self.sel.select(timeout=max(0, timeout)):
+                if key.data is None:
+                    self.wakeup.recv(4096)
+                    continue
+                self.sel.unregister(key.fileobj)
+                self.ready.put(key.data)
+            now = time.monotonic()
+            with self.paused_lock:
+                while self.paused and self.paused[0][0] <= now:
+                    self.ready.put(heapq.heappop(self.paused)[2])
+            if now >= next_sweep:
+                # Only idle connections are registered, so none of these
+                # is being stepped by a worker right now
+                for key in list(self.sel.get_map().values()):
+                    if key.data is not None and key.data.expired(now):
+                        self.sel.unregister(key.fileobj)
+                        self.ready.put(key.data)
+                next_sweep = now + self.sweep_interval
+
+    def work(self):
+        while True:
+            conn = self.ready.get()
+            state = conn.step()
+            if state == WAIT:
+                self.sel.register(conn.sock, selectors.EVENT_READ, conn)
+            elif state == AGAIN:
+                self.ready.put(conn)
+            elif state == PAUSE:
+                self.pause(conn)
@@ -0,0 +1,71 @@
+"""Binary wire protocol for bot and machine clients
+
+A client opts in by answering the name prompt with "/binary <name>\\n".
+From then on every frame in both directions is a 9-byte header followed
+by the payload:
+
+    payload length (u32) | message type (u8) | sender id (u32)
+
+All integers are big-endian. Sender id 0 is the server.
+"""
+import struct
+
+
+HEADER = struct.Struct('!IBI')
+
+# Message types
+CHAT = 1     # client -> server: payload is the message; server -> client: from sender id
+JOIN = 2     # client -> server: join the room in payload;
+             # server -> client: sender id (username in payload) entered your room
+LEAVE = 3    # client -> server: leave the room in payload (or the current one if empty);
+             # server -> client: sender id (username in payload) left your room
+NOTICE = 4   # server -> client: UTF-8 server notice
+LIST = 5     # client -> server: request; server -> client: usernames, one per line
+QUIT = 6     # client -> server
+WELCOME = 7  # server -> client: sender id is the client's own id, payload its name
+ROOM = 8     # cluster bus only: sender id moved to the room in payload
+STATS = 9    # client -> server: request; server -> client: plaintext metrics
+DIRECT = 10  # client -> server: payload is "<username>\n<message>";
+             # server -> client: private message from sender id
+HISTORY = 11  # client -> server: payload is an optional ASCII count;
+              # server -> client: the room's recent CHAT packets
+PING = 12    # either direction: are you there? Answered with PONG
+PONG = 13    # either direction
+
+NEGOTIATE = "/binary "
+COMPRESS = "/zlib "
+
+
+def negotiate_compression(name):
+    """Split a handshake name line into (rest of the line, wants_zlib)
+
+    "/zlib " goes in front of the name or of "/binary <name>". Everything
+    the server sends after the handshake is then a single zlib stream.
+    """
+    if name.startswith(COMPRESS):
+        return name[len(COMPRESS):].strip(), True
+    return name, False
+
+def negotiate(name):
+    """Split a handshake name line into (username, wants_binary)"""
+    if name.startswith(NEGOTIATE):
+        return name[len(NEGOTIATE):].strip(), True
+    return name, False
+
+def pack(kind, sender_id, payload=b""):
+    return HEADER.pack(len(payload), kind, sender_id) + payload
+
+def read_packet(reader, deadline=None):
+    """Next (type, sender id, payload) from a FrameReader, or None at EOF
+
+    The payload is a memoryview into the reader's buffer. Nothing is
+    consumed until the whole packet has arrived.
+    """
+    header = reader.peek(HEADER.size, deadline)
+    if header is None:
+        return None
+    length, kind, sender_id = HEADER.unpack(header)
+    packet = reader.read_exact(HEADER.size + length, deadline)
+    if packet is None:
+        return None
+    return kind, sender_id, packet[HEADER.size:]
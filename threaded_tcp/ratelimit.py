@@ -0,0 +1,93 @@
+"""Token-bucket limits on what clients may send
+
+Every frame a client sends is charged to its own message and byte
+buckets and to the server-wide message bucket. A bucket may go into
+debt; the charge then returns how long the debt takes to repay, and
+the reader stops reading that client for as long. Its input piles up
+in the kernel's receive buffer, and once that fills TCP's flow control
+stalls the sender, so nothing is dropped.
+"""
+import threading
+import time
+
+import metrics
+
+
+BURST = 1.0  # seconds of traffic a bucket may take at once
+
+throttle_pauses = metrics.counter('throttle_pauses')
+throttle_seconds = metrics.histogram('throttle_seconds')
+
+
+class TokenBucket:
+    """rate tokens per second, holding at most burst"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.time = time.monotonic()
+
+    def charge(self, n, now):
+        """Take n tokens, going into debt if need be; seconds until it is repaid"""
+        self.tokens = min(self.burst, self.tokens + (now - self.time) * self.rate) - n
+        self.time = now
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class SharedBucket(TokenBucket):
+    """A TokenBucket every reader thread charges"""
+
+    def __init__(self, rate, burst):
+        super().__init__(rate, burst)
+        self.lock = threading.Lock()
+
+    def charge(self, n, now):
+        with self.lock:
+            return super().charge(n, now)
+
+
+class RateLimits:
+    """How fast clients may send; 0 leaves a limit off
+
+    messages and bytes are per second for each client, global_messages
+    per second across all of them. Buckets hold burst seconds' worth.
+    """
+
+    def __init__(self, messages=0, bytes=0, global_messages=0, burst=BURST):
+        if min(messages, bytes, global_messages) < 0 or burst <= 0:
+            raise ValueError("Rate limits must be positive, or 0 for none")
+        self.messages = messages
+        self.bytes = bytes
+        self.global_messages = global_messages
+        self.burst = burst
+        self.shared = SharedBucket(global_messages, global_messages * burst) if global_messages else None
+
+    def throttle(self):
+        """A new client's Throttle, or None when nothing is limited"""
+        buckets = []
+        if self.messages:
+            buckets.append((TokenBucket(self.messages, self.messages * self.burst), False))
+        if self.bytes:
+            buckets.append((TokenBucket(self.bytes, self.bytes * self.burst), True))
+        if self.shared:
+            buckets.append((self.shared, False))
+        return Throttle(buckets) if buckets else None
+
+
+class Throttle:
+    """One client's buckets, charged by whichever thread reads it"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets  # [(bucket, charged in bytes rather than messages)]
+        self.until = 0.0  # monotonic time the current pause ends
+
+    def charge(self, size):
+        """Charge one frame of size bytes; seconds to stop reading for"""
+        now = time.monotonic()
+        delay = max(bucket.charge(size if by_bytes else 1, now) for bucket, by_bytes in self.buckets)
+        if delay:
+            self.until = now + delay
+            throttle_pauses.inc()
+            throttle_seconds.observe(delay)
+        return delay
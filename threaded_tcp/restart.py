@@ -0,0 +1,65 @@
+"""Hand a listening socket to a replacement server process
+
+The running server offers its listener on a Unix control socket. A new
+process started with the same port connects to it, receives the
+listening fd with SCM_RIGHTS and starts accepting on the very same
+kernel socket, so its backlog carries over and no connection attempt
+is refused. The old process then stops accepting and drains.
+"""
+import logging
+import os
+import socket
+import threading
+
+
+READY = b"R"  # replacement -> old server: I am accepting now
+
+log = logging.getLogger('chat_server')
+
+
+def offer_listener(path, server, handed_off):
+    """Give server's fd to the first replacement that asks, then set handed_off
+
+    Runs in a daemon thread. The control socket at path is replaced if a
+    stale one is left over from a previous run.
+    """
+    ctl = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    ctl.bind(path)
+    ctl.listen(1)
+
+    def serve():
+        with ctl:
+            while True:
+                conn, _ = ctl.accept()
+                with conn:
+                    try:
+                        socket.send_fds(conn, [b"L"], [server.fileno()])
+                        if conn.recv(1) == READY:
+                            break
+                    except OSError as e:
+                        log.warning("Listener handoff failed: %s", e)
+        # The replacement now owns the path; leave it in place
+        log.info("Listening socket handed off")
+        handed_off.set()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return ctl
+
+def take_listener(path, timeout=10.0):
+    """Receive the listening socket of the server offering it at path"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as ctl:
+        ctl.settimeout(timeout)
+        ctl.connect(path)
+        _, fds, _, _ = socket.recv_fds(ctl, 1, 1)
+        if not fds:
+            raise ConnectionError(f"No listening socket received from {path}")
+        server = socket.socket(fileno=fds[0])
+        # Our accept loop starts right after this, and until the old
+        # server stops, both processes accept from the same backlog
+        ctl.sendall(READY)
+    log.info("Took over listening socket %s from %s", server.getsockname(), path)
+    return server
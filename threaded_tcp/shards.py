@@ -0,0 +1,78 @@
+"""Fan-out spread over a fixed set of sender threads
+
+Clients are partitioned into shards by session id, and each shard has
+one sender thread working through a FIFO queue of jobs. A broadcast
+becomes one job per shard: the thread that read the message only
+enqueues, and the shards queue frames on their clients' outboxes in
+parallel. Since a client always belongs to the same shard, it still
+sees messages in the order they were broadcast.
+
+The shard threads only run Python code in parallel on free-threaded
+CPython (3.13t and later). With the GIL, they still take the O(N) walk
+off the sender's read loop, but the total CPU spent stays the same.
+"""
+import logging
+import os
+import queue
+import sys
+import threading
+
+
+# sys._is_gil_enabled() only exists from 3.13 on
+FREE_THREADED = not getattr(sys, '_is_gil_enabled', lambda: True)()
+# 1 fans out inline on the sending thread
+DEFAULT = min(os.cpu_count() or 1, 8) if FREE_THREADED else 1
+
+log = logging.getLogger('chat_server')
+
+
+class Shards:
+    """count sender threads, each running the jobs submitted to it in order"""
+
+    def __init__(self, count):
+        self.queues = [queue.SimpleQueue() for _ in range(count)]
+        self.threads = [threading.Thread(target=self._run, args=(q,), daemon=True,
+                                         name=f"shard-{i}")
+                        for i, q in enumerate(self.queues)]
+
+    def __len__(self):
+        return len(self.queues)
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def submit(self, shard, fn, *args):
+        """Run fn(*args) on shard's thread, after everything submitted to it before"""
+        self.queues[shard].put((fn, args))
+
+    def backlog(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def flush(self, timeout=None):
+        """Wait until every job submitted so far has run; False on timeout"""
+        done = [threading.Event() for _ in self.queues]
+        for q, event in zip(self.queues, done):
+            q.put((event.set, ()))
+        return all(event.wait(timeout) for event in done)
+
+    def stop(self):
+        """Run what is queued, then end the threads"""
+        for q in self.queues:
+            q.put(None)
+        for thread in self.threads:
+            if thread.is_alive():
+                thread.join()
+
+    @staticmethod
+    def _run(q):
+        while True:
+            job = q.get()
+            if job is None:
+                return
+            fn, args = job
+            try:
+                fn(*args)
+            except Exception:
+                log.exception("Shard job %r failed", fn)
@@ -0,0 +1,130 @@
+import socket
+import threading
+import time
+import pytest
+import outbound
+from async_server import tcp_server, clients
+from outbound import SlowConsumerPolicy, DISCONNECT, DROP_NEWEST
+
+
+@pytest.fixture
+def reset_clients():
+    clients.clear()
+    yield
+    clients.clear()
+
+
+@pytest.fixture
+def server_thread():
+    def start_server(port=8181, **options):
+        thread = threading.Thread(
+            target=tcp_server,
+            kwargs={'port': port, 'host': '127.0.0.1', **options},
+            daemon=True
+        )
+        thread.start()
+        time.sleep(0.2)
+        return thread
+
+    yield start_server
+
+
+def connect(port, username):
+    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    client.connect(('127.0.0.1', port))
+    assert client.recv(1024) == b"Enter your name: "
+    client.send(f"{username}\n".encode())
+    time.sleep(0.1)
+    return client
+
+
+class TestAsyncServer:
+
+    def test_client_joins(self, reset_clients, server_thread):
+        server_thread(port=8182)
+
+        client = connect(8182, "Alice")
+
+        assert list(clients.values()) == ["Alice"]
+        assert b"Alice joined" in client.recv(1024)
+
+        client.close()
+        time.sleep(0.1)
+
+    def test_message_broadcast_to_other_clients(self, reset_clients, server_thread):
+        server_thread(port=8183)
+
+        client1 = connect(8183, "Alice")
+        client1.recv(1024)
+        client2 = connect(8183, "Bob")
+
+        assert b"Bob joined" in client1.recv(1024)
+
+        client1.send(b"Hello everyone!\n")
+        time.sleep(0.1)
+
+        msg = client2.recv(1024)
+        assert b"[Alice] Hello everyone!" in msg
+
+        client1.close()
+        client2.close()
+        time.sleep(0.1)
+
+    def test_list_and_quit(self, reset_clients, server_thread):
+        server_thread(port=8184)
+
+        client1 = connect(8184, "Alice")
+        client2 = connect(8184, "Bob")
+        client1.recv(1024)
+
+        client1.send(b"/list\n")
+        time.sleep(0.1)
+        response = client1.recv(1024)
+        assert b"Alice" in response and b"Bob" in response
+
+        client2.send(b"/quit\n")
+        time.sleep(0.2)
+
+        assert list(clients.values()) == ["Alice"]
+        assert b"Bob left" in client1.recv(1024)
+
+        client1.close()
+        client2.close()
+        time.sleep(0.1)
+
+    def flood_past(self, port, stalled_name):
+        """Connect a client that never reads, then send until its transport backs up"""
+        stalled = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        stalled.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        stalled.connect(('127.0.0.1', port))
+        stalled.recv(1024)
+        stalled.send(f"{stalled_name}\n".encode())
+        time.sleep(0.1)
+        alice = connect(port, "Alice")
+        # Past what the kernel buffers on both ends of the socket
+        for _ in range(100):
+            alice.sendall((b"x" * 100 + b"\n") * 1000)
+        time.sleep(0.5)
+        return stalled, alice
+
+    def test_slow_consumer_is_disconnected(self, reset_clients, server_thread):
+        server_thread(port=8185, slow_consumer=SlowConsumerPolicy(DISCONNECT, max_bytes=16384))
+        stalled, alice = self.flood_past(8185, "Stalled")
+
+        assert list(clients.values()) == ["Alice"]
+
+        stalled.close()
+        alice.close()
+        time.sleep(0.1)
+
+    def test_slow_consumer_misses_messages(self, reset_clients, server_thread):
+        server_thread(port=8186, slow_consumer=SlowConsumerPolicy(DROP_NEWEST, max_bytes=16384))
+        dropped = outbound.frames_dropped.value
+        stalled, alice = self.flood_past(8186, "Stalled")
+
+        assert sorted(clients.values()) == ["Alice", "Stalled"]
+        assert outbound.frames_dropped.value > dropped
+
+        stalled.close()
+        alice.close()
+        time.sleep(0.1)
@@ -0,0 +1,139 @@
+import asyncio
+import socket
+import threading
+import time
+import pytest
+import chat_server
+import protocol
+from chat_client import Client, ClientPool, AsyncClient, NameTaken, backoff
+
+
+@pytest.fixture
+def server():
+    def start_server(port, **options):
+        thread = threading.Thread(
+            target=chat_server.tcp_server,
+            kwargs={'port': port, 'host': '127.0.0.1', **options},
+            daemon=True
+        )
+        thread.start()
+        time.sleep(0.2)
+        return port
+
+    return start_server
+
+
+def impostor():
+    """Port of a fake server that sends a CHAT packet before WELCOME"""
+    listener = socket.create_server(('127.0.0.1', 0))
+
+    def serve():
+        with listener:
+            conn, _ = listener.accept()
+            with conn:
+                conn.sendall(b"Enter your name: ")
+                conn.recv(1024)
+                conn.sendall(protocol.pack(protocol.CHAT, 42, b"not yours")
+                             + protocol.pack(protocol.WELCOME, 7, b"alice"))
+                conn.recv(1024)
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def next_chat(client, kind=protocol.CHAT, timeout=2):
+    """(sender id, payload) of the next packet of this kind, skipping notices"""
+    while True:
+        packet = client.receive(timeout)
+        if packet[0] == kind:
+            return packet[1:]
+
+
+class TestClient:
+
+    def test_chat_between_two_clients(self, server):
+        port = server(8120)
+        with Client('127.0.0.1', port, 'alice').connect() as alice, \
+                Client('127.0.0.1', port, 'bob').connect() as bob:
+            alice.send("hi bob")
+            assert next_chat(bob) == (alice.id, b"hi bob")
+
+            bob.direct('alice', "psst")
+            assert next_chat(alice, protocol.DIRECT) == (bob.id, b"psst")
+
+    def test_requests_are_pipelined(self, server):
+        port = server(8121)
+        with Client('127.0.0.1', port, 'alice').connect() as alice:
+            futures = [alice.request_list() for _ in range(10)]
+            alice.send("in between")
+
+            assert [f.result(2) for f in futures] == [b"alice"] * 10
+
+    def test_name_taken(self, server):
+        port = server(8122)
+        with Client('127.0.0.1', port, 'alice').connect():
+            with pytest.raises(NameTaken):
+                Client('127.0.0.1', port, 'alice').connect()
+
+    def test_reconnects_and_rejoins_room(self, server):
+        port = server(8123)
+        with Client('127.0.0.1', port, 'alice').connect() as alice, \
+                Client('127.0.0.1', port, 'bob').connect() as bob:
+            alice.join('games')
+            bob.join('games')
+            time.sleep(0.1)
+
+            # The server drops alice, as it would a slow consumer
+            chat_server.names['alice'].outbox.abort()
+            deadline = time.monotonic() + 5
+            while alice.reconnects == 0 and time.monotonic() < deadline:
+                time.sleep(0.05)
+            assert alice.reconnects == 1
+            time.sleep(0.1)
+
+            assert chat_server.names['alice'].room == 'games'
+            alice.send("back again")
+            assert next_chat(bob) == (alice.id, b"back again")
+
+    def test_pool_of_identities(self, server):
+        port = server(8124)
+        names = [f"bot-{i}" for i in range(5)]
+        with ClientPool('127.0.0.1', port, names).connect() as pool:
+            assert sorted(pool['bot-0'].list_users()) == names
+            pool['bot-1'].send("beep")
+            assert next_chat(pool['bot-4']) == (pool['bot-1'].id, b"beep")
+
+    def test_first_packet_must_be_welcome(self):
+        with pytest.raises(ConnectionError, match="WELCOME"):
+            Client('127.0.0.1', impostor(), 'alice', reconnect=False).connect()
+
+    def test_backoff_grows_to_maximum(self):
+        delays = backoff(initial=0.1, maximum=1.0)
+        for bound in (0.1, 0.2, 0.4, 0.8, 1.0, 1.0):
+            assert 0 <= next(delays) <= bound
+
+
+class TestAsyncClient:
+
+    def test_chat_and_pipelined_requests(self, server):
+        port = server(8125)
+
+        async def scenario():
+            async with AsyncClient('127.0.0.1', port, 'alice') as alice, \
+                    AsyncClient('127.0.0.1', port, 'bob') as bob:
+                replies = [await alice.request_list() for _ in range(5)]
+                await alice.send("hi from asyncio")
+                while True:
+                    kind, sender_id, payload = await asyncio.wait_for(bob.receive(), 2)
+                    if kind == protocol.CHAT:
+                        break
+                users = await asyncio.gather(*replies)
+                return (sender_id, payload), alice.id, users
+
+        (sender_id, payload), alice_id, users = asyncio.run(scenario())
+        assert (sender_id, payload) == (alice_id, b"hi from asyncio")
+        assert users == [b"alice\nbob"] * 5
+
+    def test_first_packet_must_be_welcome(self):
+        with pytest.raises(ConnectionError, match="WELCOME"):
+            asyncio.run(AsyncClient('127.0.0.1', impostor(), 'alice', reconnect=False).connect())
@@ -1,17 +1,27 @@
+import json
 import socket
 import threading
 import time
+import urllib.request
+import zlib
 import pytest
-from chat_server import tcp_server, broadcast, remove_client, handle_client, clients, clients_lock
+import chat_server
+from chat_server import tcp_server, broadcast, remove_client, handle_client, clients, clients_lock, names
+from outbound import SlowConsumerPolicy, DROP_OLDEST
+from framing import FrameReader
+from ratelimit import RateLimits
+import protocol
 
 
 @pytest.fixture
 def reset_clients():
     with clients_lock:
         clients.clear()
+        names.clear()
     yield
     with clients_lock:
         clients.clear()
+        names.clear()
 
 
 @pytest.fixture
@@ -19,11 +29,11 @@ def server_thread():
     server = None
     thread = None
     
-    def start_server(port=8081):
+    def start_server(port=8081, **options):
         nonlocal server, thread
         thread = threading.Thread(
             target=tcp_server,
-            kwargs={'port': port, 'host': '127.0.0.1'},
+            kwargs={'port': port, 'host': '127.0.0.1', **options},
             daemon=True
         )
         thread.start()
@@ -147,6 +157,35 @@ class TestBroadcasting:
         time.sleep(0.1)
 
 
+    def test_merged_lines_broadcast_separately(self, reset_clients, server_thread):
+        server_thread(port=8094)
+
+        client1 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client1.connect(('127.0.0.1', 8094))
+        client1.recv(1024)
+        client1.send(b"Alice\n")
+        time.sleep(0.1)
+
+        client2 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client2.connect(('127.0.0.1', 8094))
+        client2.recv(1024)
+        client2.send(b"Bob\n")
+        time.sleep(0.2)
+        client2.recv(1024)
+
+        client1.send(b"first\nsecond\nthi")
+        time.sleep(0.1)
+        client1.send(b"rd\n")
+        time.sleep(0.2)
+
+        msg = client2.recv(1024)
+        assert msg == b"[Alice] first\n[Alice] second\n[Alice] third\n"
+
+        client1.close()
+        client2.close()
+        time.sleep(0.1)
+
+
 class TestClientDisconnection:
     
     def test_client_removed_on_disconnect(self, reset_clients, server_thread):
@@ -276,6 +315,919 @@ class TestThreadSafety:
             assert len(clients) == 0
 
 
+class TestHandshake:
+
+    def test_stalled_client_does_not_block_accept(self, reset_clients, server_thread):
+        server_thread(port=8091, max_clients=1024)
+
+        staller = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        staller.connect(('127.0.0.1', 8091))
+        assert staller.recv(1024) == b"Enter your name: "
+
+        others = []
+        start = time.time()
+        for _ in range(1000):
+            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client.settimeout(5)
+            client.connect(('127.0.0.1', 8091))
+            assert client.recv(1024) == b"Enter your name: "
+            others.append(client)
+        elapsed = time.time() - start
+
+        assert elapsed < 10
+
+        late = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        late.connect(('127.0.0.1', 8091))
+        late.recv(1024)
+        late.send(b"Alice\n")
+        time.sleep(0.2)
+
+        with clients_lock:
+            assert list(clients.values()) == ["Alice"]
+
+        for client in others + [staller, late]:
+            client.close()
+        time.sleep(0.5)
+
+    def test_handshake_timeout_drops_silent_client(self, reset_clients, server_thread):
+        server_thread(port=8092, handshake_timeout=0.2)
+
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.connect(('127.0.0.1', 8092))
+        client.recv(1024)
+        time.sleep(0.4)
+
+        client.settimeout(1)
+        assert client.recv(1024) == b""
+        with clients_lock:
+            assert len(clients) == 0
+
+        client.close()
+
+
+class TestSlowConsumers:
+
+    def test_stalled_reader_does_not_block_broadcast(self, reset_clients, server_thread):
+        server_thread(port=8093, slow_consumer=SlowConsumerPolicy(DROP_OLDEST, max_bytes=64 * 1024))
+
+        slow = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        slow.connect(('127.0.0.1', 8093))
+        slow.recv(1024)
+        slow.send(b"Slow\n")
+        time.sleep(0.1)
+
+        alice = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        alice.connect(('127.0.0.1', 8093))
+        alice.recv(1024)
+        alice.send(b"Alice\n")
+        bob = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        bob.connect(('127.0.0.1', 8093))
+        bob.recv(1024)
+        bob.send(b"Bob\n")
+        time.sleep(0.2)
+
+        seen = b""
+        got_ping = threading.Event()
+
+        def read_bob():
+            nonlocal seen
+            bob.settimeout(10)
+            while not got_ping.is_set():
+                data = bob.recv(65536)
+                if not data:
+                    break
+                seen = seen[-16:] + data
+                if b"ping" in seen:
+                    got_ping.set()
+
+        reader = threading.Thread(target=read_bob, daemon=True)
+        reader.start()
+        # Enough to fill Slow's socket buffers many times over
+        alice.settimeout(10)
+        alice.sendall((b"x" * 1023 + b"\n") * 8192)
+        alice.sendall(b"ping\n")
+
+        assert got_ping.wait(timeout=5)
+        for client in (slow, alice, bob):
+            client.close()
+        time.sleep(0.2)
+
+
+class TestRooms:
+
+    def connect(self, port, username):
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.connect(('127.0.0.1', port))
+        client.recv(1024)
+        client.send(f"{username}\n".encode())
+        time.sleep(0.1)
+        return client
+
+    def drain(self, client):
+        client.settimeout(0.3)
+        data = b""
+        try:
+            while True:
+                data += client.recv(1024)
+        except socket.timeout:
+            return data
+
+    def test_messages_and_notices_scoped_to_room(self, reset_clients, server_thread):
+        server_thread(port=8096)
+
+        alice = self.connect(8096, "Alice")
+        bob = self.connect(8096, "Bob")
+        carol = self.connect(8096, "Carol")
+        for client in (alice, bob, carol):
+            self.drain(client)
+
+        alice.send(b"/join games\n")
+        time.sleep(0.1)
+        assert self.drain(alice) == b"[Server] Alice joined games\n"
+        assert self.drain(carol) == b"[Server] Alice left lobby\n"
+
+        bob.send(b"/join games\n")
+        time.sleep(0.1)
+        assert self.drain(alice) == b"[Server] Bob joined games\n"
+        self.drain(bob)
+        self.drain(carol)
+
+        alice.send(b"anyone for chess?\n")
+        time.sleep(0.1)
+        assert self.drain(bob) == b"[Alice] anyone for chess?\n"
+        assert self.drain(carol) == b""
+
+        carol.send(b"quiet in here\n")
+        time.sleep(0.1)
+        assert self.drain(alice) == b""
+        assert self.drain(bob) == b""
+
+        bob.send(b"/leave games\n")
+        time.sleep(0.1)
+        assert self.drain(alice) == b"[Server] Bob left games\n"
+        assert self.drain(carol) == b"[Server] Bob joined lobby\n"
+        # Back in the lobby, Bob is first shown what he missed there
+        assert self.drain(bob) == b"[Carol] quiet in here\n[Server] Bob joined lobby\n"
+
+        alice.close()
+        time.sleep(0.2)
+        assert self.drain(bob) == b""
+
+        bob.close()
+        carol.close()
+        time.sleep(0.1)
+
+    def test_leave_other_room_is_rejected(self, reset_clients, server_thread):
+        server_thread(port=8097)
+
+        alice = self.connect(8097, "Alice")
+        self.drain(alice)
+
+        alice.send(b"/leave games\n")
+        time.sleep(0.1)
+        assert self.drain(alice) == b"You are not in games\n"
+
+        alice.close()
+        time.sleep(0.1)
+
+
+class TestBinaryProtocol:
+
+    def test_binary_and_text_clients_interoperate(self, reset_clients, server_thread):
+        server_thread(port=8095)
+
+        text = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        text.connect(('127.0.0.1', 8095))
+        text.recv(1024)
+        text.send(b"Alice\n")
+        time.sleep(0.1)
+        text.recv(1024)
+
+        bot = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        bot.settimeout(2)
+        bot.connect(('127.0.0.1', 8095))
+        assert bot.recv(1024) == b"Enter your name: "
+        bot.send(b"/binary bot\n")
+        reader = FrameReader(bot)
+
+        kind, bot_id, name = protocol.read_packet(reader)
+        assert (kind, bytes(name)) == (protocol.WELCOME, b"bot")
+        kind, sender_id, name = protocol.read_packet(reader)
+        assert (kind, sender_id, bytes(name)) == (protocol.JOIN, bot_id, b"bot")
+        assert text.recv(1024) == b"[Server] bot joined the chat!\n"
+
+        text.send(b"hello bot\n")
+        kind, sender_id, payload = protocol.read_packet(reader)
+        assert (kind, bytes(payload)) == (protocol.CHAT, b"hello bot")
+        assert sender_id not in (0, bot_id)
+
+        bot.sendall(protocol.pack(protocol.CHAT, 0, b"beep\nboop"))
+        time.sleep(0.1)
+        assert text.recv(1024) == b"[bot] beep boop\n"
+
+        bot.sendall(protocol.pack(protocol.LIST, 0))
+        kind, _, roster = protocol.read_packet(reader)
+        assert (kind, bytes(roster)) == (protocol.LIST, b"Alice\nbot")
+
+        bot.sendall(protocol.pack(protocol.QUIT, 0))
+        time.sleep(0.2)
+        assert text.recv(1024) == b"[Server] bot left the chat!\n"
+
+        text.close()
+        bot.close()
+        time.sleep(0.1)
+
+    def test_welcome_comes_first_in_a_busy_lobby(self, reset_clients, server_thread):
+        server_thread(port=8128)
+
+        text = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        text.connect(('127.0.0.1', 8128))
+        text.recv(1024)
+        text.send(b"Alice\n")
+        time.sleep(0.1)
+        stop = threading.Event()
+
+        def flood():
+            while not stop.is_set():
+                text.sendall(b"busy\n" * 20)
+                time.sleep(0.001)
+
+        flooder = threading.Thread(target=flood, daemon=True)
+        flooder.start()
+        bots = []
+        try:
+            for i in range(50):
+                bot = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                bot.settimeout(2)
+                bot.connect(('127.0.0.1', 8128))
+                bots.append(bot)
+                assert bot.recv(1024) == b"Enter your name: "
+                bot.send(f"/binary bot{i}\n".encode())
+                kind, _, name = protocol.read_packet(FrameReader(bot))
+                assert (kind, bytes(name)) == (protocol.WELCOME, f"bot{i}".encode())
+        finally:
+            stop.set()
+            flooder.join()
+            for bot in bots:
+                bot.close()
+            text.close()
+            time.sleep(0.2)
+
+
+class TestStats:
+
+    def test_stats_command_and_endpoint(self, reset_clients, server_thread):
+        server_thread(port=8098, stats_port=8099)
+
+        alice = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        alice.settimeout(2)
+        alice.connect(('127.0.0.1', 8098))
+        alice.recv(1024)
+        alice.send(b"Alice\n")
+        time.sleep(0.1)
+        alice.recv(1024)
+
+        alice.send(b"hello\n/stats\n")
+        time.sleep(0.2)
+        stats = dict(line.split(" ", 1) for line in alice.recv(65536).decode().splitlines())
+        assert stats["clients"] == "1"
+        assert int(stats["messages_in"]) >= 2
+        assert int(stats["clients_lock_wait_seconds_count"]) > 0
+        assert "fanout_seconds_p99" in stats
+
+        with urllib.request.urlopen("http://127.0.0.1:8099/", timeout=2) as response:
+            body = response.read().decode()
+        assert "connections_total " in body
+        assert "outbox_queued_bytes " in body
+
+        alice.close()
+        time.sleep(0.1)
+
+
+class TestAdmission:
+
+    def connect(self, port):
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.settimeout(2)
+        client.connect(('127.0.0.1', port))
+        return client
+
+    def test_reject_when_full(self, reset_clients, server_thread):
+        server_thread(port=8100, max_connections=2)
+
+        first, second = self.connect(8100), self.connect(8100)
+        assert first.recv(1024) == b"Enter your name: "
+        assert second.recv(1024) == b"Enter your name: "
+
+        third = self.connect(8100)
+        assert third.recv(1024) == b"Server full, try again later\n"
+        assert third.recv(1024) == b""
+
+        first.close()
+        time.sleep(0.2)
+        fourth = self.connect(8100)
+        assert fourth.recv(1024) == b"Enter your name: "
+
+        for client in (second, third, fourth):
+            client.close()
+        time.sleep(0.1)
+
+    def test_hold_when_full(self, reset_clients, server_thread):
+        server_thread(port=8101, max_connections=1, when_full='hold')
+
+        first = self.connect(8101)
+        assert first.recv(1024) == b"Enter your name: "
+
+        # Sits in the listen backlog until the first client leaves
+        second = self.connect(8101)
+        second.settimeout(0.3)
+        with pytest.raises(socket.timeout):
+            second.recv(1024)
+
+        first.close()
+        second.settimeout(2)
+        assert second.recv(1024) == b"Enter your name: "
+
+        second.close()
+        time.sleep(0.1)
+
+
+class TestPoolHandler:
+
+    def test_chat_through_worker_pool(self, reset_clients, server_thread):
+        server_thread(port=8102, handler='pool', pool_size=2)
+
+        names = ["Alice", "Bob", "Carol", "Dave", "Eve"]
+        threads = threading.active_count()
+        users = []
+        for name in names:
+            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client.settimeout(2)
+            client.connect(('127.0.0.1', 8102))
+            assert client.recv(1024) == b"Enter your name: "
+            client.send(f"{name}\n".encode())
+            time.sleep(0.05)
+            users.append(client)
+        time.sleep(0.1)
+        for client in users:
+            client.recv(4096)
+
+        with clients_lock:
+            assert sorted(clients.values()) == names
+        # Only each client's writer thread: no reader thread per client
+        assert threading.active_count() - threads == len(names)
+
+        users[0].send(b"hi ")
+        time.sleep(0.05)
+        users[0].send(b"all\n/list\n")
+        time.sleep(0.2)
+        for client in users[1:]:
+            assert client.recv(1024) == b"[Alice] hi all\n"
+        assert users[0].recv(1024) == b"Current clients: Alice, Bob, Carol, Dave, Eve\n"
+
+        for client in users:
+            client.close()
+        time.sleep(0.2)
+        with clients_lock:
+            assert len(clients) == 0
+
+    def test_pool_handshake_timeout(self, reset_clients, server_thread):
+        server_thread(port=8103, handler='pool', handshake_timeout=0.2)
+
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.connect(('127.0.0.1', 8103))
+        client.recv(1024)
+
+        client.settimeout(3)
+        assert client.recv(1024) == b""
+        client.close()
+
+
+class TestLockFreeFanOut:
+
+    def test_chat_and_list_do_not_wait_for_clients_lock(self, reset_clients, server_thread):
+        server_thread(port=8104)
+
+        users = []
+        for name in ("Alice", "Bob"):
+            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client.settimeout(2)
+            client.connect(('127.0.0.1', 8104))
+            client.recv(1024)
+            client.send(f"{name}\n".encode())
+            time.sleep(0.1)
+            users.append(client)
+        alice, bob = users
+        alice.recv(1024)
+        bob.recv(1024)
+
+        # Membership changes are blocked, but reading the snapshot is not
+        with clients_lock:
+            alice.send(b"still here\n")
+            assert bob.recv(1024) == b"[Alice] still here\n"
+            bob.send(b"/list\n")
+            assert bob.recv(1024) == b"Current clients: Alice, Bob\n"
+
+        alice.close()
+        bob.close()
+        time.sleep(0.1)
+
+
+class TestDirectMessages:
+
+    def connect(self, port, name, prompt=b"Enter your name: "):
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.settimeout(2)
+        client.connect(('127.0.0.1', port))
+        assert client.recv(1024) == prompt
+        client.send(f"{name}\n".encode())
+        time.sleep(0.1)
+        return client
+
+    def test_msg_reaches_only_the_named_user(self, reset_clients, server_thread):
+        server_thread(port=8105)
+        alice = self.connect(8105, "Alice")
+        bob = self.connect(8105, "Bob")
+        carol = self.connect(8105, "Carol")
+        time.sleep(0.1)
+        for client in (alice, bob, carol):
+            client.recv(4096)
+
+        alice.send(b"/msg Carol  psst, over here\n")
+        assert carol.recv(1024) == b"[Alice -> you] psst, over here\n"
+        bob.settimeout(0.2)
+        with pytest.raises(socket.timeout):
+            bob.recv(1024)
+
+        alice.send(b"/msg Dave hello\n")
+        assert alice.recv(1024) == b"No such user: Dave\n"
+        alice.send(b"/msg Carol\n")
+        assert alice.recv(1024) == b"Usage: /msg <user> <text>\n"
+
+        for client in (alice, bob, carol):
+            client.close()
+        time.sleep(0.1)
+
+    def test_binary_direct_message(self, reset_clients, server_thread):
+        server_thread(port=8106)
+        alice = self.connect(8106, "Alice")
+        bot = self.connect(8106, "/binary bot")
+        reader = FrameReader(bot)
+        kind, bot_id, _ = protocol.read_packet(reader)
+        assert kind == protocol.WELCOME
+        assert protocol.read_packet(reader)[0] == protocol.JOIN
+        alice.recv(1024)
+
+        bot.send(protocol.pack(protocol.DIRECT, bot_id, b"Alice\nbeep"))
+        assert alice.recv(1024) == b"[bot -> you] beep\n"
+        alice.send(b"/msg bot boop\n")
+        kind, _, payload = protocol.read_packet(reader)
+        assert (kind, bytes(payload)) == (protocol.DIRECT, b"boop")
+
+        bot.send(protocol.pack(protocol.DIRECT, bot_id, b"nobody\nbeep"))
+        kind, _, payload = protocol.read_packet(reader)
+        assert (kind, bytes(payload)) == (protocol.NOTICE, b"No such user: nobody")
+
+        alice.close()
+        bot.close()
+        time.sleep(0.1)
+
+    def test_binary_direct_message_cannot_forge_lines(self, reset_clients, server_thread):
+        server_thread(port=8129)
+        alice = self.connect(8129, "Alice")
+        bot = self.connect(8129, "/binary bot")
+        reader = FrameReader(bot)
+        _, bot_id, _ = protocol.read_packet(reader)
+        alice.recv(1024)
+
+        forged = b"hi\n[Server] Admin: please re-enter your password"
+        bot.send(protocol.pack(protocol.DIRECT, bot_id, b"Alice\n" + forged))
+        assert alice.recv(1024) == \
+            b"[bot -> you] hi [Server] Admin: please re-enter your password\n"
+
+        # The same from a bot on another cluster worker
+        chat_server.deliver_remote(protocol.JOIN, 99, b"ghost")
+        alice.recv(1024)
+        chat_server.deliver_remote(protocol.DIRECT, 99, b"Alice\n" + forged)
+        assert alice.recv(1024) == \
+            b"[ghost -> you] hi [Server] Admin: please re-enter your password\n"
+        chat_server.deliver_remote(protocol.LEAVE, 99, b"ghost")
+
+        alice.close()
+        bot.close()
+        time.sleep(0.1)
+
+    @pytest.mark.parametrize('port, handler', [(8107, 'thread'), (8108, 'pool')])
+    def test_taken_name_is_prompted_again(self, reset_clients, server_thread, port, handler):
+        server_thread(port=port, handler=handler)
+        first = self.connect(port, "Alice")
+        second = self.connect(port, "Alice")
+
+        assert second.recv(1024) == b"That name is taken. Enter your name: "
+        second.send(b"Alicia\n")
+        time.sleep(0.1)
+        with clients_lock:
+            assert sorted(clients.values()) == ["Alice", "Alicia"]
+            assert sorted(names) == ["Alice", "Alicia"]
+
+        first.close()
+        time.sleep(0.2)
+        with clients_lock:
+            assert list(names) == ["Alicia"]
+        second.close()
+        time.sleep(0.1)
+
+    def test_list_reply_is_cached_until_membership_changes(self, reset_clients, server_thread):
+        server_thread(port=8109)
+        alice = self.connect(8109, "Alice")
+        alice.recv(1024)
+
+        first = chat_server.snapshot.list_replies()
+        assert chat_server.snapshot.list_replies() is first
+        alice.send(b"/list\n")
+        assert alice.recv(1024) == b"Current clients: Alice\n"
+
+        bob = self.connect(8109, "Bob")
+        alice.recv(1024)
+        assert chat_server.snapshot.list_replies() is not first
+        alice.send(b"/list\n")
+        assert alice.recv(1024) == b"Current clients: Alice, Bob\n"
+
+        alice.close()
+        bob.close()
+        time.sleep(0.1)
+
+
+class TestHistory:
+
+    def connect(self, port, name):
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.settimeout(2)
+        client.connect(('127.0.0.1', port))
+        client.recv(1024)
+        client.send(f"{name}\n".encode())
+        time.sleep(0.1)
+        return client
+
+    def test_joiner_gets_recent_messages_in_one_write(self, reset_clients, server_thread):
+        server_thread(port=8110, history_replay=2)
+        alice = self.connect(8110, "Alice")
+        for text in (b"one\n", b"two\n", b"three\n"):
+            alice.send(text)
+            time.sleep(0.05)
+
+        bob = self.connect(8110, "Bob")
+        assert bob.recv(1024) == b"[Alice] two\n[Alice] three\n[Server] Bob joined the chat!\n"
+
+        bob.send(b"/history 5\n")
+        assert bob.recv(1024) == b"[Alice] one\n[Alice] two\n[Alice] three\n"
+        bob.send(b"/history lots\n")
+        assert bob.recv(1024) == b"Usage: /history [N]\n"
+        bob.send(b"/join games\n/history\n")
+        time.sleep(0.1)
+        assert bob.recv(1024) == b"[Server] Bob joined games\nNo messages in games yet\n"
+
+        alice.close()
+        bob.close()
+        time.sleep(0.1)
+
+    def test_replay_is_queued_as_one_frame(self):
+        class Outbox:
+            frames = []
+
+            def put(self, frame):
+                self.frames.append(frame)
+                return True
+
+        chat_server.history = chat_server.History()
+        for text in (b"[A] one\n", b"[A] two\n"):
+            chat_server.history.append(chat_server.LOBBY, text, b"")
+        session = chat_server.Session(None, "Bob", Outbox())
+
+        assert chat_server.replay(session, 5) == 2
+        assert session.outbox.frames == [b"[A] one\n[A] two\n"]
+
+    def test_durable_replay_is_bounded(self, tmp_path):
+        class Outbox:
+            frames = []
+
+            def put(self, frame):
+                self.frames.append(frame)
+                return True
+
+        chat_server.history = chat_server.History(max_bytes=1000, max_replay=50)
+        chat_server.journal = chat_server.Journal(str(tmp_path))
+        try:
+            for i in range(100):
+                chat_server.journal.append(chat_server.LOBBY, 1, "A", b"x" * 10)
+            chat_server.journal.close()
+            session = chat_server.Session(None, "Bob", Outbox())
+
+            assert chat_server.replay(session, 10 ** 9, durable=True) == 50
+            chat_server.history.max_bytes = 100
+            assert chat_server.replay(session, 10 ** 9, durable=True) == 10
+        finally:
+            chat_server.journal = None
+            chat_server.history = chat_server.History()
+
+    def test_binary_history_request(self, reset_clients, server_thread):
+        server_thread(port=8111)
+        alice = self.connect(8111, "Alice")
+        alice.send(b"hello bots\n")
+        time.sleep(0.1)
+
+        bot = self.connect(8111, "/binary bot")
+        reader = FrameReader(bot)
+        assert protocol.read_packet(reader)[0] == protocol.WELCOME
+        kind, _, payload = protocol.read_packet(reader)
+        assert (kind, bytes(payload)) == (protocol.CHAT, b"hello bots")
+        assert protocol.read_packet(reader)[0] == protocol.JOIN
+
+        bot.send(protocol.pack(protocol.HISTORY, 0, b"1"))
+        kind, _, payload = protocol.read_packet(reader)
+        assert (kind, bytes(payload)) == (protocol.CHAT, b"hello bots")
+
+        alice.close()
+        bot.close()
+        time.sleep(0.1)
+
+
+class TestCompression:
+
+    def test_zlib_client_gets_one_compressed_stream(self, reset_clients, server_thread):
+        server_thread(port=8112)
+        clients = {}
+        for name in ("/zlib Alice", "Bob", "/zlib /binary bot"):
+            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client.settimeout(2)
+            client.connect(('127.0.0.1', 8112))
+            assert client.recv(1024) == b"Enter your name: "
+            client.send(f"{name}\n".encode())
+            time.sleep(0.1)
+            clients[name.split()[-1]] = client
+        alice, bob, bot = clients["Alice"], clients["Bob"], clients["bot"]
+        inflate_alice = zlib.decompressobj()
+        inflate_bot = zlib.decompressobj()
+        alice_joined = inflate_alice.decompress(alice.recv(4096))
+        assert alice_joined.startswith(b"[Server] Alice joined the chat!\n")
+        inflate_bot.decompress(bot.recv(4096))
+        bob.recv(4096)
+
+        bob.send(b"hello compressed world\n")
+        time.sleep(0.1)
+        assert inflate_alice.decompress(alice.recv(4096)) == b"[Bob] hello compressed world\n"
+        assert inflate_bot.decompress(bot.recv(4096)) == protocol.pack(
+            protocol.CHAT, chat_server.names["Bob"].id, b"hello compressed world"
+        )
+
+        for client in (alice, bob, bot):
+            client.close()
+        time.sleep(0.1)
+
+
+class TestHeartbeat:
+
+    def connect(self, port, name):
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.settimeout(4)
+        client.connect(('127.0.0.1', port))
+        client.recv(1024)
+        client.send(f"{name}\n".encode())
+        time.sleep(0.1)
+        return client
+
+    def test_silent_binary_client_is_pinged_then_evicted(self, reset_clients, server_thread):
+        server_thread(port=8113, heartbeat=1.0, idle_timeout=2.0)
+        bot = self.connect(8113, "/binary bot")
+        reader = FrameReader(bot)
+        assert protocol.read_packet(reader)[0] == protocol.WELCOME
+        assert protocol.read_packet(reader)[0] == protocol.JOIN
+
+        start = time.monotonic()
+        assert protocol.read_packet(reader)[0] == protocol.PING
+        assert 0.5 <= time.monotonic() - start < 2.0
+        assert protocol.read_packet(reader) is None
+        assert 1.5 <= time.monotonic() - start < 3.5
+        time.sleep(0.1)
+        with clients_lock:
+            assert "bot" not in names
+
+    def test_answering_pings_keeps_the_session(self, reset_clients, server_thread):
+        server_thread(port=8114, heartbeat=1.0, idle_timeout=2.0)
+        bot = self.connect(8114, "/binary bot")
+        alice = self.connect(8114, "Alice")
+        reader = FrameReader(bot)
+
+        deadline = time.monotonic() + 3.5
+        while time.monotonic() < deadline:
+            kind, _, _ = protocol.read_packet(reader)
+            if kind == protocol.PING:
+                bot.send(protocol.pack(protocol.PONG, 0))
+        with clients_lock:
+            # Text clients are left to TCP keepalive, not evicted for silence
+            assert sorted(names) == ["Alice", "bot"]
+        assert alice.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE) == 0
+        with clients_lock:
+            assert names["Alice"].sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+
+        bot.close()
+        alice.close()
+        time.sleep(0.1)
+
+
+class TestDrain:
+
+    def test_stop_notifies_and_disconnects_everyone(self, reset_clients, server_thread):
+        stop = threading.Event()
+        thread = server_thread(port=8115, stop=stop, drain_timeout=1.0)
+        users = []
+        for name in ("Alice", "/binary bot"):
+            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client.settimeout(3)
+            client.connect(('127.0.0.1', 8115))
+            client.recv(1024)
+            client.send(f"{name}\n".encode())
+            time.sleep(0.1)
+            users.append(client)
+        alice, bot = users
+        alice.recv(1024)
+        reader = FrameReader(bot)
+        while protocol.read_packet(reader)[0] != protocol.JOIN:
+            pass
+
+        stop.set()
+        start = time.monotonic()
+        assert alice.recv(1024) == b"[Server] Server is shutting down\n"
+        assert alice.recv(1024) == b""
+        kind, _, payload = protocol.read_packet(reader)
+        assert (kind, bytes(payload)) == (protocol.NOTICE, b"Server is shutting down")
+        assert protocol.read_packet(reader) is None
+        thread.join(3)
+        assert not thread.is_alive()
+        assert time.monotonic() - start < 2.0
+        with clients_lock:
+            assert not names
+
+        with pytest.raises(ConnectionRefusedError):
+            socket.create_connection(('127.0.0.1', 8115))
+
+
+class TestJournal:
+
+    def connect(self, port, name):
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.settimeout(2)
+        client.connect(('127.0.0.1', port))
+        client.recv(1024)
+        client.send(f"{name}\n".encode())
+        time.sleep(0.1)
+        return client
+
+    def test_history_survives_a_restart(self, reset_clients, server_thread, tmp_path):
+        stop = threading.Event()
+        thread = server_thread(port=8116, stop=stop, drain_timeout=0.5, journal_dir=str(tmp_path))
+        alice = self.connect(8116, "Alice")
+        for text in (b"one\n", b"two\n"):
+            alice.send(text)
+            time.sleep(0.05)
+        stop.set()
+        thread.join(3)
+        alice.close()
+
+        server_thread(port=8117, history_replay=0, journal_dir=str(tmp_path))
+        bob = self.connect(8117, "Bob")
+        assert bob.recv(1024) == b"[Server] Bob joined the chat!\n"
+        bob.send(b"/history 5\n")
+        assert bob.recv(1024) == b"[Alice] one\n[Alice] two\n"
+        bob.close()
+        time.sleep(0.1)
+
+
+class TestRateLimit:
+
+    def connect(self, port, name):
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.settimeout(2)
+        client.connect(('127.0.0.1', port))
+        client.recv(1024)
+        client.send(f"{name}\n".encode())
+        time.sleep(0.1)
+        return client
+
+    def received_lines(self, client, seconds):
+        data = b""
+        deadline = time.monotonic() + seconds
+        client.settimeout(0.05)
+        while time.monotonic() < deadline:
+            try:
+                data += client.recv(65536)
+            except socket.timeout:
+                pass
+        return [line for line in data.split(b"\n") if line.startswith(b"[Alice]")]
+
+    @pytest.mark.parametrize('port, handler', [(8118, 'thread'), (8119, 'pool')])
+    def test_flood_is_slowed_not_dropped(self, reset_clients, server_thread, port, handler):
+        server_thread(port=port, handler=handler,
+                      rate_limits=RateLimits(messages=20, burst=0.25))
+        alice = self.connect(port, "Alice")
+        bob = self.connect(port, "Bob")
+        alice.send(b"".join(f"m{i}\n".encode() for i in range(30)))
+
+        # 5 at once from the burst, then 20 a second
+        early = self.received_lines(bob, 0.5)
+        assert 8 <= len(early) <= 18
+        late = self.received_lines(bob, 1.5)
+        assert early + late == [f"[Alice] m{i}".encode() for i in range(30)]
+
+        alice.close()
+        bob.close()
+        time.sleep(0.1)
+
+    def test_limits_are_in_stats(self, reset_clients):
+        chat_server.limits = RateLimits(messages=5, bytes=1000, global_messages=50)
+        stats = chat_server.metrics.render()
+        assert "rate_limit_messages 5\n" in stats
+        assert "rate_limit_bytes 1000\n" in stats
+        assert "rate_limit_global_messages 50\n" in stats
+        assert "throttle_pauses " in stats
+        chat_server.limits = RateLimits()
+
+
+class TestTracing:
+
+    def test_sampled_message_is_traced_end_to_end(self, reset_clients, server_thread, tmp_path):
+        path = tmp_path / 'trace.json'
+        stop = threading.Event()
+        thread = server_thread(port=8126, stop=stop, drain_timeout=0.5,
+                               trace_path=str(path), trace_sample=1.0)
+        users = []
+        for name in ("Alice", "Bob"):
+            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client.settimeout(2)
+            client.connect(('127.0.0.1', 8126))
+            client.recv(1024)
+            client.send(f"{name}\n".encode())
+            time.sleep(0.1)
+            users.append(client)
+        alice, bob = users
+        alice.send(b"traced\n")
+        time.sleep(0.1)
+        stop.set()
+        thread.join(3)
+        alice.close()
+        bob.close()
+
+        names = {event['name'] for event in json.loads(path.read_text())['traceEvents']}
+        assert {'recv', 'handle_text', 'decode', 'encode', 'fan_out',
+                'queued', 'send', 'clients_lock wait', 'clients_lock hold'} <= names
+        assert chat_server.tracing.tracer is None
+
+
+class TestBroadcastShards:
+
+    def connect(self, port, name):
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.settimeout(2)
+        client.connect(('127.0.0.1', port))
+        client.recv(1024)
+        client.send(f"{name}\n".encode())
+        time.sleep(0.1)
+        return client
+
+    def test_every_client_gets_every_message_in_order(self, reset_clients, server_thread):
+        stop = threading.Event()
+        thread = server_thread(port=8127, stop=stop, drain_timeout=0.5, broadcast_shards=4)
+        alice = self.connect(8127, "Alice")
+        others = [self.connect(8127, f"user{i}") for i in range(6)]
+        time.sleep(0.1)
+        for client in others:
+            client.settimeout(0.2)
+            try:
+                while client.recv(65536):
+                    pass
+            except socket.timeout:
+                pass
+        assert len(set(s.id % 4 for s in chat_server.sessions.values())) == 4
+
+        alice.send(b"".join(f"m{i}\n".encode() for i in range(50)))
+        expected = b"".join(f"[Alice] m{i}\n".encode() for i in range(50))
+        for client in others:
+            client.settimeout(2)
+            data = b""
+            while len(data) < len(expected):
+                data += client.recv(65536)
+            assert data == expected
+
+        stop.set()
+        for client in others:
+            assert client.recv(1024) == b"[Server] Server is shutting down\n"
+        thread.join(3)
+        assert chat_server.senders is None
+        for client in [alice] + others:
+            client.close()
+
+
 class TestRemoveClient:
     
     def test_remove_client_function(self, reset_clients):
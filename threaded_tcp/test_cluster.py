@@ -0,0 +1,148 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import pytest
+import protocol
+from cluster import Bus
+
+
+@pytest.fixture
+def cluster():
+    procs = []
+
+    def start_cluster(port, workers=2, *args):
+        proc = subprocess.Popen(
+            [sys.executable, 'chat_server.py', '--host', '127.0.0.1',
+             '--port', str(port), '--workers', str(workers), '--drain-timeout', '1', *args],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.DEVNULL,
+        )
+        procs.append(proc)
+        time.sleep(1.0)
+        return proc
+
+    yield start_cluster
+
+    for proc in procs:
+        proc.terminate()
+        proc.wait(timeout=5)
+
+
+def connect(port, username):
+    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    client.settimeout(2)
+    client.connect(('127.0.0.1', port))
+    client.recv(1024)
+    client.send(f"{username}\n".encode())
+    time.sleep(0.1)
+    return client
+
+
+def drain(client):
+    data = b""
+    try:
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    except socket.timeout:
+        pass
+    return data
+
+
+class TestCluster:
+
+    def test_messages_and_roster_span_workers(self, cluster):
+        cluster(port=8191, workers=2)
+
+        names = [f"User{i}" for i in range(8)]
+        users = [connect(8191, name) for name in names]
+        time.sleep(0.3)
+        for client in users:
+            client.settimeout(0.3)
+            drain(client)
+
+        users[0].send(b"hello cluster\n")
+        time.sleep(0.3)
+        for client in users[1:]:
+            assert b"[User0] hello cluster\n" in drain(client)
+
+        users[-1].send(b"/list\n")
+        time.sleep(0.3)
+        roster = drain(users[-1])
+        for name in names:
+            assert name.encode() in roster
+
+        users[3].close()
+        time.sleep(0.3)
+        assert b"User3 left" in drain(users[0])
+
+        for client in users:
+            client.close()
+
+    def test_workers_share_the_port(self, cluster):
+        proc = cluster(port=8192, workers=3)
+
+        assert proc.poll() is None
+        with open(f"/proc/{proc.pid}/task/{proc.pid}/children") as f:
+            assert len(f.read().split()) == 3
+
+    def test_sigterm_drains_every_worker(self, cluster):
+        proc = cluster(8193, 2)
+        clients = [connect(8193, f"user{i}") for i in range(6)]
+        for client in clients:
+            client.settimeout(0.2)
+            drain(client)
+
+        proc.send_signal(signal.SIGTERM)
+        for client in clients:
+            client.settimeout(5)
+            assert drain(client).endswith(b"[Server] Server is shutting down\n")
+        assert proc.wait(timeout=5) == 0
+        for client in clients:
+            client.close()
+
+    def test_longest_line_crosses_workers(self, cluster):
+        cluster(port=8194, workers=2)
+        names = [f"User{i}" for i in range(8)]
+        users = [connect(8194, name) for name in names]
+        time.sleep(0.3)
+        for client in users:
+            client.settimeout(0.3)
+            drain(client)
+
+        # The default --max-frame, with room for the newline
+        line = b"x" * 4090
+        users[0].send(line + b"\n")
+        time.sleep(0.3)
+        for client in users[1:]:
+            assert b"[User0] " + line + b"\n" in drain(client)
+
+        users[-1].send(b"/list\n")
+        time.sleep(0.3)
+        roster = drain(users[-1])
+        for name in names:
+            assert name.encode() in roster
+        for client in users:
+            client.close()
+
+
+class TestBus:
+
+    def test_publish_survives_a_dead_hub(self, tmp_path):
+        path = str(tmp_path / 'bus.sock')
+        hub = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        hub.bind(path)
+        hub.listen(1)
+        bus = Bus(path)
+        conn, _ = hub.accept()
+        conn.close()
+        hub.close()
+
+        for _ in range(3):
+            bus.publish(protocol.pack(protocol.CHAT, 1, b"x" * 65536))
+        assert bus.lost
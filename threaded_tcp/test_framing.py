@@ -0,0 +1,85 @@
+import socket
+import threading
+import time
+import pytest
+from framing import FrameReader, FrameTooLarge
+
+
+@pytest.fixture
+def sock_pair():
+    a, b = socket.socketpair()
+    yield a, b
+    a.close()
+    b.close()
+
+
+class TestFrameReader:
+
+    def test_merged_lines_are_split(self, sock_pair):
+        reader = FrameReader(sock_pair[0])
+        sock_pair[1].sendall(b"one\ntwo\nthree\n")
+
+        assert bytes(reader.read_frame()) == b"one"
+        assert bytes(reader.read_frame()) == b"two"
+        assert bytes(reader.read_frame()) == b"three"
+
+    def test_split_line_is_joined(self, sock_pair):
+        reader = FrameReader(sock_pair[0])
+
+        def send_in_pieces():
+            for piece in (b"hel", b"lo wo", b"rld\n"):
+                sock_pair[1].sendall(piece)
+                time.sleep(0.05)
+
+        sender = threading.Thread(target=send_in_pieces)
+        sender.start()
+        assert bytes(reader.read_frame()) == b"hello world"
+        sender.join()
+
+    def test_buffer_is_reused_across_frames(self, sock_pair):
+        reader = FrameReader(sock_pair[0], max_frame=16)
+        buf = reader.buf
+
+        for i in range(100):
+            sock_pair[1].sendall(f"line {i:03}\n".encode())
+            assert bytes(reader.read_frame()) == f"line {i:03}".encode()
+
+        assert reader.buf is buf and len(buf) == 16
+
+    def test_crlf_is_stripped(self, sock_pair):
+        reader = FrameReader(sock_pair[0])
+        sock_pair[1].sendall(b"telnet\r\n\r\n")
+
+        assert bytes(reader.read_frame()) == b"telnet"
+        assert bytes(reader.read_frame()) == b""
+
+    def test_read_exact_after_line(self, sock_pair):
+        reader = FrameReader(sock_pair[0], max_frame=16)
+        sock_pair[1].sendall(b"name\n0123456789")
+        sock_pair[1].sendall(b"abcdef")
+
+        assert bytes(reader.read_frame()) == b"name"
+        assert bytes(reader.read_exact(4)) == b"0123"
+        assert bytes(reader.read_exact(12)) == b"456789abcdef"
+
+    def test_frame_too_large(self, sock_pair):
+        reader = FrameReader(sock_pair[0], max_frame=16)
+        sock_pair[1].sendall(b"x" * 32 + b"\n")
+
+        with pytest.raises(FrameTooLarge):
+            reader.read_frame()
+
+    def test_eof_returns_none_and_drops_partial(self, sock_pair):
+        reader = FrameReader(sock_pair[0])
+        sock_pair[1].sendall(b"done\npartial")
+        sock_pair[1].shutdown(socket.SHUT_WR)
+
+        assert bytes(reader.read_frame()) == b"done"
+        assert reader.read_frame() is None
+
+    def test_deadline_covers_whole_frame(self, sock_pair):
+        reader = FrameReader(sock_pair[0])
+        sock_pair[1].sendall(b"slo")
+
+        with pytest.raises(socket.timeout):
+            reader.read_frame(deadline=time.monotonic() + 0.1)
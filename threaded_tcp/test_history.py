@@ -0,0 +1,38 @@
+from history import History
+
+
+class TestHistory:
+
+    def test_last_returns_oldest_first(self):
+        history = History()
+        for i in range(5):
+            history.append('lobby', f"t{i}".encode(), f"b{i}".encode())
+
+        assert history.last('lobby', 3) == [b"t2", b"t3", b"t4"]
+        assert history.last('lobby', 2, binary=True) == [b"b3", b"b4"]
+        assert history.last('lobby', 0) == []
+        assert history.last('games', 3) == []
+
+    def test_byte_budget_evicts_oldest_across_rooms(self):
+        history = History(max_bytes=40)
+        history.append('lobby', b"x" * 5, b"y" * 5)
+        history.append('games', b"x" * 5, b"y" * 5)
+        history.append('lobby', b"x" * 5, b"y" * 5)
+        history.append('lobby', b"x" * 5, b"y" * 5)
+        assert (len(history), history.bytes) == (4, 40)
+
+        history.append('lobby', b"new", b"new")
+        assert (len(history), history.bytes) == (4, 36)
+        assert len(history.last('lobby', 10)) == 3
+        assert len(history.last('games', 10)) == 1
+
+        history.append('lobby', b"x" * 10, b"y" * 10)
+        assert history.last('games', 10) == []
+        assert 'games' not in history.rooms
+        assert history.bytes <= 40
+
+    def test_oversized_message_is_not_kept(self):
+        history = History(max_bytes=10)
+        history.append('lobby', b"x" * 8, b"y" * 8)
+
+        assert len(history) == 0
@@ -0,0 +1,101 @@
+import json
+import os
+import time
+from journal import Journal, main
+
+
+def fill(journal, messages):
+    for room, text in messages:
+        journal.append(room, 7, 'alice', text.encode())
+
+
+class TestJournal:
+
+    def test_records_survive_reopening(self, tmp_path):
+        journal = Journal(str(tmp_path)).start()
+        fill(journal, [('lobby', "one"), ('games', "two")])
+        journal.close()
+
+        journal = Journal(str(tmp_path))
+        assert journal.committed == 2
+        records = [(seq, room, name, message) for seq, (_, _, room, name, message)
+                   in journal.records()]
+        assert records == [(0, 'lobby', 'alice', b"one"), (1, 'games', 'alice', b"two")]
+        assert [seq for seq, _ in journal.records(1)] == [1]
+
+    def test_segments_rotate(self, tmp_path):
+        journal = Journal(str(tmp_path), segment_bytes=100)
+        fill(journal, [('lobby', f"message {i}") for i in range(10)])
+        journal.close()
+
+        assert len(journal.segments) > 1
+        assert len(os.listdir(tmp_path)) == 2 * len(journal.segments)
+        assert [record[4] for _, record in journal.records(3, 6)] == \
+            [b"message 3", b"message 4", b"message 5"]
+
+    def test_tail_of_one_room(self, tmp_path):
+        journal = Journal(str(tmp_path), segment_bytes=100)
+        fill(journal, [('lobby' if i % 3 else 'games', f"m{i}") for i in range(12)])
+        journal.close()
+
+        assert [record[4] for record in journal.tail('games', 2)] == [b"m6", b"m9"]
+        assert [record[4] for record in journal.tail('games', 10)] == \
+            [b"m0", b"m3", b"m6", b"m9"]
+        assert journal.tail('games', 10, scan=3) == [journal.tail('games', 1)[0]]
+        assert journal.tail('nowhere', 5) == []
+        assert [record[4] for record in journal.tail('lobby', 10, max_bytes=6)] == [b"m10", b"m11"]
+        assert [record[4] for record in journal.tail('lobby', 10, max_bytes=5)] == [b"m11"]
+
+    def test_torn_tail_is_dropped(self, tmp_path):
+        journal = Journal(str(tmp_path))
+        fill(journal, [('lobby', "kept"), ('lobby', "torn")])
+        journal.close()
+        # A crash mid-write: the last record's bytes are cut short
+        segment = journal.segments[-1]
+        os.truncate(segment.log_path, os.path.getsize(segment.log_path) - 2)
+
+        journal = Journal(str(tmp_path)).start()
+        assert [record[4] for _, record in journal.records()] == [b"kept"]
+        fill(journal, [('lobby', "after")])
+        journal.close()
+        assert [record[4] for _, record in journal.records()] == [b"kept", b"after"]
+
+    def test_export(self, tmp_path, capsys):
+        journal = Journal(str(tmp_path))
+        fill(journal, [('lobby', "one"), ('games', "two")])
+        journal.close()
+
+        main([str(tmp_path), '--room', 'games'])
+        lines = capsys.readouterr().out.splitlines()
+        assert [json.loads(line)['message'] for line in lines] == ["two"]
+        assert json.loads(lines[0])['seq'] == 1
+
+    def test_export_leaves_a_live_journal_alone(self, tmp_path, capsys):
+        journal = Journal(str(tmp_path))
+        fill(journal, [('lobby', "one")])
+        journal._write_pending()
+        # A writer between its log and index writes: the record is not committed yet
+        journal.log.write(b"\0" * 20)
+        segment = journal.segments[-1]
+        size = os.path.getsize(segment.log_path)
+
+        main([str(tmp_path)])
+        assert [json.loads(line)['message'] for line in capsys.readouterr().out.splitlines()] == ["one"]
+        assert os.path.getsize(segment.log_path) == size
+        journal.close()
+
+    def test_export_of_missing_segments_creates_nothing(self, tmp_path, capsys):
+        main([str(tmp_path)])
+        assert capsys.readouterr().out == ""
+        assert os.listdir(tmp_path) == []
+
+    def test_writer_wakes_on_append(self, tmp_path):
+        journal = Journal(str(tmp_path), sync_interval=0).start()
+        time.sleep(0.05)  # let the writer go idle
+        fill(journal, [('lobby', "one")])
+        deadline = time.monotonic() + 1
+        while journal.committed < 1 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        assert journal.committed == 1
+        journal.close()
+        assert not journal.thread.is_alive()
@@ -0,0 +1,86 @@
+import logging
+import threading
+import pytest
+import metrics
+from logs import RateLimit
+
+
+class TestHistogram:
+
+    def test_percentiles_use_bucket_upper_bounds(self):
+        h = metrics.Histogram()
+        for _ in range(99):
+            h.observe(3e-6)
+        h.observe(0.5)
+
+        assert h.count == 100
+        assert h.percentile(50) == 4e-6
+        assert h.percentile(99) == 4e-6
+        assert h.percentile(99.9) == pytest.approx(0.524288)
+        assert h.max == 0.5
+
+    def test_empty_histogram(self):
+        assert metrics.Histogram().percentile(99) == 0.0
+
+
+class TestTimedLock:
+
+    def test_records_wait_and_hold(self):
+        lock = metrics.TimedLock(metrics.Histogram(), metrics.Histogram())
+        held = threading.Event()
+        release = threading.Event()
+
+        def holder():
+            with lock:
+                held.set()
+                release.wait()
+
+        thread = threading.Thread(target=holder)
+        thread.start()
+        held.wait()
+        assert not lock.acquire(blocking=False)
+        threading.Timer(0.05, release.set).start()
+        with lock:
+            pass
+        thread.join()
+
+        assert lock.hold.count == 2
+        assert lock.wait.count == 2
+        assert lock.wait.max >= 0.04
+        assert lock.hold.max >= 0.04
+
+
+class TestRender:
+
+    def test_render_lists_every_series(self):
+        metrics.counter('test_render_total').inc(3)
+        metrics.gauge('test_render_gauge', lambda: 7)
+        metrics.histogram('test_render_seconds').observe(1e-3)
+
+        lines = metrics.render().splitlines()
+
+        assert "test_render_total 3" in lines
+        assert "test_render_gauge 7" in lines
+        assert "test_render_seconds_count 1" in lines
+        assert "test_render_seconds_p999 0.001024" in lines
+
+
+class TestRateLimit:
+
+    def make_record(self, lineno=1):
+        return logging.LogRecord('chat_server', logging.INFO, 'x.py', lineno, "hi %s", ("there",), None)
+
+    def test_suppresses_and_reports_count(self, monkeypatch):
+        now = [100.0]
+        monkeypatch.setattr('logs.time.monotonic', lambda: now[0])
+        limit = RateLimit(rate=1, burst=2)
+
+        passed = [limit.filter(self.make_record()) for _ in range(5)]
+        assert passed == [True, True, False, False, False]
+        # Call sites are limited independently
+        assert limit.filter(self.make_record(lineno=2))
+
+        now[0] += 1.0
+        record = self.make_record()
+        assert limit.filter(record)
+        assert record.getMessage() == "hi there (3 similar suppressed)"
@@ -0,0 +1,208 @@
+import socket
+import time
+import zlib
+import pytest
+from outbound import Outbox, SlowConsumerPolicy, WritePolicy, send_calls, frames_sent, \
+    compress_batch, compressor
+from outbound import DROP_OLDEST, DROP_NEWEST, DISCONNECT, LATENCY, THROUGHPUT
+
+
+@pytest.fixture
+def sock_pair():
+    a, b = socket.socketpair()
+    yield a, b
+    a.close()
+    b.close()
+
+
+def queued(outbox):
+    return [frame for frame, _ in outbox.frames]
+
+
+class TestPolicies:
+
+    def test_drop_oldest_keeps_newest_frames(self, sock_pair):
+        outbox = Outbox(sock_pair[0], SlowConsumerPolicy(DROP_OLDEST, max_bytes=10))
+
+        for frame in (b"aaaa", b"bbbb", b"cccc"):
+            assert outbox.put(frame)
+
+        assert queued(outbox) == [b"bbbb", b"cccc"]
+        assert outbox.queued_bytes == 8
+        assert outbox.dropped == 1
+
+    def test_drop_newest_keeps_oldest_frames(self, sock_pair):
+        outbox = Outbox(sock_pair[0], SlowConsumerPolicy(DROP_NEWEST, max_bytes=10))
+
+        for frame in (b"aaaa", b"bbbb", b"cccc"):
+            assert outbox.put(frame)
+
+        assert queued(outbox) == [b"aaaa", b"bbbb"]
+        assert outbox.dropped == 1
+
+    def test_disconnect_on_byte_backlog(self, sock_pair):
+        outbox = Outbox(sock_pair[0], SlowConsumerPolicy(DISCONNECT, max_bytes=10))
+
+        assert outbox.put(b"aaaa")
+        assert outbox.put(b"bbbb")
+        assert not outbox.put(b"cccc")
+
+        assert outbox.closed
+        sock_pair[1].settimeout(1)
+        assert sock_pair[1].recv(1024) == b""
+
+    def test_disconnect_on_time_backlog(self, sock_pair):
+        policy = SlowConsumerPolicy(DISCONNECT, max_bytes=1024, max_delay=0.05)
+        outbox = Outbox(sock_pair[0], policy)
+
+        assert outbox.put(b"aaaa")
+        time.sleep(0.1)
+        assert not outbox.put(b"bbbb")
+        assert outbox.closed
+
+    def test_unknown_policy_rejected(self):
+        with pytest.raises(ValueError):
+            SlowConsumerPolicy('block')
+
+
+class TestWriter:
+
+    def test_writer_drains_queue_in_order(self, sock_pair):
+        outbox = Outbox(sock_pair[0]).start()
+
+        outbox.put(b"one\n")
+        outbox.put(b"two\n")
+        time.sleep(0.1)
+
+        assert sock_pair[1].recv(1024) == b"one\ntwo\n"
+        outbox.close()
+        outbox.thread.join(timeout=1)
+        assert not outbox.thread.is_alive()
+
+    def test_queued_frames_coalesce_into_one_send(self, sock_pair):
+        outbox = Outbox(sock_pair[0])
+        for frame in (b"one\n", b"two\n", b"three\n"):
+            outbox.put(frame)
+        calls = send_calls.value
+
+        outbox.start()
+        time.sleep(0.1)
+
+        assert sock_pair[1].recv(1024) == b"one\ntwo\nthree\n"
+        assert send_calls.value == calls + 1
+        outbox.close()
+
+    def test_throughput_mode_waits_to_batch(self, sock_pair):
+        outbox = Outbox(sock_pair[0], write_policy=WritePolicy(THROUGHPUT, flush_delay=0.2)).start()
+        calls = send_calls.value
+
+        outbox.put(b"one\n")
+        time.sleep(0.05)
+        outbox.put(b"two\n")
+        time.sleep(0.3)
+
+        assert sock_pair[1].recv(1024) == b"one\ntwo\n"
+        assert send_calls.value == calls + 1
+        outbox.close()
+
+    def test_drain_flushes_then_shuts_down(self, sock_pair):
+        outbox = Outbox(sock_pair[0])
+        for frame in (b"one\n", b"two\n"):
+            outbox.put(frame)
+        outbox.drain()
+        assert not outbox.put(b"three\n")
+
+        outbox.start()
+        sock_pair[1].settimeout(1)
+        received = b""
+        while chunk := sock_pair[1].recv(1024):
+            received += chunk
+        assert received == b"one\ntwo\n"
+        outbox.thread.join(1)
+        assert not outbox.thread.is_alive()
+
+    def test_partial_sendmsg_resends_the_rest(self):
+        class Trickle:
+            """Socket that accepts at most 3 bytes per call"""
+            family = socket.AF_UNIX
+
+            def __init__(self):
+                self.data = b""
+
+            def sendmsg(self, buffers):
+                chunk = b"".join(bytes(b) for b in buffers)[:3]
+                self.data += chunk
+                return len(chunk)
+
+        sock = Trickle()
+        outbox = Outbox(sock)
+        outbox._send([b"ab", b"cdef", b"g"], 7)
+
+        assert sock.data == b"abcdefg"
+
+        # Every frame of a batch counts, however many writes it took
+        sent = frames_sent.value
+        for frame in (b"ab", b"cdef", b"g"):
+            outbox.put(frame)
+        outbox.start()
+        deadline = time.monotonic() + 1
+        while len(sock.data) < 14 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        assert frames_sent.value == sent + 3
+        outbox.close()
+
+
+class TestWritePolicy:
+
+    def test_latency_mode_sets_nodelay(self):
+        server = socket.create_server(('127.0.0.1', 0))
+        client = socket.create_connection(server.getsockname())
+        conn, _ = server.accept()
+
+        Outbox(conn, write_policy=WritePolicy(LATENCY))
+        assert conn.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+
+        for s in (conn, client, server):
+            s.close()
+
+    def test_unknown_mode_rejected(self):
+        with pytest.raises(ValueError):
+            WritePolicy('eager')
+
+
+class TestCompression:
+
+    def test_stream_inflates_after_every_batch(self, sock_pair):
+        outbox = Outbox(sock_pair[0], compress=True).start()
+        inflate = zlib.decompressobj()
+        sock_pair[1].settimeout(1)
+
+        for frames in ([b"[Alice] hi\n"], [b"[Bob] hi\n", b"[Alice] how are you?\n"]):
+            for frame in frames:
+                outbox.put(frame)
+            time.sleep(0.1)
+            assert inflate.decompress(sock_pair[1].recv(1024)) == b"".join(frames)
+        outbox.close()
+
+    def test_frames_sent_counts_frames_not_chunks(self, sock_pair):
+        outbox = Outbox(sock_pair[0], compress=True)
+        sent = frames_sent.value
+        for i in range(50):
+            outbox.put(f"[Alice] message {i}\n".encode())
+        outbox.start()
+        sock_pair[1].settimeout(1)
+        sock_pair[1].recv(65536)
+        time.sleep(0.05)
+        assert frames_sent.value == sent + 50
+        outbox.close()
+
+    def test_context_persists_across_batches(self):
+        stream = compressor()
+        line = b"[Alice] the quick brown fox jumps over the lazy dog\n"
+
+        first = sum(map(len, compress_batch(stream, [line])))
+        again = sum(map(len, compress_batch(stream, [line])))
+
+        # The repeat is a back-reference into the previous batch
+        assert again < first / 3
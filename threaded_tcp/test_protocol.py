@@ -0,0 +1,58 @@
+import socket
+import pytest
+import protocol
+from framing import FrameReader
+
+
+@pytest.fixture
+def sock_pair():
+    a, b = socket.socketpair()
+    yield a, b
+    a.close()
+    b.close()
+
+
+class TestProtocol:
+
+    def test_negotiate(self):
+        assert protocol.negotiate("Alice") == ("Alice", False)
+        assert protocol.negotiate("/binary bot-7") == ("bot-7", True)
+
+    def test_negotiate_compression(self):
+        assert protocol.negotiate_compression("Alice") == ("Alice", False)
+        assert protocol.negotiate_compression("/zlib Alice") == ("Alice", True)
+        assert protocol.negotiate_compression("/zlib /binary bot-7") == ("/binary bot-7", True)
+
+    def test_pack_header(self):
+        packet = protocol.pack(protocol.CHAT, 42, b"hi")
+
+        assert packet == b"\x00\x00\x00\x02\x01\x00\x00\x00\x2ahi"
+
+    def test_round_trip_binary_payload(self, sock_pair):
+        reader = FrameReader(sock_pair[0])
+        payload = bytes(range(256)) * 4
+        sock_pair[1].sendall(protocol.pack(protocol.CHAT, 7, payload) + protocol.pack(protocol.QUIT, 7))
+
+        kind, sender_id, data = protocol.read_packet(reader)
+        assert (kind, sender_id, bytes(data)) == (protocol.CHAT, 7, payload)
+        kind, sender_id, data = protocol.read_packet(reader)
+        assert (kind, sender_id, bytes(data)) == (protocol.QUIT, 7, b"")
+
+    def test_eof_mid_packet(self, sock_pair):
+        reader = FrameReader(sock_pair[0])
+        sock_pair[1].sendall(protocol.pack(protocol.CHAT, 1, b"truncated")[:-3])
+        sock_pair[1].shutdown(socket.SHUT_WR)
+
+        assert protocol.read_packet(reader) is None
+
+    def test_nonblocking_partial_packet_is_retried(self, sock_pair):
+        reader = FrameReader(sock_pair[0], flags=socket.MSG_DONTWAIT)
+        packet = protocol.pack(protocol.CHAT, 3, b"split packet")
+        sock_pair[1].sendall(packet[:12])
+
+        with pytest.raises(BlockingIOError):
+            protocol.read_packet(reader)
+
+        sock_pair[1].sendall(packet[12:])
+        kind, sender_id, data = protocol.read_packet(reader)
+        assert (kind, sender_id, bytes(data)) == (protocol.CHAT, 3, b"split packet")
@@ -0,0 +1,43 @@
+import pytest
+from ratelimit import TokenBucket, RateLimits
+
+
+class TestTokenBucket:
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=10, burst=3)
+        bucket.time = 0.0
+        assert [bucket.charge(1, 0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+        # In debt by one token: a tenth of a second to repay
+        assert bucket.charge(1, 0.0) == pytest.approx(0.1)
+        assert bucket.charge(1, 0.2) == 0.0
+        assert bucket.charge(1, 10.0) == 0.0
+        assert bucket.tokens == 2
+
+    def test_large_charge_waits_proportionally(self):
+        bucket = TokenBucket(rate=1000, burst=1000)
+        bucket.time = 0.0
+        assert bucket.charge(3000, 0.0) == pytest.approx(2.0)
+
+
+class TestRateLimits:
+
+    def test_no_limits_means_no_throttle(self):
+        assert RateLimits().throttle() is None
+
+    def test_slowest_bucket_wins(self):
+        throttle = RateLimits(messages=100, bytes=1000, burst=1).throttle()
+        assert throttle.charge(500) == 0.0
+        assert throttle.charge(1500) == pytest.approx(1.0, abs=0.01)
+        assert throttle.until > 0
+
+    def test_global_bucket_is_shared(self):
+        limits = RateLimits(global_messages=2, burst=1)
+        first, second = limits.throttle(), limits.throttle()
+        assert first.charge(10) == 0.0
+        assert second.charge(10) == 0.0
+        assert first.charge(10) > 0.4
+
+    def test_negative_limit_rejected(self):
+        with pytest.raises(ValueError):
+            RateLimits(messages=-1)
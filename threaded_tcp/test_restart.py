@@ -0,0 +1,85 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import pytest
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def servers():
+    procs = []
+
+    def start_server(port, *args):
+        proc = subprocess.Popen(
+            [sys.executable, 'chat_server.py', '--host', '127.0.0.1', '--port', str(port),
+             '--drain-timeout', '1', *args],
+            cwd=HERE,
+            stdout=subprocess.DEVNULL,
+        )
+        procs.append(proc)
+        time.sleep(0.8)
+        return proc
+
+    yield start_server
+
+    for proc in procs:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+
+def connect(port, name):
+    client = socket.create_connection(('127.0.0.1', port), timeout=3)
+    assert client.recv(1024) == b"Enter your name: "
+    client.send(f"{name}\n".encode())
+    return client
+
+
+class TestHotRestart:
+
+    def test_listener_handoff_refuses_no_connections(self, servers, tmp_path):
+        control = str(tmp_path / 'control.sock')
+        old = servers(8190, '--control-socket', control)
+        alice = connect(8190, "Alice")
+        assert alice.recv(1024) == b"[Server] Alice joined the chat!\n"
+
+        refused = []
+        prompts = []
+        stop = threading.Event()
+
+        def hammer():
+            while not stop.is_set():
+                try:
+                    with socket.create_connection(('127.0.0.1', 8190), timeout=3) as probe:
+                        prompts.append(probe.recv(1024))
+                except ConnectionRefusedError:
+                    refused.append(time.monotonic())
+
+        prober = threading.Thread(target=hammer)
+        prober.start()
+        new = servers(8190, '--takeover', control, '--control-socket', control)
+
+        # The old server hands over, tells its clients and drains
+        assert alice.recv(1024) == b"[Server] Server is restarting, please reconnect\n"
+        assert alice.recv(1024) == b""
+        assert old.wait(timeout=5) == 0
+        stop.set()
+        prober.join()
+
+        assert refused == []
+        assert prompts and set(prompts) == {b"Enter your name: "}
+        assert new.poll() is None
+        alice = connect(8190, "Alice")
+        assert alice.recv(1024) == b"[Server] Alice joined the chat!\n"
+
+        # SIGTERM drains too, and the control socket goes away
+        new.terminate()
+        assert alice.recv(1024) == b"[Server] Server is shutting down\n"
+        assert new.wait(timeout=5) == 0
+        assert not os.path.exists(control)
+        alice.close()
@@ -0,0 +1,41 @@
+import threading
+from shards import Shards
+
+
+class TestShards:
+
+    def test_jobs_run_in_order_per_shard(self):
+        shards = Shards(3).start()
+        seen = [[] for _ in range(3)]
+        for i in range(300):
+            shards.submit(i % 3, seen[i % 3].append, i)
+        assert shards.flush(2)
+        assert seen == [list(range(s, 300, 3)) for s in range(3)]
+        assert shards.backlog() == 0
+        shards.stop()
+
+    def test_jobs_run_on_shard_threads(self):
+        shards = Shards(2).start()
+        names = []
+        shards.submit(1, lambda: names.append(threading.current_thread().name))
+        shards.flush(2)
+        assert names == ["shard-1"]
+        shards.stop()
+
+    def test_failing_job_does_not_stop_its_shard(self):
+        shards = Shards(1).start()
+        seen = []
+        shards.submit(0, lambda: 1 / 0)
+        shards.submit(0, seen.append, "after")
+        assert shards.flush(2)
+        assert seen == ["after"]
+        shards.stop()
+
+    def test_stop_runs_what_is_queued(self):
+        shards = Shards(2).start()
+        seen = []
+        for i in range(100):
+            shards.submit(i % 2, seen.append, i)
+        shards.stop()
+        assert sorted(seen) == list(range(100))
+        assert not any(thread.is_alive() for thread in shards.threads)
@@ -0,0 +1,58 @@
+from timers import TimingWheel
+
+
+def make_wheel(slots=8):
+    wheel = TimingWheel(tick=1.0, slots=slots)
+    wheel.time = 0.0
+    return wheel
+
+
+class TestTimingWheel:
+
+    def test_fires_once_after_delay(self):
+        wheel = make_wheel()
+        fired = []
+        wheel.schedule(3, fired.append, 'a')
+
+        assert wheel.advance(2.9) == 0
+        assert wheel.advance(3.0) == 1
+        assert fired == ['a']
+        assert wheel.advance(20.0) == 0
+        assert len(wheel) == 0
+
+    def test_delays_longer_than_one_turn(self):
+        wheel = make_wheel(slots=8)
+        fired = []
+        for delay in (1, 8, 9, 17):
+            wheel.schedule(delay, fired.append, delay)
+
+        for now in range(1, 18):
+            wheel.advance(now)
+            assert fired == [d for d in (1, 8, 9, 17) if d <= now]
+
+    def test_cancel(self):
+        wheel = make_wheel()
+        fired = []
+        timer = wheel.schedule(2, fired.append, 'cancelled')
+        wheel.schedule(2, fired.append, 'kept')
+        assert len(wheel) == 2
+
+        wheel.cancel(timer)
+        wheel.cancel(timer)
+        assert len(wheel) == 1
+        wheel.advance(5)
+        assert fired == ['kept']
+
+    def test_callback_can_reschedule(self):
+        wheel = make_wheel()
+        fired = []
+
+        def again(n):
+            fired.append(n)
+            if n < 3:
+                wheel.schedule(1, again, n + 1)
+
+        wheel.schedule(1, again, 1)
+        for now in range(1, 6):
+            wheel.advance(now)
+        assert fired == [1, 2, 3]
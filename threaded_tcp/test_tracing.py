@@ -0,0 +1,62 @@
+import json
+import threading
+import time
+import metrics
+import tracing
+
+
+class TestTracer:
+
+    def test_stages_follow_each_other(self):
+        tracer = tracing.Tracer(sample=1.0)
+        assert not tracer.active()
+        tracer.begin()
+        assert tracer.active()
+        tracer.stage('decode')
+        tracer.stage('encode', room='lobby')
+        tracer.end()
+
+        decode, encode = tracer.events
+        assert (decode['name'], encode['name']) == ('decode', 'encode')
+        assert encode['ts'] >= decode['ts'] + decode['dur'] - 0.001
+        assert encode['args'] == {'room': 'lobby'}
+        assert not tracer.active()
+
+    def test_sample_rate(self):
+        assert not any(tracing.Tracer(sample=0).sampled() for _ in range(100))
+        assert all(tracing.Tracer(sample=1).sampled() for _ in range(100))
+
+    def test_ring_keeps_newest(self):
+        tracer = tracing.Tracer(max_events=2)
+        for name in ('a', 'b', 'c'):
+            tracer.span(name, 0.0, 1.0)
+        assert [event['name'] for event in tracer.events] == ['b', 'c']
+
+    def test_export_chrome_trace(self, tmp_path):
+        tracer = tracing.Tracer()
+        now = time.perf_counter()
+        tracer.span('send', now, now + 0.002, bytes=10)
+        path = tmp_path / 'trace.json'
+
+        assert tracer.export(str(path)) == 1
+        events = json.loads(path.read_text())['traceEvents']
+        thread, send = events
+        assert thread['ph'] == 'M' and thread['args']['name'] == threading.current_thread().name
+        assert send['ph'] == 'X' and send['tid'] == thread['tid']
+        assert abs(send['dur'] - 2000) < 1
+
+
+class TestTracedLock:
+
+    def test_lock_spans_only_while_tracing(self):
+        lock = metrics.TimedLock(metrics.Histogram(), metrics.Histogram(), 'test_lock')
+        with lock:
+            pass
+        tracer = tracing.start(sample=1.0)
+        try:
+            with lock:
+                pass
+        finally:
+            tracing.stop()
+        assert [event['name'] for event in tracer.events] == ['test_lock wait', 'test_lock hold']
+        assert lock.hold.count == 2
@@ -0,0 +1,94 @@
+"""Hashed timing wheel for large numbers of coarse timers
+
+Timers hash into one of `slots` buckets by expiry tick; a bucket far in
+the future also records how many full turns of the wheel to wait. A
+single thread advances one tick at a time and fires what is due, so
+scheduling and cancelling are O(1) whatever the number of timers, at
+the cost of one tick of precision.
+"""
+import logging
+import threading
+import time
+
+
+log = logging.getLogger('chat_server')
+
+
+class Timer:
+    __slots__ = ('callback', 'args', 'slot', 'rounds')
+
+    def __init__(self, callback, args):
+        self.callback = callback
+        self.args = args
+
+
+class TimingWheel:
+    """Fires callback(*args) about delay seconds after schedule()
+
+    Callbacks run on the wheel's thread, outside its lock, so they may
+    schedule or cancel timers themselves. They should be quick.
+    """
+
+    def __init__(self, tick=0.5, slots=512):
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)]  # {Timer: None}, an ordered set
+        self.current = 0  # slot of the last tick processed
+        self.time = time.monotonic()  # when that tick ended
+        self.count = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def __len__(self):
+        return self.count
+
+    def schedule(self, delay, callback, *args):
+        timer = Timer(callback, args)
+        ticks = max(1, -int(-delay // self.tick))  # round up: never fire early
+        with self.lock:
+            timer.slot = (self.current + ticks) % len(self.slots)
+            timer.rounds = (ticks - 1) // len(self.slots)
+            self.slots[timer.slot][timer] = None
+            self.count += 1
+        return timer
+
+    def cancel(self, timer):
+        """Stop timer from firing; harmless if it already has"""
+        with self.lock:
+            if self.slots[timer.slot].pop(timer, 0) is None:
+                self.count -= 1
+
+    def advance(self, now):
+        """Fire every timer due by now"""
+        due = []
+        with self.lock:
+            while self.time + self.tick <= now:
+                self.time += self.tick
+                self.current = (self.current + 1) % len(self.slots)
+                bucket = self.slots[self.current]
+                for timer in list(bucket):
+                    if timer.rounds:
+                        timer.rounds -= 1
+                    else:
+                        del bucket[timer]
+                        due.append(timer)
+            self.count -= len(due)
+        for timer in due:
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                log.exception("Timer callback %r failed", timer.callback)
+        return len(due)
+
+    def start(self):
+        """Advance the wheel from a daemon thread (once, however often it is called)"""
+        with self.lock:
+            if self.thread is None:
+                self.time = time.monotonic()
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            self.advance(time.monotonic())
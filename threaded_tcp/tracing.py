@@ -0,0 +1,89 @@
+"""Sampled spans of the message path, exported as a Chrome trace
+
+Tracing is off unless start() installs a Tracer; until then every hook
+costs one attribute check. Once on, each message read from a client is
+sampled with probability `sample`. For a sampled message the reading
+thread records its stages (recv, decode, encode, fan_out) as spans,
+each one ending where the next begins. Writer threads sample their
+batches the same way (time queued, compress, send), and
+metrics.TimedLock records sampled wait and hold spans.
+
+Spans go to a bounded in-memory ring. export() writes it in the Chrome
+trace event format, which chrome://tracing and https://ui.perfetto.dev
+load directly.
+"""
+import collections
+import json
+import os
+import random
+import threading
+import time
+
+
+SAMPLE = 0.01  # fraction of messages traced
+MAX_EVENTS = 100000  # spans kept, newest first to go
+
+tracer = None  # the installed Tracer, or None while tracing is off
+
+
+class Message(threading.local):
+    mark = None  # per thread: end of the sampled message's last stage, if any
+
+
+class Tracer:
+
+    def __init__(self, sample=SAMPLE, max_events=MAX_EVENTS):
+        self.sample = sample
+        self.events = collections.deque(maxlen=max_events)
+        self.threads = {}  # {thread id: name}
+        self.local = Message()
+        self.origin = time.perf_counter()
+
+    def sampled(self):
+        return random.random() < self.sample
+
+    def begin(self):
+        """Trace the message the current thread is about to handle"""
+        self.local.mark = time.perf_counter()
+
+    def end(self):
+        self.local.mark = None
+
+    def active(self):
+        """Whether the current thread is handling a sampled message"""
+        return self.local.mark is not None
+
+    def stage(self, name, **args):
+        """Record the time since begin() or the previous stage as a span called name"""
+        now = time.perf_counter()
+        self.span(name, self.local.mark, now, **args)
+        self.local.mark = now
+
+    def span(self, name, start, end, **args):
+        """Record a stage that ran from start to end (time.perf_counter() values)"""
+        tid = threading.get_ident()
+        if tid not in self.threads:
+            self.threads[tid] = threading.current_thread().name
+        self.events.append({
+            'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': tid,
+            'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6, 'args': args,
+        })
+
+    def export(self, path):
+        """Write the spans recorded so far to path as Chrome trace JSON; how many"""
+        events = list(self.events)
+        names = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid,
+                  'args': {'name': name}} for tid, name in list(self.threads.items())]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': names + events, 'displayTimeUnit': 'ms'}, f)
+        return len(events)
+
+
+def start(sample=SAMPLE, max_events=MAX_EVENTS):
+    global tracer
+    tracer = Tracer(sample, max_events)
+    return tracer
+
+def stop():
+    global tracer
+    tracer = None